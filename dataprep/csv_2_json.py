@@ -1,40 +1,86 @@
 import argparse
 import csv
 import json
+import os
 import sys
-from collections import defaultdict
 
-from mer.utils import calculate_wer, get_sentences
+from mer.utils import Alignment, iter_chunks
+from mer.wer import get_wer_pool
 
+REFERENCE_COLUMN = "content"
+RECOGNISED_COLUMN = "amazon_transcription"
 
-def csv_2_json(csv_path, json_path):
+
+def convert_row(indexed_row):
+    """Split one transcript into per sentence examples, keeping the row's other columns (e.g. speaker) as metadata"""
+    row_index, row = indexed_row
+    metadata = {"row": row_index}
+    metadata.update((k, v) for k, v in row.items() if k not in (REFERENCE_COLUMN, RECOGNISED_COLUMN))
+
+    examples = []
+    # get reference and recognised transcripts, align once and split them on a per sentence basis
+    for sentence_index, sentence in enumerate(Alignment(row[REFERENCE_COLUMN], row[RECOGNISED_COLUMN]).get_sentences()):
+        ref, rec = sentence.ref_text, sentence.rec_text
+        wer_results = sentence.get_wer()
+        if wer_results[1] == 0 or rec in ".?!" or rec == ref:
+            # This means the reference or recognised is empty. Ignore these test cases.
+            continue
+        examples.append(
+            {
+                "reference": ref,
+                "recognised": rec,
+                "mimir": wer_results[2]["comparison"],
+                "minor": "",
+                "standard": "",
+                "serious": "",
+                "metadata": {**metadata, "sentence": sentence_index},
+            }
+        )
+    return examples
+
+
+def csv_2_json(csv_path, json_path, jsonl=False, processes=None, chunk_size=1000):
+    """
+    Rows are read chunk_size at a time and fanned out over a process pool, with examples written out as each
+    chunk finishes so memory stays bounded however big the CSV is. The json output is written incrementally too.
+    """
     csv_reader = csv.DictReader(csv_path, delimiter=",")
-    sentences_dict = defaultdict(list)
-    for row in csv_reader:
-        # get reference and recognised transcripts, align and split them on a per sentence basis
-        ref_text, rec_text = get_sentences(row["content"], row["amazon_transcription"])
-        for ref, rec in zip(ref_text, rec_text):
-            wer_results = calculate_wer(ref, rec)
-            if wer_results[1] == 0 or rec in ".?!" or rec == ref:
-                # This means the reference or recognised is empty. Ignore these test cases.
-                continue
-            sentences_dict["examples"].append(
-                {
-                    "reference": ref,
-                    "recognised": rec,
-                    "mimir": wer_results[2]["comparison"],
-                    "minor": "",
-                    "standard": "",
-                    "serious": "",
-                }
-            )
-
-    json.dump(sentences_dict, json_path, indent=2)
+    processes = processes or os.cpu_count() or 1
+    pool = get_wer_pool(processes)
+
+    def map_rows(chunk):
+        if pool is None:
+            return map(convert_row, chunk)
+        # Send each worker a few batches of rows rather than one row per round trip
+        return pool.map(convert_row, chunk, chunksize=max(1, len(chunk) // (4 * processes)))
+
+    first = True
+    if not jsonl:
+        json_path.write('{\n  "examples": [')
+    try:
+        for chunk in iter_chunks(enumerate(csv_reader), chunk_size):
+            for examples in map_rows(chunk):
+                for example in examples:
+                    if jsonl:
+                        json_path.write(json.dumps(example) + "\n")
+                        continue
+                    json_path.write(("\n" if first else ",\n") + json.dumps(example, indent=2))
+                    first = False
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    if not jsonl:
+        json_path.write("\n  ]\n}\n")
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--csv_path", type=argparse.FileType("r"))
     parser.add_argument("--json_out_path", type=argparse.FileType("w"), default=sys.stdout)
+    parser.add_argument("--jsonl", action="store_true", help="write one example per line instead of a json object")
+    parser.add_argument("--processes", type=int, default=None, help="number of processes to align rows with")
+    parser.add_argument("--chunk_size", type=int, default=1000, help="number of csv rows to read at once")
     args = parser.parse_args()
-    csv_2_json(args.csv_path, args.json_out_path)
+    csv_2_json(
+        args.csv_path, args.json_out_path, jsonl=args.jsonl, processes=args.processes, chunk_size=args.chunk_size
+    )
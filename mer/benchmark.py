@@ -0,0 +1,160 @@
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import random
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from mer.mer import get_meaning_error_rate
+from mer.mockserver import MockCompletionServer
+
+VOCABULARY = (
+    "the a to of and in that is it for on you with was as have be at this are we but not they his from she "
+    "by or one had what all were when there can an your which their said if do will each about how up out "
+    "them then many some so these would other into has more her two like him see time could no make than "
+    "first been its who now people my made over did down only way find use may water long little very after"
+).split()
+
+
+def recognise_word(rng, word, word_error_rate=0.1):
+    """Recognised words for a reference word, deleted, substituted or followed by an insertion at word_error_rate"""
+    draw = rng.random()
+    if draw < word_error_rate / 3:
+        return []
+    if draw < 2 * word_error_rate / 3:
+        return [rng.choice(VOCABULARY)]
+    if draw < word_error_rate:
+        return [word, rng.choice(VOCABULARY)]
+    return [word]
+
+
+def get_synthetic_examples(size, word_error_rate=0.1, seed=0):
+    """Reference/recognised pairs with random substitutions, deletions and insertions at about word_error_rate"""
+    rng = random.Random(seed)
+    examples = []
+    for _ in range(size):
+        ref_words = rng.choices(VOCABULARY, k=rng.randint(6, 24))
+        rec_words = [rec_word for word in ref_words for rec_word in recognise_word(rng, word, word_error_rate)]
+        examples.append({"reference": " ".join(ref_words), "recognised": " ".join(rec_words)})
+    return examples
+
+
+def read_usage(output_json):
+    """Usage and summary blocks of a json output, or the last line of a JSONL one written in stream mode"""
+    with open(output_json, "r", encoding="utf-8") as f:
+        if output_json.endswith(".jsonl"):
+            *_, last_line = f
+            return json.loads(last_line)
+        return json.load(f)
+
+
+def run_benchmark(api_base, prompt_config_path, size, concurrency, num_samples, batch_size, stream, seed):
+    """One end to end run in a fresh process so its peak memory isn't mixed up with other runs"""
+    examples = get_synthetic_examples(size, seed=seed)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        output_json = os.path.join(tmp_dir, "results.jsonl" if stream else "results.json")
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            meaning_error_rate, _ = get_meaning_error_rate(
+                iter(examples) if stream else examples,
+                prompt_config_path,
+                output_json,
+                api_key="mock",
+                api_base=api_base,
+                num_samples=num_samples,
+                concurrency=concurrency,
+                batch_size=batch_size,
+                max_budget=float("inf"),
+                stream=stream,
+                wer_processes=1,
+            )
+        wall_time = time.perf_counter() - start
+        output = read_usage(output_json)
+
+    total_tokens = output["usage"]["total_tokens"]
+    return {
+        "size": size,
+        "concurrency": concurrency,
+        "wall_time": round(wall_time, 4),
+        "utterances_per_second": round(size / wall_time, 2),
+        "tokens_per_second": round(total_tokens / wall_time, 2),
+        "total_tokens": total_tokens,
+        "retries": output["usage"]["retries"],
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "meaning_error_rate": round(meaning_error_rate, 2),
+    }
+
+
+def benchmark(
+    sizes,
+    concurrency_levels,
+    prompt_config_path="./config/prompt_multiple.json",
+    num_samples=3,
+    batch_size=1,
+    stream=False,
+    seed=0,
+    **server_kwargs,
+):
+    """Score synthetic corpora of each size at each concurrency level against a local mock completion server"""
+    results = []
+    with MockCompletionServer(seed=seed, **server_kwargs) as server:
+        for size in sizes:
+            for concurrency in concurrency_levels:
+                args = (server.api_base, prompt_config_path, size, concurrency, num_samples, batch_size, stream, seed)
+                with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    result = executor.submit(run_benchmark, *args).result()
+                print(
+                    f"size {size:>6} concurrency {concurrency:>4}: {result['utterances_per_second']:>8.2f} utt/s "
+                    f"{result['tokens_per_second']:>10.2f} tokens/s, {result['retries']} retries, "
+                    f"peak RSS {result['peak_rss_mb']} MB"
+                )
+                results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    # pylint: disable=line-too-long
+    # fmt: off
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000], help="number of utterances in each synthetic corpus")  # noqa:  E201
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="concurrency levels to run each corpus at")  # noqa:  E201
+    parser.add_argument("--prompt_config_path", type=str, default="./config/prompt_multiple.json", help="path to prompt config json")  # noqa:  E201
+    parser.add_argument("--num_samples", type=int, default=3, help="number of samples per utterance")  # noqa:  E201
+    parser.add_argument("--batch_size", type=int, default=1, help="utterances packed into each prompt")  # noqa:  E201
+    parser.add_argument("--stream", action="store_true", help="score in stream mode")  # noqa:  E201
+    parser.add_argument("--latency", type=float, default=0.5, help="median seconds the mock server takes per request")  # noqa:  E201
+    parser.add_argument("--latency_sigma", type=float, default=0.5, help="spread of the log-normal latency, 0 for constant")  # noqa:  E201
+    parser.add_argument("--error_rate", type=float, default=0.0, help="fraction of requests answered with a server error")  # noqa:  E201
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="fraction of requests answered with a 429")  # noqa:  E201
+    parser.add_argument("--truncation_rate", type=float, default=0.0, help="fraction of continuations cut off before the result line")  # noqa:  E201
+    parser.add_argument("--seed", type=int, default=0, help="seed for the synthetic corpus and mock server")  # noqa:  E201
+    parser.add_argument("--output_json", type=str, default=None, help="path to save the benchmark results")  # noqa:  E201
+    # fmt: on
+    args = parser.parse_args()
+
+    results = benchmark(
+        args.sizes,
+        args.concurrency,
+        prompt_config_path=args.prompt_config_path,
+        num_samples=args.num_samples,
+        batch_size=args.batch_size,
+        stream=args.stream,
+        seed=args.seed,
+        latency=args.latency,
+        latency_sigma=args.latency_sigma,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        truncation_rate=args.truncation_rate,
+    )
+    if args.output_json:
+        with open(args.output_json, "w", encoding="utf-8") as f:
+            json.dump({"results": results}, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
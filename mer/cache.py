@@ -0,0 +1,168 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join("~", ".cache", "mer", "continuations.db")
+# Once full the cache is evicted down to this fraction of max_size so it isn't scanned again on every put
+EVICTION_LOW_WATER = 0.9
+# Least recently used entries are looked up this many at a time while evicting
+EVICTION_BATCH_SIZE = 256
+
+
+class ContinuationCache:
+    """
+    On disk cache of LM continuations keyed by a hash of everything that affects the request
+    (endpoint, model, full prompt string, temperature, max_tokens and num_samples). Least recently used
+    entries are evicted once the cache grows beyond max_size_mb.
+    """
+
+    def __init__(self, cache_path=DEFAULT_CACHE_PATH, max_size_mb=512):
+        self.cache_path = os.path.expanduser(cache_path)
+        self.max_size = None if max_size_mb is None else int(max_size_mb * 1024 * 1024)
+        if os.path.dirname(self.cache_path):
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+
+        # Connections can be shared between threads (e.g. a service's event loop thread and the one that built it)
+        # so every use of the connection holds the lock
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(self.cache_path, isolation_level=None, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS continuations (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                value TEXT,
+                size INTEGER,
+                created REAL,
+                accessed REAL
+            )"""
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS accessed_index ON continuations (accessed)")
+        self.size = self.stats()["size"]
+        self.hits, self.misses = 0, 0
+
+    @staticmethod
+    def get_key(model, prompt, temperature, max_tokens, num_samples, sample_round=0, api_base=None):
+        request = [model, prompt, temperature, max_tokens, num_samples]
+        if sample_round:
+            request.append(sample_round)
+        if api_base is not None:
+            # Continuations from another endpoint (e.g. a local stand-in) must never be served to real runs
+            request.append({"api_base": api_base})
+        request = json.dumps(request, ensure_ascii=False)
+        return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+    def __contains__(self, key):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM continuations WHERE key = ?", (key,)).fetchone() is not None
+
+    def get(self, key):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM continuations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute("UPDATE continuations SET accessed = ? WHERE key = ?", (time.time(), key))
+            return json.loads(row[0])
+
+    def put(self, key, model, value):
+        with self.lock:
+            value = json.dumps(value, ensure_ascii=False)
+            size = len(key) + len(value.encode("utf-8"))
+            now = time.time()
+            old = self.conn.execute("SELECT size FROM continuations WHERE key = ?", (key,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO continuations VALUES (?, ?, ?, ?, ?, ?)", (key, model, value, size, now, now)
+            )
+            self.size += size - (old[0] if old else 0)
+            if self.max_size is not None and self.size > self.max_size:
+                self.evict(int(self.max_size * EVICTION_LOW_WATER))
+
+    def evict(self, max_size, batch_size=EVICTION_BATCH_SIZE):
+        """Delete least recently used entries until the cache is no bigger than max_size bytes"""
+        with self.lock:
+            removed = 0
+            while self.size > max_size:
+                rows = self.conn.execute(
+                    "SELECT key, size FROM continuations ORDER BY accessed ASC LIMIT ?", (batch_size,)
+                ).fetchall()
+                if not rows:
+                    break
+                to_delete = []
+                for key, size in rows:
+                    if self.size <= max_size:
+                        break
+                    to_delete.append((key,))
+                    self.size -= size
+                self.conn.executemany("DELETE FROM continuations WHERE key = ?", to_delete)
+                removed += len(to_delete)
+            return removed
+
+    def prune(self, max_size_mb=None, older_than_days=None, model=None):
+        with self.lock:
+            removed = 0
+            if model is not None:
+                removed += self.conn.execute("DELETE FROM continuations WHERE model = ?", (model,)).rowcount
+            if older_than_days is not None:
+                cutoff = time.time() - older_than_days * 24 * 60 * 60
+                removed += self.conn.execute("DELETE FROM continuations WHERE accessed < ?", (cutoff,)).rowcount
+            self.size = self.stats()["size"]
+            if max_size_mb is not None:
+                removed += self.evict(int(max_size_mb * 1024 * 1024))
+            self.conn.execute("VACUUM")
+            return removed
+
+    def stats(self):
+        with self.lock:
+            entries, size, oldest, newest = self.conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), MIN(accessed), MAX(accessed) FROM continuations"
+            ).fetchone()
+            per_model = dict(self.conn.execute("SELECT model, COUNT(*) FROM continuations GROUP BY model").fetchall())
+            return {"entries": entries, "size": size, "oldest": oldest, "newest": newest, "models": per_model}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def print_stats(stats):
+    print(f"entries: {stats['entries']}, size: {stats['size'] / 1024 / 1024:.2f}MB")
+    for timestamp in ["oldest", "newest"]:
+        if stats[timestamp] is not None:
+            print(f"{timestamp} access: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(stats[timestamp]))}")
+    for model, count in stats["models"].items():
+        print(f"  {model}: {count} entries")
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Inspect and prune the continuation cache")
+    # pylint: disable=line-too-long
+    # fmt: off
+    parser.add_argument("command", choices=["stats", "prune", "clear"], help="stats to inspect the cache, prune to evict entries, clear to remove everything")  # noqa:  E201
+    parser.add_argument("--cache_path", type=str, default=DEFAULT_CACHE_PATH, help="path to sqlite continuation cache")  # noqa:  E201
+    parser.add_argument("--max_size_mb", type=float, default=None, help="evict least recently used entries until cache is below this size")  # noqa:  E201
+    parser.add_argument("--older_than_days", type=float, default=None, help="evict entries not used in this many days")  # noqa:  E201
+    parser.add_argument("--model", type=str, default=None, help="evict entries for this model")  # noqa:  E201
+    # fmt: on
+    args = parser.parse_args()
+
+    cache = ContinuationCache(args.cache_path, max_size_mb=None)
+    if args.command == "prune":
+        removed = cache.prune(max_size_mb=args.max_size_mb, older_than_days=args.older_than_days, model=args.model)
+        print(f"Removed {removed} entries")
+    elif args.command == "clear":
+        removed = cache.prune(max_size_mb=0)
+        print(f"Removed {removed} entries")
+    print_stats(cache.stats())
+    cache.close()
+
+
+if __name__ == "__main__":
+    main()
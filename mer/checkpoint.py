@@ -0,0 +1,79 @@
+import json
+import os
+from collections import Counter, defaultdict
+
+
+class Checkpoint:
+    """
+    Append only JSONL log of LM responses keyed by the request hash. Each line is written as soon as a
+    prompt's continuations arrive so that a crash or Ctrl-C loses nothing that has already been paid for.
+    Only the file offset of each record and the running token usage are kept in memory.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        self.offsets = {}
+        self.usage = Counter()
+        self.model_usage = defaultdict(Counter)
+        if resume:
+            self.load()
+        elif os.path.exists(self.path):
+            os.remove(self.path)
+        self.f = None
+
+    def __contains__(self, key):
+        return key in self.offsets
+
+    def __getitem__(self, key):
+        with open(self.path, "rb") as f:
+            f.seek(self.offsets[key])
+            return json.loads(f.readline())
+
+    def load(self):
+        """Index completed records by request hash, skipping a partially written last line"""
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            offset = 0
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    offset += len(line)
+                    continue
+                self.add_record(record, offset)
+                offset += len(line)
+
+    def add_record(self, record, offset):
+        # A repeated request replaces the earlier response but both were paid for
+        self.usage.update(record["usage"])
+        self.model_usage[record.get("model")].update(record["usage"])
+        self.offsets[record["key"]] = offset
+
+    def append(self, key, continuations, usage, model=None):
+        if self.f is None:
+            partial_line = False
+            if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+                with open(self.path, "rb") as f:
+                    f.seek(-1, os.SEEK_END)
+                    partial_line = f.read(1) != b"\n"
+            self.f = open(self.path, "ab")  # pylint: disable=consider-using-with
+            # Start on a fresh line if the previous run died part way through writing one
+            if partial_line:
+                self.f.write(b"\n")
+        record = {"key": key, "continuations": continuations, "usage": dict(usage), "model": model}
+        offset = self.f.tell()
+        self.f.write((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"))
+        self.f.flush()
+        self.add_record(record, offset)
+
+    def get_usage(self, field="total_tokens", model=None):
+        """Token usage over every response in the checkpoint (or just one model's), including ones from earlier runs"""
+        if model is not None:
+            return self.model_usage[model][field]
+        return self.usage[field]
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
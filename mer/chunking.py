@@ -0,0 +1,63 @@
+import json
+from collections import defaultdict
+
+from mer.utils import Alignment, calculate_meaning_error_rate
+
+# Cap on aligned words in a unit so prompts stay bounded when a transcript has little or no punctuation
+DEFAULT_MAX_WORDS = 50
+
+
+def split_examples(examples, max_words=DEFAULT_MAX_WORDS):
+    """
+    Lazily split each long-form example into aligned sentence units that are scored as independent utterances.
+    Each unit's metadata records the file it came from so results can be put back together afterwards.
+    """
+    for file_index, example in enumerate(examples):
+        alignment = Alignment(example["reference"], example["recognised"])
+        for sentence_index, sentence in enumerate(alignment.get_sentences(keep_remainder=True, max_words=max_words)):
+            metadata = {**example.get("metadata", {}), "file_index": file_index, "sentence": sentence_index}
+            yield {"reference": sentence.ref_text, "recognised": sentence.rec_text, "metadata": metadata}
+
+
+def read_results(output_path, stream=False):
+    """Per-utterance results from a json output, or a JSONL one written in stream mode (last line is the summary)"""
+    with open(output_path, "r", encoding="utf-8") as f:
+        if not stream:
+            yield from json.load(f)["results"]
+            return
+        previous = None
+        for line in f:
+            if previous is not None:
+                yield previous
+            previous = json.loads(line)
+
+
+def aggregate_files(results):
+    """Sum the penalties, errors and reference counts of the sentence units back up to one result per file"""
+    files = defaultdict(lambda: {"sentences": 0, "reference_count": 0, "errors": 0, "penalty": 0.0})
+    for result in results:
+        metadata = result["metadata"]
+        file_result = files[metadata["file_index"]]
+        file_result.update((k, v) for k, v in metadata.items() if k not in ("file_index", "sentence"))
+        file_result["sentences"] += 1
+        file_result["reference_count"] += result["reference_count"]
+        file_result["errors"] += result.get("insertions", 0) + result.get("deletions", 0) + result.get("substitions", 0)
+        file_result["penalty"] += result["voted_penality"]
+
+    file_results = []
+    for file_index in sorted(files):
+        file_result = {"file_index": file_index, **files[file_index]}
+        reference_count = file_result["reference_count"]
+        if reference_count:
+            file_result["wer"] = round(100 * file_result["errors"] / reference_count, 2)
+            mer = calculate_meaning_error_rate(reference_count, file_result["penalty"])
+            file_result["meaning_error_rate"] = round(mer, 2)
+        file_results.append(file_result)
+    return file_results
+
+
+def save_file_results(output_path, files_json, stream=False):
+    file_results = aggregate_files(read_results(output_path, stream))
+    with open(files_json, "w", encoding="utf-8") as f:
+        json.dump({"files": file_results}, f, indent=4)
+    return file_results
@@ -0,0 +1,73 @@
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiohttp
+import openai
+
+from mer.ratelimit import SpendCapReached
+
+
+@asynccontextmanager
+async def pooled_session(concurrency=1):
+    """Share one keep-alive connection pool between all open ai requests made inside this context"""
+    connector = aiohttp.TCPConnector(limit=max(concurrency, 1), keepalive_timeout=60)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        token = openai.aiosession.set(session)
+        try:
+            yield session
+        finally:
+            openai.aiosession.reset(token)
+
+
+async def run_in_order(worker, items, concurrency=1, on_result=None):
+    """
+    Run the async worker over every item with at most `concurrency` calls in flight.
+    Results are returned in the same order as the input items regardless of completion order.
+    on_result(index, result) is called as soon as each result arrives. If the spend cap is reached the
+    remaining items aren't started and their results are None.
+    """
+    assert concurrency >= 1, "Concurrency must be at least 1"
+    items = list(items)
+    results = [None] * len(items)
+    queue = iter(enumerate(items))
+
+    async def consume():
+        # Each consumer pulls the next item as soon as its previous request finishes
+        for index, item in queue:
+            try:
+                results[index] = await worker(item)
+            except SpendCapReached:
+                # Stop admitting new work, items that never ran are left as None
+                return
+            if on_result is not None:
+                on_result(index, results[index])
+
+    async with pooled_session(concurrency):
+        await asyncio.gather(*(consume() for _ in range(min(concurrency, len(items)) or 1)))
+    return results
+
+
+def map_in_order(worker, items, concurrency=1):
+    """Blocking wrapper around run_in_order for calling from synchronous code"""
+    return asyncio.run(run_in_order(worker, items, concurrency=concurrency))
+
+
+async def get_continuations_async(
+    lm, prompt_strings, num_samples=1, concurrency=1, on_result=None, max_tokens=64, sample_round=0
+):
+    async def worker(prompt_string):
+        return await lm.get_continuation_async(
+            prompt_string, max_tokens=max_tokens, num_samples=num_samples, sample_round=sample_round
+        )
+
+    return await run_in_order(worker, prompt_strings, concurrency=concurrency, on_result=on_result)
+
+
+def get_continuations(lm, prompt_strings, num_samples=1, concurrency=1, on_result=None, max_tokens=64, sample_round=0):
+    """
+    Get continuations for a list of prompts keeping many requests in flight at once.
+    Returns a list of (continuations, response) tuples in the same order as prompt_strings.
+    """
+    return asyncio.run(
+        get_continuations_async(lm, prompt_strings, num_samples, concurrency, on_result, max_tokens, sample_round)
+    )
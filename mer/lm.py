@@ -1,7 +1,12 @@
+import asyncio
 import os
+import time
 
 import openai
 
+from mer.cache import ContinuationCache
+from mer.ratelimit import RateLimiter, get_retry_delay, is_retryable
+
 # Cost for 1k tokens for each model
 models2cost = {
     "gpt-3.5-turbo": 0.0020,
@@ -18,8 +23,28 @@ class LanguageModel:
     LM object that handles the open AI API and response given a prompt.
     """
 
-    def __init__(self, model="text-davinci-002", api_key=None):
+    def __init__(
+        self,
+        model="text-davinci-002",
+        api_key=None,
+        api_base=None,
+        cache=None,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        max_retries=6,
+        backoff_base=1.0,
+        spend_cap=None,
+        metrics=None,
+    ):
         self.model = model
+        self.api_base = api_base  # None uses the default open ai endpoint
+        self.cache = cache  # ContinuationCache consulted before every request
+        self.rate_limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base  # seconds to wait before the first retry, doubling each time
+        self.retries = 0
+        self.spend_cap = spend_cap  # SpendCap checked before admitting each request
+        self.metrics = metrics  # Metrics recording the latency and tokens of each request, None when off
         assert model in models2cost, f"Model {model} not supported"
 
         # Use api key passed in or environment variable if not
@@ -30,35 +55,131 @@ class LanguageModel:
         assert self.api_key != "", "Pass api_key or set OPENAI_API_KEY evironment variable"
         openai.api_key = self.api_key
 
-    def get_continuation(self, prompt, temperature=0.7, max_tokens=64, num_samples=1):
-        response = openai.Completion.create(
-            model=self.model,
-            prompt=prompt,
-            temperature=temperature,
-            max_tokens=max_tokens,
-            top_p=1.0,
-            best_of=num_samples,
-            n=num_samples,
+    def get_continuation(self, prompt, temperature=0.7, max_tokens=64, num_samples=1, sample_round=0):
+        key = self.get_cache_key(prompt, temperature, max_tokens, num_samples, sample_round)
+        cached = self.load_from_cache(key)
+        if cached is not None:
+            return cached
+
+        if self.spend_cap is not None:
+            self.spend_cap.admit()
+        estimated_tokens = self.estimate_tokens(prompt, max_tokens, num_samples)
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.rate_limiter.reserve(estimated_tokens))
+            start = time.perf_counter()
+            try:
+                response = openai.Completion.create(**self.get_request(prompt, temperature, max_tokens, num_samples))
+                break
+            except openai.error.OpenAIError as e:
+                time.sleep(self.get_retry_delay(e, attempt))
+
+        self.rate_limiter.refund(estimated_tokens - response["usage"]["total_tokens"])
+        if self.metrics is not None:
+            self.metrics.record_request(time.perf_counter() - start, response["usage"]["total_tokens"])
+        if self.spend_cap is not None:
+            self.spend_cap.add(response["usage"]["total_tokens"], models2cost[self.model])
+        return self.save_to_cache(key, response)
+
+    async def get_continuation_async(self, prompt, temperature=0.7, max_tokens=64, num_samples=1, sample_round=0):
+        """Same as get_continuation but awaits the request so many can be in flight at once"""
+        key = self.get_cache_key(prompt, temperature, max_tokens, num_samples, sample_round)
+        cached = self.load_from_cache(key)
+        if cached is not None:
+            return cached
+
+        if self.spend_cap is not None:
+            self.spend_cap.admit()
+        estimated_tokens = self.estimate_tokens(prompt, max_tokens, num_samples)
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(self.rate_limiter.reserve(estimated_tokens))
+            start = time.perf_counter()
+            try:
+                response = await openai.Completion.acreate(
+                    **self.get_request(prompt, temperature, max_tokens, num_samples)
+                )
+                break
+            except openai.error.OpenAIError as e:
+                await asyncio.sleep(self.get_retry_delay(e, attempt))
+
+        self.rate_limiter.refund(estimated_tokens - response["usage"]["total_tokens"])
+        if self.metrics is not None:
+            self.metrics.record_request(time.perf_counter() - start, response["usage"]["total_tokens"])
+        if self.spend_cap is not None:
+            self.spend_cap.add(response["usage"]["total_tokens"], models2cost[self.model])
+        return self.save_to_cache(key, response)
+
+    def get_request(self, prompt, temperature, max_tokens, num_samples):
+        return {
+            "model": self.model,
+            "prompt": prompt,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": 1.0,
+            "best_of": num_samples,
+            "n": num_samples,
+            "api_base": self.api_base,
+        }
+
+    def get_retry_delay(self, error, attempt):
+        """Seconds to wait before retrying, re-raising the error if it can't be retried"""
+        if attempt >= self.max_retries or not is_retryable(error):
+            raise error
+        self.retries += 1
+        if self.metrics is not None:
+            self.metrics.retries += 1
+        delay = get_retry_delay(error, attempt, backoff_base=self.backoff_base)
+        print(f"WARNING: {type(error).__name__} from API ({error}), retrying in {delay:.1f}s")
+        return delay
+
+    @staticmethod
+    def estimate_tokens(prompt, max_tokens=64, num_samples=1):
+        # Rate limits count the max_tokens of every sample against the quota, each token is ~4 chars
+        return len(prompt) // 4 + max_tokens * num_samples
+
+    def get_cache_key(self, prompt, temperature=0.7, max_tokens=64, num_samples=1, sample_round=0):
+        # sample_round tells apart repeated requests for extra samples of the same prompt
+        return ContinuationCache.get_key(
+            self.model, prompt, temperature, max_tokens, num_samples, sample_round, api_base=self.api_base
         )
 
+    def is_cached(self, prompt, temperature=0.7, max_tokens=64, num_samples=1, sample_round=0):
+        if self.cache is None:
+            return False
+        return self.get_cache_key(prompt, temperature, max_tokens, num_samples, sample_round) in self.cache
+
+    def load_from_cache(self, key):
+        if self.cache is None:
+            return None
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+        if self.metrics is not None:
+            self.metrics.cache_hits += 1
+        # Nothing is spent on a cache hit so report zero usage for cost accounting
+        response = {
+            "choices": [{"text": text} for text in cached["continuations"]],
+            "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            "cached_usage": cached["usage"],
+        }
+        return cached["continuations"], response
+
+    def save_to_cache(self, key, response):
+        continuations = self.unpack_response(response)
+        if self.cache is not None:
+            self.cache.put(key, self.model, {"continuations": continuations, "usage": dict(response["usage"])})
+        return continuations, response
+
+    @staticmethod
+    def unpack_response(response):
         continuations = []
         for item in response["choices"]:
             text = item["text"].strip()
             assert text is not None
-            continuations.append(item["text"].strip())
-
-        return continuations, response
+            continuations.append(text)
+        return continuations
 
     def print_actual_cost(self, tokens):
         cost = models2cost[self.model] * tokens / 1000
-        print(f"COST: #tokens: {tokens}, cost: ${cost:.2f}, runs/$: {1/cost:.1f}")
-        return round(cost, 2)
-
-    def print_estimated_cost(self, prompt, num_samples=1):
-        # Find estimate number of tokens based on prompt
-        approx_completion_tokens = 25 * num_samples  # based on ~100 char continuation, ~20 words
-        approx_prompt_tokens = len(prompt) / 4  # each token is approximately 4 chars
-        tokens = approx_prompt_tokens + approx_completion_tokens
-        cost = models2cost[self.model] * tokens / 1000
-        print(f"COST: #char: {len(prompt)}, #tokens: {tokens}, cost: ${cost:.2f}, runs/$: {1/cost:.1f}")
+        runs_per_dollar = f"{1/cost:.1f}" if cost else "inf"
+        print(f"COST: #tokens: {tokens}, cost: ${cost:.2f}, runs/$: {runs_per_dollar}")
         return round(cost, 2)
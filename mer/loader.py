@@ -0,0 +1,80 @@
+import os
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Opening lots of small files is dominated by latency (especially on network storage) so read many at once
+DEFAULT_THREADS = 32
+TRANSCRIPT_DIRS = ("reference", "recognised")
+
+
+def read_dbl(dbl):
+    """Paths listed in a dbl file, ignoring blank lines such as a trailing newline"""
+    return [line.strip() for line in dbl.read().split("\n") if line.strip()]
+
+
+def read_transcript(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def load_transcripts(paths, threads=DEFAULT_THREADS):
+    """
+    Yield the contents of each file in the same order as paths. Files are read on a thread pool with a
+    bounded number of reads in flight so memory doesn't grow with the number of files.
+    """
+    with ThreadPoolExecutor(threads) as pool:
+        pending = deque()
+        for path in paths:
+            pending.append(pool.submit(read_transcript, path))
+            if len(pending) >= 4 * threads:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def load_dbl_examples(ref_paths, rec_paths, threads=DEFAULT_THREADS):
+    """Examples of each pair of files, with the reference path in their metadata to tell where results came from"""
+    assert len(ref_paths) == len(rec_paths), "Length of reference and recognised dbls differ"
+    paths = (path for pair in zip(ref_paths, rec_paths) for path in pair)
+    transcripts = load_transcripts(paths, threads)
+    return (
+        {"reference": ref, "recognised": rec, "metadata": {"file": ref_path}}
+        for ref_path, ref, rec in zip(ref_paths, transcripts, transcripts)
+    )
+
+
+def get_transcript_key(name):
+    """Split an archive member path into its transcript type and the path shared by its ref and rec files"""
+    parts = name.split("/")
+    for i, part in enumerate(parts):
+        if part in TRANSCRIPT_DIRS:
+            return part, "/".join(parts[:i] + parts[i + 1 :])  # noqa: E203
+    return None, None
+
+
+def load_tar_examples(tar_paths):
+    """
+    Yield examples from tar shards holding reference/<name> and recognised/<name> text files, read sequentially
+    in one pass. Transcripts wait in memory only until their partner turns up, so keep pairs close in the archive.
+    Each example's metadata records the shard and the reference member it came from.
+    """
+    for tar_path in tar_paths:
+        unpaired = {}
+        with tarfile.open(tar_path, "r|*") as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                transcript_type, key = get_transcript_key(member.name)
+                if transcript_type is None:
+                    continue
+                text = tar.extractfile(member).read().decode("utf-8").strip()
+                other = unpaired.pop(key, None)
+                if other is None or other[0] == transcript_type:
+                    unpaired[key] = (transcript_type, text, member.name)
+                    continue
+                transcripts = {t: (content, name) for t, content, name in [other, (transcript_type, text, member.name)]}
+                (ref, ref_name), (rec, _) = transcripts["reference"], transcripts["recognised"]
+                yield {"reference": ref, "recognised": rec, "metadata": {"file": ref_name, "shard": tar_path}}
+        if unpaired:
+            print(f"WARNING: {len(unpaired)} transcripts in {os.path.basename(tar_path)} have no matching ref/rec")
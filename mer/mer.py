@@ -1,97 +1,804 @@
-import os
+import copy
 import json
-from mer.lm import LanguageModel
+import os
+from collections import Counter, defaultdict
+from dataclasses import replace
+
+from mer.checkpoint import Checkpoint
+from mer.engine import get_continuations, map_in_order
+from mer.lm import models2cost
+from mer.metrics import Metrics, timed
+from mer.options import ScoringOptions
+from mer.planner import CostPlanner, SpendApproval
 from mer.prompt import PromptMultiple
+from mer.ratelimit import SpendCap
+from mer.store import ResultStore, get_settings_fingerprint
+from mer.triage import get_triage_vote
 from mer.utils import (
+    Alignment,
     calculate_meaning_error_rate,
-    calculate_wer,
+    get_samples_needed,
+    group_identical_pairs,
+    iter_chunks,
     majority_voting,
+    ResultStream,
     save_results,
 )
+from mer.wer import calculate_corpus_alignments, calculate_corpus_wer, get_wer_pool
+
+
+def request_continuations(
+    lm, checkpoint, prompt_strings, num_samples=1, concurrency=1, max_tokens=64, confirm=None, sample_round=0
+):
+    """
+    Get continuations for every prompt, returned in the same order as prompt_strings.
+    Prompts already in the checkpoint aren't requested again and new responses are checkpointed as they arrive.
+    confirm(indices) is called with the prompts that will have to be paid for before any are requested.
+    """
+    keys = [
+        lm.get_cache_key(p, max_tokens=max_tokens, num_samples=num_samples, sample_round=sample_round)
+        for p in prompt_strings
+    ]
+    pending = [i for i, key in enumerate(keys) if key not in checkpoint]
+    if len(pending) < len(prompt_strings):
+        print(f"Resuming from checkpoint with {len(prompt_strings) - len(pending)}/{len(prompt_strings)} prompts done")
+
+    # Only prompts missing from the cache need to be paid for
+    uncached = [
+        i
+        for i in pending
+        if not lm.is_cached(
+            prompt_strings[i], max_tokens=max_tokens, num_samples=num_samples, sample_round=sample_round
+        )
+    ]
+    if len(uncached) < len(pending):
+        print(f"Found {len(pending) - len(uncached)}/{len(pending)} prompts in the cache")
+    if confirm is not None and uncached:
+        confirm(uncached)
+
+    def on_result(index, result):
+        continuations, response = result
+        checkpoint.append(keys[pending[index]], continuations, response["usage"], lm.model)
+
+    # Get continuations from lm with many requests in flight
+    try:
+        get_continuations(
+            lm,
+            [prompt_strings[i] for i in pending],
+            num_samples=num_samples,
+            concurrency=concurrency,
+            on_result=on_result,
+            max_tokens=max_tokens,
+            sample_round=sample_round,
+        )
+    except (Exception, KeyboardInterrupt):
+        print(f"Stopped early, rerun with --resume to continue from {checkpoint.path}")
+        raise
+
+    # Prompts that weren't admitted before the spend cap was reached have no continuations
+    return [checkpoint[key]["continuations"] if key in checkpoint else None for key in keys]
+
+
+def get_confirm(approve, planner, pairs, alignments, **plan_kwargs):
+    """confirm callback of request_continuations that has the plan of the uncached pairs approved first"""
+
+    def confirm(uncached):
+        if approve is not None:
+            uncached_pairs = [pairs[i] for i in uncached]
+            approve(planner.plan(uncached_pairs, alignments=[alignments[i] for i in uncached], **plan_kwargs))
+
+    return confirm
+
+
+def request_batched_continuations(
+    lm, prompt, checkpoint, planner, pairs, batch_size, num_samples=1, concurrency=1, approve=None, alignments=None
+):
+    """
+    Score pairs in batches that share one copy of the few shot prefix, returning per-utterance continuations.
+    Utterances whose answer can't be found in every sampled continuation fall back to single utterance prompts.
+    """
+    alignments = alignments or [None] * len(pairs)
+    starts = range(0, len(pairs), batch_size)
+    batches = [pairs[i : i + batch_size] for i in starts]  # noqa: E203
+    batch_alignments = [alignments[i : i + batch_size] for i in starts]  # noqa: E203
+    batch_prompts = [prompt.create_batch_prompt(batch, a) for batch, a in zip(batches, batch_alignments)]
+
+    def confirm(uncached):
+        if approve is not None:
+            uncached_pairs = [pair for i in uncached for pair in batches[i]]
+            approve(planner.plan(uncached_pairs, batch_size, [a for i in uncached for a in batch_alignments[i]]))
+
+    batch_continuations = request_continuations(
+        lm, checkpoint, batch_prompts, num_samples, concurrency, max_tokens=64 * batch_size, confirm=confirm
+    )
+
+    continuations_list, fallback = [], []
+    for batch, continuations in zip(batches, batch_continuations):
+        if continuations is None:
+            continuations_list.extend([None] * len(batch))
+            continue
+        for item_continuations in prompt.split_batch_continuations(continuations, len(batch)):
+            if item_continuations is None:
+                fallback.append(len(continuations_list))
+            continuations_list.append(item_continuations)
+    if fallback:
+        print(f"Falling back to single utterance prompts for {len(fallback)} utterances that failed to parse")
+        fallback_pairs = [pairs[i] for i in fallback]
+        fallback_alignments = [alignments[i] for i in fallback]
+        fallback_prompts = [prompt.create_prompt(*pair, a) for pair, a in zip(fallback_pairs, fallback_alignments)]
+        fallback_continuations = request_continuations(
+            lm,
+            checkpoint,
+            fallback_prompts,
+            num_samples,
+            concurrency,
+            confirm=get_confirm(approve, planner, fallback_pairs, fallback_alignments),
+        )
+        for i, continuations in zip(fallback, fallback_continuations):
+            continuations_list[i] = continuations
+
+    # Compare prompt sizes against sending every utterance on its own, which would carry about the examples
+    # selected for its batch, so the examples aren't ranked again for every utterance
+    batched_tokens = planner.plan(pairs, batch_size, alignments)["prompt_tokens"]
+    if fallback:
+        batched_tokens += planner.plan(fallback_pairs, alignments=fallback_alignments)["prompt_tokens"]
+    unbatched_tokens = sum(
+        len(batch) * planner.count_prefix_tokens(batch, a)
+        + sum(planner.count_utterance_tokens(*pair) for pair in batch)
+        for batch, a in zip(batches, batch_alignments)
+    )
+    stats = {
+        "batch_fallbacks": len(fallback),
+        "estimated_batched_prompt_tokens": batched_tokens,
+        "estimated_unbatched_prompt_tokens": unbatched_tokens,
+    }
+    return continuations_list, stats
 
 
-def get_meaning_error_rate(examples, prompt_config_path, output_json, api_key=None, num_samples=3, simple=False):
-    prompt = PromptMultiple.from_file(prompt_config_path, simple=simple)
-    lm = LanguageModel(api_key=api_key)
+def request_adaptive_continuations(
+    lm, prompt, checkpoint, planner, pairs, num_samples=3, max_samples=6, concurrency=1, approve=None, alignments=None
+):
+    """
+    Sample each prompt incrementally, stopping as soon as one penalty has an unbeatable majority.
+    Extra samples (up to max_samples) are only drawn on ties or continuations that fail to parse.
+    """
+    alignments = alignments or [None] * len(pairs)
+    prompt_strings = [prompt.create_prompt(ref, rec, alignment) for (ref, rec), alignment in zip(pairs, alignments)]
+    first_samples = get_samples_needed([], num_samples, max_samples)
+    uncached = []
+    for i, prompt_string in enumerate(prompt_strings):
+        key = lm.get_cache_key(prompt_string, num_samples=first_samples)
+        if key not in checkpoint and not lm.is_cached(prompt_string, num_samples=first_samples):
+            uncached.append(i)
+    if uncached and approve is not None:
+        approve(planner.plan([pairs[i] for i in uncached], alignments=[alignments[i] for i in uncached]))
 
-    cost, total_tokens = 0, 0
+    async def sample(prompt_string):
+        continuations, penalties = [], []
+        sample_round = 0
+        to_request = get_samples_needed(penalties, num_samples, max_samples)
+        while to_request > 0:
+            key = lm.get_cache_key(prompt_string, num_samples=to_request, sample_round=sample_round)
+            if key not in checkpoint:
+                new_continuations, response = await lm.get_continuation_async(
+                    prompt_string, num_samples=to_request, sample_round=sample_round
+                )
+                checkpoint.append(key, new_continuations, response["usage"], lm.model)
+            for text in checkpoint[key]["continuations"]:
+                continuations.append(text)
+                penalties.append(prompt.get_result(text)[1])
+            sample_round += 1
+            to_request = get_samples_needed(penalties, num_samples, max_samples)
+        return continuations
 
-    # if file exists, load it
-    output_log = f"{output_json}.continuations.json"
-    if os.path.exists(output_log):
-        with open(output_log, "r", encoding="utf-8") as f:
-            continuations_list = list(json.load(f))
+    try:
+        continuations_list = map_in_order(sample, prompt_strings, concurrency=concurrency)
+    except (Exception, KeyboardInterrupt):
+        print(f"Stopped early, rerun with --resume to continue from {checkpoint.path}")
+        raise
+
+    completed = [continuations for continuations in continuations_list if continuations is not None]
+    stats = {"sampled_utterances": len(completed), "total_samples": sum(len(c) for c in completed)}
+    return continuations_list, stats
+
+
+def repair_continuations(
+    lm,
+    prompt,
+    checkpoint,
+    planner,
+    pairs,
+    continuations_list,
+    concurrency=1,
+    max_repairs=2,
+    approve=None,
+    alignments=None,
+):
+    """
+    Re-request only the samples whose continuation couldn't be parsed, so every paid for sample can count towards
+    the vote. Samples that never reached the result line were likely truncated so get twice the max_tokens.
+    Each round of re-requests is approved like any other, planned at max_tokens per sample.
+    """
+    alignments = alignments or [None] * len(pairs)
+    stats = Counter()
+    for repair_round in range(1, max_repairs + 1):
+        # Failed samples of each prompt grouped by the number of samples and max_tokens needed to replace them
+        groups = defaultdict(list)
+        for i, continuations in enumerate(continuations_list):
+            if continuations is None:
+                continue
+            failed = [j for j, text in enumerate(continuations) if prompt.get_result(text)[1] is None]
+            if repair_round == 1:
+                stats["samples"] += len(continuations)
+                stats["parse_failures"] += len(failed)
+            if failed:
+                truncated = any(prompt.is_truncated(continuations[j]) for j in failed)
+                groups[(len(failed), 128 if truncated else 64)].append((i, failed))
+        if not groups:
+            break
+
+        for (num_samples, max_tokens), items in groups.items():
+            repair_pairs = [pairs[i] for i, _ in items]
+            repair_alignments = [alignments[i] for i, _ in items]
+            prompt_strings = [prompt.create_prompt(*pair, a) for pair, a in zip(repair_pairs, repair_alignments)]
+            confirm = get_confirm(
+                approve, planner, repair_pairs, repair_alignments, num_samples=num_samples, max_tokens=max_tokens
+            )
+            new_continuations_list = request_continuations(
+                lm,
+                checkpoint,
+                prompt_strings,
+                num_samples,
+                concurrency,
+                max_tokens,
+                confirm=confirm,
+                sample_round=repair_round,
+            )
+            stats["repair_samples"] += num_samples * len(items)
+            for (i, failed), new_continuations in zip(items, new_continuations_list):
+                if new_continuations is None:
+                    continue
+                continuations = list(continuations_list[i])
+                for j, text in zip(failed, new_continuations):
+                    continuations[j] = text
+                continuations_list[i] = continuations
+    return continuations_list, stats
+
+
+def request_lm_votes(
+    lm,
+    prompt,
+    checkpoint,
+    planner,
+    pairs,
+    num_samples=3,
+    concurrency=1,
+    batch_size=1,
+    adaptive=False,
+    max_samples=None,
+    approve=None,
+    max_repairs=2,
+    alignments=None,
+):
+    """
+    Majority vote of each pair (None if it wasn't scored before the spend cap was reached) and usage stats.
+    Alignments already built for the pairs are reused to retrieve few shot examples.
+    """
+    stats = {}
+    if not pairs:
+        return [], stats
+    if lm.spend_cap.reached:
+        # Nothing more will be admitted so don't ask to approve requests that can't be made
+        return [None] * len(pairs), stats
+    alignments = alignments or [None] * len(pairs)
+    if adaptive:
+        continuations_list, stats = request_adaptive_continuations(
+            lm,
+            prompt,
+            checkpoint,
+            planner,
+            pairs,
+            num_samples=num_samples,
+            max_samples=max_samples or 2 * num_samples,
+            concurrency=concurrency,
+            approve=approve,
+            alignments=alignments,
+        )
+    elif batch_size > 1:
+        continuations_list, stats = request_batched_continuations(
+            lm,
+            prompt,
+            checkpoint,
+            planner,
+            pairs,
+            batch_size,
+            num_samples=num_samples,
+            concurrency=concurrency,
+            approve=approve,
+            alignments=alignments,
+        )
     else:
-        for example in examples:
-            _, ref, rec = prompt.unpack_example(example)
-            prompt_string = prompt.create_prompt(ref, rec)
-            cost += lm.print_estimated_cost(prompt_string, num_samples=num_samples)
-
-        accept_strings = ["Y", "y", "Yes", "yes"]
-        if input(f"Do you want to spend ${round(cost, 2)}? Enter Y/N to continue: ") not in accept_strings:
-            print("You didn't want to proceed, exiting")
-            exit(1)
-
-        continuations_list = []
-        for example in examples:
-            _, ref, rec = prompt.unpack_example(example)
-
-            # Create prompt and get continuations from lm
-            prompt_string = prompt.create_prompt(ref, rec)
-            continuations, response = lm.get_continuation(prompt_string, num_samples=num_samples)
-            total_tokens += response["usage"]["total_tokens"]
-            continuations_list.append(continuations)
-        cost = lm.print_actual_cost(total_tokens)
-        print(f"Cost: ${round(cost, 2)}")
+        prompt_strings = [prompt.create_prompt(*pair, alignment) for pair, alignment in zip(pairs, alignments)]
+        continuations_list = request_continuations(
+            lm,
+            checkpoint,
+            prompt_strings,
+            num_samples=num_samples,
+            concurrency=concurrency,
+            confirm=get_confirm(approve, planner, pairs, alignments),
+        )
+    # Adaptive voting already draws extra samples in place of ones that fail to parse
+    if max_repairs and not adaptive:
+        continuations_list, repair_stats = repair_continuations(
+            lm, prompt, checkpoint, planner, pairs, continuations_list, concurrency, max_repairs, approve, alignments
+        )
+        stats = {**stats, **repair_stats}
+    with timed(lm.metrics, "voting"):
+        votes = [majority_voting(c, prompt) if c is not None else None for c in continuations_list]
+    unparseable = sum(1 for c, vote in zip(continuations_list, votes) if c is not None and vote is None)
+    return votes, {**stats, "unparseable": unparseable}
 
-        # save list of continuations to file
-        with open(output_log, "w", encoding="utf-8") as f:
-            json.dump(continuations_list, f, indent=4)
 
-    total_errors, total_reference_count = 0, 0  # For WER
-    total_penalty, total_target_penalty = 0, 0  # For MER
-    results = []
-    for example, continuations in zip(examples, continuations_list):
-        error_count_target, ref, rec = prompt.unpack_example(example)
+def needs_escalation(pair, vote, wer_threshold=None, alignment=None):
+    """Whether a vote from the cheap model should be rescored by the expensive one"""
+    if vote is None:
+        # None of the cheap model's samples could be parsed
+        return True
+    _, result = vote
+    # Samples that disagree or fail to parse don't count towards the vote
+    if result["vote_count"] < len(result["predictions"]):
+        return True
+    if wer_threshold is not None:
+        if alignment is None:
+            alignment = Alignment(*pair)
+        return alignment.reference_count > 0 and 100 * alignment.errors / alignment.reference_count > wer_threshold
+    return False
+
 
-        # WER
-        errors, reference_count, wer_result = calculate_wer(ref, rec)
-        total_errors += errors
-        total_reference_count += reference_count
+def request_cascade_votes(
+    lm, cheap_lm, prompt, checkpoint, planner, cheap_planner, pairs, wer_threshold=None, alignments=None, **kwargs
+):
+    """Score every pair with the cheap model and only send the hard ones (see needs_escalation) to the expensive one"""
+    alignments = alignments or [None] * len(pairs)
+    votes, stats = request_lm_votes(cheap_lm, prompt, checkpoint, cheap_planner, pairs, alignments=alignments, **kwargs)
+    for vote in votes:
+        if vote is not None:
+            vote[1]["model"] = cheap_lm.model
+
+    # Both tiers share the spend cap, so once it's reached nothing can be escalated (including the pairs left
+    # without a vote because of it)
+    escalated = []
+    if not lm.spend_cap.reached:
+        escalated = [
+            i
+            for i, (pair, vote, alignment) in enumerate(zip(pairs, votes, alignments))
+            if needs_escalation(pair, vote, wer_threshold, alignment)
+        ]
+    # Unparseable cheap votes are counted again by the expensive model if it can't parse them either
+    rescored = sum(1 for i in escalated if votes[i] is None)
+    escalated_pairs = [pairs[i] for i in escalated]
+    escalated_votes, escalated_stats = request_lm_votes(
+        lm, prompt, checkpoint, planner, escalated_pairs, alignments=[alignments[i] for i in escalated], **kwargs
+    )
+    for i, vote in zip(escalated, escalated_votes):
+        # Keep the cheap vote if the spend cap stopped the expensive model from scoring it
+        if vote is not None:
+            vote[1]["model"] = lm.model
+            votes[i] = vote
+
+    stats = Counter(stats)
+    stats.update(escalated_stats)
+    stats.update({"cascade_utterances": len(pairs), "escalated": len(escalated)})
+    stats["unparseable"] -= rescored
+    return votes, stats
+
+
+def request_votes(lm, prompt, checkpoint, planner, pairs, triage=None, cascade=None, alignments=None, **kwargs):
+    """
+    Votes of each pair where utterances the triage can resolve locally are never sent to the LM.
+    With a cascade of (cheap_lm, cheap_planner, wer_threshold) the cheap model scores the pairs first.
+    Each vote records whether it was resolved by the triage or the LM. Alignments of the pairs are built once
+    unless passed in, and shared by example retrieval and escalation.
+    """
+    if alignments is None:
+        alignments = [Alignment(ref, rec) for ref, rec in pairs]
+    triage_classes = [triage.classify(ref, rec) if triage is not None else None for ref, rec in pairs]
+    lm_indices = [i for i, classes in enumerate(triage_classes) if classes is None]
+    lm_pairs = [pairs[i] for i in lm_indices]
+    lm_alignments = [alignments[i] for i in lm_indices]
+    if cascade is not None:
+        cheap_lm, cheap_planner, wer_threshold = cascade
+        lm_votes, stats = request_cascade_votes(
+            lm, cheap_lm, prompt, checkpoint, planner, cheap_planner, lm_pairs, wer_threshold, lm_alignments, **kwargs
+        )
+    else:
+        lm_votes, stats = request_lm_votes(
+            lm, prompt, checkpoint, planner, lm_pairs, alignments=lm_alignments, **kwargs
+        )
+
+    votes = [None if classes is None else get_triage_vote(classes) for classes in triage_classes]
+    for i, vote in zip(lm_indices, lm_votes):
+        if vote is not None:
+            vote[1]["resolved_by"] = "lm"
+        votes[i] = vote
+    return votes, {**stats, "triaged": len(pairs) - len(lm_indices)}
+
+
+def score_examples(prompt, examples, votes, pair_indices, wers, totals):
+    """Yield the result of each scored example, adding its errors and penalties to the running totals"""
+    for example, pair_index, (errors, reference_count, wer_result) in zip(examples, pair_indices, wers):
+        totals["examples"] += 1
+        if votes[pair_index] is None:
+            # Never scored as the spend cap was reached first
+            continue
+        error_count_target, _, _ = prompt.unpack_example(example)
+
+        # WER (errors is None when the reference is empty)
+        totals["errors"] += errors or 0
+        totals["reference_count"] += reference_count
 
         # Majority voting (keep track of score penalties to work out MER)
-        voted_penalty, prediction_result = majority_voting(continuations, prompt)
+        voted_penalty, prediction_result = votes[pair_index]
+        prediction_result = copy.deepcopy(prediction_result)
         mer_pred = calculate_meaning_error_rate(reference_count, voted_penalty)
         prediction_result["meaning_error_rate"] = round(mer_pred, 2)
-        total_penalty += voted_penalty
+        totals["penalty"] += voted_penalty
 
         # If you have human labels (targets counts for error type), then record extra stats
         if error_count_target:
             penalty_target = prompt.get_penalty(error_count_target)
-            total_target_penalty += penalty_target
+            totals["target_penalty"] += penalty_target
             mer_target = calculate_meaning_error_rate(reference_count, penalty_target)
             error_count_target["meaning_error_rate"] = round(mer_target, 2)
             prediction_result["target"] = error_count_target
             prediction_result["mer_diff"] = round(mer_pred - mer_target, 2)
 
-        results.append({**wer_result, **prediction_result})
+        totals["scored"] += 1
+        result = {**wer_result, **prediction_result}
+        if "metadata" in example:
+            # Keeps track of where the example came from, e.g. the file of a sentence unit
+            result["metadata"] = example["metadata"]
+        yield result
+
+
+def get_usage_stats(stats, batch_size=1, adaptive=False, max_samples=None):
+    """Turn the stats summed over every chunk into the ratios reported in the usage block"""
+    examples, unique_examples = stats["examples"], stats["unique_examples"]
+    dedup_ratio = 1 - unique_examples / examples if examples else 0.0
+    print(f"Deduplicated {examples} examples to {unique_examples} unique pairs (dedup ratio {dedup_ratio:.2f})")
+    usage = {"examples": examples, "unique_examples": unique_examples, "dedup_ratio": round(dedup_ratio, 4)}
+    if stats["triaged"]:
+        triage_ratio = stats["triaged"] / unique_examples
+        print(f"Triage resolved {stats['triaged']}/{unique_examples} unique pairs without the LM ({triage_ratio:.0%})")
+    usage["triaged"] = stats["triaged"]
+    if stats["stored"]:
+        print(f"Reused stored results of {stats['stored']}/{unique_examples} unique pairs from earlier runs")
+    usage["stored"] = stats["stored"]
+    if stats["unparseable"]:
+        print(f"Left {stats['unparseable']}/{unique_examples} unique pairs unscored as none of their samples parsed")
+    usage["unparseable"] = stats["unparseable"]
+    if stats["samples"]:
+        parse_failure_rate = stats["parse_failures"] / stats["samples"]
+        repair_rate = stats["repair_samples"] / stats["samples"]
+        print(f"{parse_failure_rate:.1%} of samples failed to parse ({repair_rate:.1%} of samples re-requested)")
+        usage.update(
+            {
+                "parse_failures": stats["parse_failures"],
+                "parse_failure_rate": round(parse_failure_rate, 4),
+                "repair_samples": stats["repair_samples"],
+                "repair_rate": round(repair_rate, 4),
+            }
+        )
+    if adaptive:
+        sampled = stats["sampled_utterances"]
+        average_samples = stats["total_samples"] / sampled if sampled else 0
+        print(f"Adaptive voting used {average_samples:.2f} samples per utterance on average (max {max_samples})")
+        usage["average_samples"] = round(average_samples, 4)
+    elif batch_size > 1:
+        batched_tokens = stats["estimated_batched_prompt_tokens"]
+        unbatched_tokens = stats["estimated_unbatched_prompt_tokens"]
+        saving = 1 - batched_tokens / unbatched_tokens if unbatched_tokens else 0.0
+        print(
+            f"Batched prompts used {batched_tokens} prompt tokens vs {unbatched_tokens} unbatched ({saving:.0%} saving)"
+        )
+        usage.update(
+            {
+                "batch_size": batch_size,
+                "batch_fallbacks": stats["batch_fallbacks"],
+                "estimated_batched_prompt_tokens": batched_tokens,
+                "estimated_unbatched_prompt_tokens": unbatched_tokens,
+                "estimated_prompt_token_saving": round(saving, 4),
+            }
+        )
+    return usage
 
-    meaning_error_rate = calculate_meaning_error_rate(total_reference_count, total_penalty)
-    wer = 100 * total_errors / total_reference_count
 
-    if total_target_penalty > 0:
-        meaning_error_rate_target = calculate_meaning_error_rate(total_reference_count, total_target_penalty)
+def request_stored_votes(store, settings_fingerprint, pairs, request, alignments):
+    """Reuse the votes of pairs already scored with the same prompt and settings, only requesting the rest"""
+    fingerprints = [store.get_fingerprint(settings_fingerprint, ref, rec) for ref, rec in pairs]
+    votes = [store.get(fingerprint) for fingerprint in fingerprints]
+    missing = [i for i, vote in enumerate(votes) if vote is None]
+    new_votes, stats = request([pairs[i] for i in missing], [alignments[i] for i in missing])
+    for i, vote in zip(missing, new_votes):
+        votes[i] = vote
+        if vote is not None:
+            store.put(fingerprints[i], vote)
+    return votes, {**stats, "stored": len(pairs) - len(missing)}
 
-    save_results(
-        output_json,
-        results,
-        total_tokens,
-        cost,
-        total_reference_count,
-        total_penalty,
-        meaning_error_rate,
-        wer,
-        meaning_error_rate_target,
+
+def get_checkpoint_cost(checkpoint, default_model):
+    """Cost of every response in the checkpoint at the rate of the model that produced it"""
+    cost = 0.0
+    for model, usage in checkpoint.model_usage.items():
+        # Responses checkpointed before models were recorded came from the main model
+        cost += models2cost[model or default_model] * usage["total_tokens"] / 1000
+    return cost
+
+
+def get_metrics(options):
+    # Instrumentation is only hooked in when asked for so it costs nothing otherwise
+    if not (options.metrics or options.metrics_textfile or options.progress_interval):
+        return None
+    return Metrics(options.progress_interval, options.metrics_textfile)
+
+
+def get_prompt(prompt_config_path, options, model, metrics=None):
+    # With num_examples or example_token_budget set only the most relevant few shot examples go in each prompt
+    prompt = PromptMultiple.from_file(
+        prompt_config_path,
+        simple=options.simple,
+        num_examples=options.num_examples,
+        example_token_budget=options.example_token_budget,
+        model=model,
     )
+    if metrics is not None:
+        metrics.instrument(prompt, "create_prompt", "prompt")
+        metrics.instrument(prompt, "create_batch_prompt", "prompt")
+        metrics.instrument(prompt, "get_result", "parse")
+    return prompt
+
+
+def get_cascade(options, prompt, lm, metrics=None):
+    """
+    (cheap_lm, cheap_planner, wer_threshold) of a cascade, where the cheap model scores everything first and
+    only the hard utterances reach the main model, or None without a cascade model
+    """
+    if options.cascade_model is None:
+        return None
+    assert options.cascade_model != options.model, "Cascade model should be cheaper than the main model"
+    cheap_lm = options.get_language_model(options.cascade_model, lm.cache, metrics)
+    # Both tiers count towards the same cap
+    cheap_lm.spend_cap = lm.spend_cap
+    cheap_planner = CostPlanner(
+        prompt, options.cascade_model, num_samples=options.num_samples, concurrency=options.concurrency
+    )
+    return cheap_lm, cheap_planner, options.cascade_wer_threshold
+
+
+def get_settings(options):
+    """Settings that change the votes, so votes are only reused from the result store by runs that share them"""
+    return {
+        # Votes from a stand-in endpoint must never decide the scores of runs against the real one
+        "api_base": options.api_base,
+        "model": options.model,
+        "simple": options.simple,
+        "num_samples": options.num_samples,
+        "batch_size": options.batch_size,
+        "adaptive": options.adaptive,
+        "max_samples": options.max_samples,
+        "max_repairs": options.max_repairs,
+        "num_examples": options.num_examples,
+        "example_token_budget": options.example_token_budget,
+        "triage_classes": list(options.triage_classes) if options.triage else None,
+        "cascade_model": options.cascade_model,
+        "cascade_wer_threshold": options.cascade_wer_threshold,
+    }
+
+
+def open_result_store(options):
+    """Store of the votes of earlier runs so only changed pairs are scored, clearing this run's build"""
+    store = ResultStore(options.result_store) if options.result_store else None
+    assert store is not None or options.build is None, "A result store is needed to record builds"
+    assert (
+        options.compare_build is None or options.build is not None
+    ), "Name this run's build to compare it with another"
+    if options.build is not None:
+        store.clear_build(options.build)
+    return store
+
+
+def add_results(scored, results, writer=None, store=None, build=None, totals=None):
+    """Write each scored result (or keep it when not streaming) and record it under the build in the store"""
+    build_results = []
+    for result in scored:
+        if writer is not None:
+            writer.write(result)
+        else:
+            results.append(result)
+        if build is not None:
+            # score_examples counts each example before yielding its result
+            build_results.append((totals["examples"] - 1, result))
+    if build_results:
+        store.add_build_results(build, build_results)
+
+
+def save_build_diff(store, compare_build, build, output_json):
+    """Write the report of utterances that moved since the earlier build next to the output json"""
+    report = store.diff_builds(compare_build, build)
+    diff_json = f"{os.path.splitext(output_json)[0]}_diff.json"
+    with open(diff_json, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=4)
+    moved = report["summary"]
+    print(
+        f"Compared {moved['compared']} utterances with build {compare_build}: {moved['changed_transcripts']} "
+        f"transcripts changed, {moved['improved']} improved, {moved['regressed']} regressed (see {diff_json})"
+    )
+
+
+def get_run_usage(stats, options, lm, checkpoint, cascade=None, metrics=None):
+    """Usage block of the run and its total tokens and cost, which include any earlier runs of a resumed job"""
+    usage = get_usage_stats(stats, options.batch_size, options.adaptive, options.max_samples or 2 * options.num_samples)
+
+    # Cost is rebuilt from the checkpoint so tokens spent in earlier runs are counted
+    total_tokens = checkpoint.get_usage("total_tokens")
+    usage["retries"] = lm.retries
+    if lm.spend_cap.reached:
+        print(f"Spend cap reached after {lm.spend_cap.spent_tokens} tokens, results only cover the completed subset")
+    usage["spend_cap_reached"] = lm.spend_cap.reached
+    if metrics is not None:
+        usage["metrics"] = metrics.get_report()
+        print(metrics.get_progress_line())
+        if options.metrics_textfile:
+            metrics.write_textfile(options.metrics_textfile)
+    if cascade is not None:
+        # Each tier is costed at its own rate
+        cheap_lm = cascade[0]
+        usage["retries"] += cheap_lm.retries
+        usage["escalated"] = stats["escalated"]
+        usage["tiers"] = {}
+        for tier_lm, utterances in [(cheap_lm, stats["cascade_utterances"]), (lm, stats["escalated"])]:
+            print(f"{tier_lm.model} scored {utterances} unique pairs")
+            tier_tokens = checkpoint.get_usage("total_tokens", model=tier_lm.model)
+            tier_lm.print_actual_cost(tier_tokens)
+            tier_cost = round(models2cost[tier_lm.model] * tier_tokens / 1000, 4)
+            usage["tiers"][tier_lm.model] = {"utterances": utterances, "total_tokens": tier_tokens, "cost": tier_cost}
+        cost = round(get_checkpoint_cost(checkpoint, lm.model), 2)
+    else:
+        cost = lm.print_actual_cost(total_tokens)
+    print(f"Cost: ${round(cost, 2)}")
+    return usage, total_tokens, cost
+
+
+def save_run_results(output_json, results, writer, totals, total_tokens, cost, usage):
+    """Save the results with the corpus MER and WER, returning the MER and the MER of the human labels if any"""
+    # With a spend cap the rates only cover the utterances that were scored
+    coverage = totals["scored"] / totals["examples"] if totals["examples"] else 0.0
+    if coverage < 1:
+        print(f"Scored {totals['scored']}/{totals['examples']} utterances (coverage {coverage:.2f})")
+    if totals["reference_count"] > 0:
+        meaning_error_rate = calculate_meaning_error_rate(totals["reference_count"], totals["penalty"])
+        wer = 100 * totals["errors"] / totals["reference_count"]
+    else:
+        print("WARNING: No reference words were scored so reporting MER and WER as 0")
+        meaning_error_rate, wer = 0.0, 0.0
+
+    meaning_error_rate_target = None
+    if totals["target_penalty"] > 0:
+        meaning_error_rate_target = calculate_meaning_error_rate(totals["reference_count"], totals["target_penalty"])
+
+    summary_args = (total_tokens, cost, totals["reference_count"], totals["penalty"], meaning_error_rate, wer)
+    summary_kwargs = {"meaning_error_rate_target": meaning_error_rate_target, "usage": usage, "coverage": coverage}
+    if writer is not None:
+        writer.close(*summary_args, **summary_kwargs)
+    else:
+        save_results(output_json, results, *summary_args, **summary_kwargs)
 
     return meaning_error_rate, meaning_error_rate_target
+
+
+def get_meaning_error_rate(examples, prompt_config_path, output_json, options=None, **kwargs):
+    """
+    Score every example and save the results to output_json. In stream mode examples can be any iterable
+    (e.g. a generator over a JSONL file) and are scored chunk_size at a time, with each result written as a
+    JSONL line as soon as its chunk is done so memory stays flat however big the test set is.
+    The run's settings come from options (ScoringOptions defaults if not given), overridden by any kwargs.
+    """
+    options = replace(options or ScoringOptions(), **kwargs)
+    assert not (
+        options.adaptive and options.batch_size > 1
+    ), "Adaptive voting samples single utterance prompts so can't be batched"
+    metrics = get_metrics(options)
+    lm = options.get_language_model(cache=options.get_cache(), metrics=metrics)
+    prompt = get_prompt(prompt_config_path, options, lm.model, metrics)
+    planner = CostPlanner(
+        prompt,
+        lm.model,
+        num_samples=options.num_samples,
+        concurrency=options.concurrency,
+        requests_per_minute=options.requests_per_minute,
+        tokens_per_minute=options.tokens_per_minute,
+    )
+    approve = SpendApproval(options.max_budget, stream=options.stream)
+    store = open_result_store(options)
+    settings_fingerprint = get_settings_fingerprint(prompt, get_settings(options))
+
+    # Responses are checkpointed as they arrive so a resumed run only requests the prompts still missing
+    checkpoint = Checkpoint(f"{output_json}.checkpoint.jsonl", resume=options.resume)
+    # Tokens spent by earlier runs of a resumed job count towards the cap
+    lm.spend_cap = SpendCap(
+        models2cost[lm.model],
+        max_cost=options.spend_cap,
+        max_tokens=options.token_cap,
+        spent_tokens=checkpoint.get_usage(),
+        spent_cost=get_checkpoint_cost(checkpoint, lm.model),
+    )
+    cascade = get_cascade(options, prompt, lm, metrics)
+    # Utterances whose only differences the prompt says to ignore are scored locally
+    triage = options.get_triage()
+
+    def request(pairs, alignments):
+        return request_votes(
+            lm,
+            prompt,
+            checkpoint,
+            planner,
+            pairs,
+            alignments=alignments,
+            num_samples=options.num_samples,
+            concurrency=options.concurrency,
+            batch_size=options.batch_size,
+            adaptive=options.adaptive,
+            max_samples=options.max_samples,
+            approve=approve,
+            triage=triage,
+            cascade=cascade,
+            max_repairs=options.max_repairs,
+        )
+
+    # Running totals so results never have to be held in memory when streaming
+    totals = Counter()
+    stats = Counter()
+    results = []
+    writer = ResultStream(output_json) if options.stream else None
+    chunks = iter_chunks(examples, options.chunk_size) if options.stream else [list(examples)]
+    wer_pool = get_wer_pool(options.wer_processes)
+    try:
+        for chunk in chunks:
+            pairs = [tuple(prompt.unpack_example(example)[1:]) for example in chunk]
+
+            # Identical pairs are only sent to the LM once and the voted result is shared between them
+            unique_pairs, pair_indices = group_identical_pairs(pairs)
+            stats.update({"examples": len(pairs), "unique_examples": len(unique_pairs)})
+
+            # Each unique pair is aligned once, sharded over the process pool as it's CPU bound. The alignments are
+            # shared by example retrieval, escalation and WER
+            with timed(metrics, "alignment"):
+                alignments = calculate_corpus_alignments(unique_pairs, wer_pool)
+
+            if store is not None:
+                votes, chunk_stats = request_stored_votes(
+                    store, settings_fingerprint, unique_pairs, request, alignments
+                )
+            else:
+                votes, chunk_stats = request(unique_pairs, alignments)
+            stats.update(chunk_stats)
+
+            wers = calculate_corpus_wer(pairs, alignments=[alignments[i] for i in pair_indices])
+            scored = score_examples(prompt, chunk, votes, pair_indices, wers, totals)
+            add_results(scored, results, writer, store, options.build, totals)
+            if metrics is not None:
+                metrics.add_utterances(len(chunk))
+            if options.stream:
+                print(f"Scored {totals['scored']}/{totals['examples']} examples so far")
+    finally:
+        checkpoint.close()
+        if wer_pool is not None:
+            wer_pool.shutdown()
+
+    if options.compare_build is not None:
+        save_build_diff(store, options.compare_build, options.build, output_json)
+    if store is not None:
+        store.close()
+
+    usage, total_tokens, cost = get_run_usage(stats, options, lm, checkpoint, cascade, metrics)
+    return save_run_results(output_json, results, writer, totals, total_tokens, cost, usage)
@@ -0,0 +1,147 @@
+import math
+import os
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+PERCENTILES = (50, 95, 99)
+NULL_TIMER = nullcontext()
+
+
+def get_percentile(sorted_values, percentile):
+    """Nearest rank percentile of already sorted values"""
+    if not sorted_values:
+        return 0.0
+    rank = math.ceil(percentile / 100 * len(sorted_values))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def timed(metrics, stage):
+    """Timer for the stage, or a shared no-op context when instrumentation is off"""
+    return NULL_TIMER if metrics is None else metrics.timer(stage)
+
+
+class Metrics:
+    """
+    Wall time of each stage of a run (prompt building, parsing, voting, alignment), plus the latency, tokens
+    and retries of every API request. Nothing is hooked in unless a Metrics object is created, so runs
+    without instrumentation pay nothing for it. Stages can nest, e.g. voting includes parsing.
+    """
+
+    def __init__(self, progress_interval=None, textfile_path=None):
+        self.progress_interval = progress_interval  # seconds between progress lines, None to stay quiet
+        self.textfile_path = textfile_path  # Prometheus textfile rewritten with every progress line and at the end
+        self.start = time.perf_counter()
+        self.last_progress = self.start
+        self.stage_seconds = defaultdict(float)
+        self.stage_calls = Counter()
+        self.latencies = []
+        self.tokens = []
+        self.cache_hits = 0
+        self.retries = 0
+        self.utterances = 0
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_seconds[stage] += time.perf_counter() - start
+            self.stage_calls[stage] += 1
+
+    def instrument(self, obj, method_name, stage):
+        """Time every call of obj.method_name under the stage by wrapping the bound method on the instance"""
+        method = getattr(obj, method_name)
+
+        @wraps(method)
+        def timed_method(*args, **kwargs):
+            with self.timer(stage):
+                return method(*args, **kwargs)
+
+        setattr(obj, method_name, timed_method)
+
+    def record_request(self, latency, tokens):
+        self.latencies.append(latency)
+        self.tokens.append(tokens)
+        self.maybe_report()
+
+    def add_utterances(self, count):
+        self.utterances += count
+        self.maybe_report()
+
+    def maybe_report(self):
+        if self.progress_interval is None:
+            return
+        now = time.perf_counter()
+        if now - self.last_progress < self.progress_interval:
+            return
+        self.last_progress = now
+        print(self.get_progress_line())
+        if self.textfile_path:
+            self.write_textfile(self.textfile_path)
+
+    def get_progress_line(self):
+        elapsed = time.perf_counter() - self.start
+        latencies = sorted(self.latencies)
+        request_rate = len(latencies) / elapsed if elapsed else 0.0
+        return (
+            f"[{elapsed:.0f}s] {len(latencies)} requests ({request_rate:.1f}/s), {self.retries} retries, "
+            f"{self.utterances} utterances scored, API latency p50 {get_percentile(latencies, 50):.2f}s "
+            f"p95 {get_percentile(latencies, 95):.2f}s, {sum(self.tokens)} tokens"
+        )
+
+    def get_report(self):
+        elapsed = time.perf_counter() - self.start
+        latencies = sorted(self.latencies)
+        requests = len(latencies)
+        return {
+            "wall_time": round(elapsed, 4),
+            "utterances": self.utterances,
+            "utterances_per_second": round(self.utterances / elapsed, 4) if elapsed else 0.0,
+            "stages": {
+                stage: {"calls": self.stage_calls[stage], "seconds": round(seconds, 4)}
+                for stage, seconds in sorted(self.stage_seconds.items())
+            },
+            "api": {
+                "requests": requests,
+                "cache_hits": self.cache_hits,
+                "retries": self.retries,
+                "tokens_per_request": round(sum(self.tokens) / requests, 2) if requests else 0.0,
+                "latency": {
+                    **{f"p{p}": round(get_percentile(latencies, p), 4) for p in PERCENTILES},
+                    "mean": round(sum(latencies) / requests, 4) if requests else 0.0,
+                    "max": round(latencies[-1], 4) if requests else 0.0,
+                },
+            },
+        }
+
+    def write_textfile(self, textfile_path):
+        """Prometheus text exposition format, written atomically so a textfile collector never reads half a file"""
+        latencies = sorted(self.latencies)
+        lines = [
+            "# TYPE mer_stage_seconds_total counter",
+            *(f'mer_stage_seconds_total{{stage="{s}"}} {t:.6f}' for s, t in sorted(self.stage_seconds.items())),
+            "# TYPE mer_api_latency_seconds summary",
+            *(
+                f'mer_api_latency_seconds{{quantile="{p / 100}"}} {get_percentile(latencies, p):.6f}'
+                for p in PERCENTILES
+            ),
+            f"mer_api_latency_seconds_sum {sum(latencies):.6f}",
+            f"mer_api_latency_seconds_count {len(latencies)}",
+            "# TYPE mer_api_tokens_total counter",
+            f"mer_api_tokens_total {sum(self.tokens)}",
+            "# TYPE mer_api_cache_hits_total counter",
+            f"mer_api_cache_hits_total {self.cache_hits}",
+            "# TYPE mer_api_retries_total counter",
+            f"mer_api_retries_total {self.retries}",
+            "# TYPE mer_utterances_total counter",
+            f"mer_utterances_total {self.utterances}",
+            "# TYPE mer_elapsed_seconds gauge",
+            f"mer_elapsed_seconds {time.perf_counter() - self.start:.6f}",
+        ]
+        tmp_path = f"{textfile_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, textfile_path)
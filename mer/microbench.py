@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from mer.benchmark import VOCABULARY, recognise_word
+from mer.mockserver import MockCompletionServer
+from mer.prompt import PromptMultiple
+from mer.utils import calculate_wer, get_alignment, get_sentences, majority_voting, save_results
+
+DEFAULT_BASELINE_PATH = "./config/microbench_baseline.json"
+# A benchmark has regressed if it's this many times slower than its baseline
+DEFAULT_THRESHOLD = 1.5
+
+# Synthetic corpora as (number of transcripts, words per transcript), from short utterances to long-form
+CORPORA = {
+    "short": (1000, 12),
+    "medium": (50, 500),
+    "long": (2, 10000),
+}
+
+
+def get_transcript_pair(rng, num_words, word_error_rate=0.1):
+    """Punctuated reference and a recognised transcript with random substitutions, deletions and insertions"""
+    ref_words, rec_words = [], []
+    for i in range(num_words):
+        word = rng.choice(VOCABULARY)
+        if i % 12 == 11 or i == num_words - 1:
+            word += rng.choice(".?,")
+        ref_words.append(word)
+        rec_words.extend(recognise_word(rng, word, word_error_rate))
+    return " ".join(ref_words), " ".join(rec_words)
+
+
+def get_corpus(name, seed=0):
+    count, num_words = CORPORA[name]
+    rng = random.Random(seed)
+    return [get_transcript_pair(rng, num_words) for _ in range(count)]
+
+
+def get_benchmarks(prompt, pairs, seed=0):
+    """Named callables that each run one hot path over every pair of the corpus"""
+    rng = random.Random(seed)
+    server = MockCompletionServer(disagreement=0.3)
+    continuations = [[server.continuation(prompt.create_prompt(ref, rec), rng) for _ in range(3)] for ref, rec in pairs]
+    results = [{"reference": ref, "recognised": rec, "voted_penality": 0.5} for ref, rec in pairs]
+
+    def serialise():
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            save_results(os.path.join(tmp_dir, "results.json"), results, 0, 0.0, 0, 0.0, 0.0, 0.0)
+
+    return {
+        "get_alignment": lambda: [get_alignment(ref, rec) for ref, rec in pairs],
+        "get_sentences": lambda: [get_sentences(ref, rec) for ref, rec in pairs],
+        "calculate_wer": lambda: [calculate_wer(ref, rec) for ref, rec in pairs],
+        "create_prompt": lambda: [prompt.create_prompt(ref, rec) for ref, rec in pairs],
+        "get_result": lambda: [prompt.get_result(text) for samples in continuations for text in samples],
+        "majority_voting": lambda: [majority_voting(samples, prompt) for samples in continuations],
+        "save_results": serialise,
+    }
+
+
+def time_benchmark(benchmark, repeat=5, min_seconds=0.2):
+    """Best of `repeat` timings, each running the benchmark as many times as fit in min_seconds"""
+    start = time.perf_counter()
+    benchmark()
+    loops = max(1, int(min_seconds / max(time.perf_counter() - start, 1e-9)))
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(loops):
+            benchmark()
+        best = min(best, (time.perf_counter() - start) / loops)
+    return best
+
+
+def run(prompt_config_path="./config/prompt_multiple.json", corpora=tuple(CORPORA), names=None, repeat=5, seed=0):
+    """Seconds per transcript of each benchmark on each corpus, keyed as <benchmark>/<corpus>"""
+    prompt = PromptMultiple.from_file(prompt_config_path)
+    timings = {}
+    for corpus_name in corpora:
+        pairs = get_corpus(corpus_name, seed)
+        for name, benchmark in get_benchmarks(prompt, pairs, seed).items():
+            if names and name not in names:
+                continue
+            seconds = time_benchmark(benchmark, repeat=repeat) / len(pairs)
+            timings[f"{name}/{corpus_name}"] = seconds
+            print(f"{name + '/' + corpus_name:<30} {seconds * 1e6:>14.1f} us per transcript")
+    # Timings only compare on the same machine and python so record them alongside
+    return {"python": sys.version.split()[0], "machine": platform.machine(), "timings": timings}
+
+
+def compare(timings, baseline, threshold=DEFAULT_THRESHOLD):
+    """Benchmarks slower than threshold times their baseline as (key, baseline seconds, seconds, ratio)"""
+    regressions = []
+    for key, seconds in timings.items():
+        if key not in baseline:
+            print(f"{key:<30} no baseline")
+            continue
+        ratio = seconds / baseline[key]
+        flag = "REGRESSION" if ratio > threshold else ""
+        print(f"{key:<30} {baseline[key] * 1e6:>14.1f} us -> {seconds * 1e6:>14.1f} us ({ratio:.2f}x) {flag}")
+        if ratio > threshold:
+            regressions.append((key, baseline[key], seconds, ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU micro-benchmarks of the non-LM hot paths")
+    # pylint: disable=line-too-long
+    # fmt: off
+    parser.add_argument("command", choices=["run", "save", "compare"], help="run to print timings, save to store them as the baseline, compare to check them against it")  # noqa:  E201
+    parser.add_argument("--baseline", type=str, default=DEFAULT_BASELINE_PATH, help="path to the stored baseline timings")  # noqa:  E201
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="slowdown versus the baseline that counts as a regression")  # noqa:  E201
+    parser.add_argument("--corpora", type=str, nargs="+", default=list(CORPORA), choices=list(CORPORA), help="synthetic corpora to benchmark on")  # noqa:  E201
+    parser.add_argument("--benchmarks", type=str, nargs="+", default=None, help="only run these benchmarks")  # noqa:  E201
+    parser.add_argument("--repeat", type=int, default=5, help="timings to take the best of")  # noqa:  E201
+    parser.add_argument("--prompt_config_path", type=str, default="./config/prompt_multiple.json", help="path to prompt config json")  # noqa:  E201
+    # fmt: on
+    args = parser.parse_args()
+
+    report = run(args.prompt_config_path, corpora=args.corpora, names=args.benchmarks, repeat=args.repeat)
+    if args.command == "save":
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Saved baseline to {args.baseline}")
+    elif args.command == "compare":
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report["timings"], baseline["timings"], args.threshold)
+        if regressions:
+            print(f"{len(regressions)} benchmarks regressed by more than {args.threshold}x")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+import json
+import math
+import random
+import re
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mer.triage import Triage
+from mer.utils import Alignment
+
+SEVERITIES = ("minor", "standard", "serious")
+SEVERITY_SCORES = {"minor": 0.25, "standard": 0.5, "serious": 1.0}
+# How often each severity is picked for a difference, roughly in line with the labelled examples
+SEVERITY_WEIGHTS = (0.5, 0.35, 0.15)
+
+BATCH_PAIR_PATTERN = re.compile(r"^Reference (\d+): (.*)\nRecognised \1: (.*)$", re.MULTILINE)
+
+
+class MockCompletionServer:
+    """
+    Local mock of the open ai completions endpoint for offline tests and load simulation. Continuations
+    describe each difference between the last reference and recognised transcript in the prompt (or every
+    numbered pair of a batch prompt) and end in a parseable result line with a realistic usage block.
+    Latency is log-normal around `latency` seconds and a fraction of requests can be made to fail with
+    server errors, 429 rate limits or continuations cut off before the result line.
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        latency_sigma=0.0,
+        error_rate=0.0,
+        rate_limit_rate=0.0,
+        truncation_rate=0.0,
+        disagreement=0.1,
+        retry_after=0.01,
+        seed=0,
+    ):
+        self.latency = latency  # median seconds per request
+        self.latency_sigma = latency_sigma  # spread of the log-normal latency, 0 for a constant latency
+        self.error_rate = error_rate  # fraction of requests answered with a 500
+        self.rate_limit_rate = rate_limit_rate  # fraction of requests answered with a 429
+        self.truncation_rate = truncation_rate  # fraction of requests cut off before the result line
+        self.disagreement = disagreement  # chance each sample picks a different severity for a difference
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+
+        # Deterministic failure modes used by the unittests
+        self.drop_last_batch_answer = False  # simulate a batch continuation that gets cut short
+        self.fail_after = None  # number of successful requests before the server starts erroring
+        self.rate_limited = 0  # number of requests to reject with 429 before serving any
+        self.truncated = 0  # number of requests whose continuations are cut off before the result line
+
+        self.requests = 0
+        self.errors = 0
+        self.max_tokens = []
+        self.tokens = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.server = None
+        self.api_base = None
+
+    @staticmethod
+    def get_severity(difference, rng, disagreement):
+        """Severity a sample gives a difference, mostly stable across samples so majority voting has work to do"""
+        weights_rng = random.Random(zlib.crc32(json.dumps(difference).encode("utf-8")))
+        severity = weights_rng.choices(SEVERITIES, SEVERITY_WEIGHTS)[0]
+        if rng.random() < disagreement:
+            severity = rng.choice(SEVERITIES)
+        return severity
+
+    def answer(self, ref, rec, rng):
+        """Reasoning and result lines for one utterance"""
+        counts = dict.fromkeys(SEVERITIES, 0)
+        reasons = []
+        for ref_words, rec_words in Triage.get_differences(Alignment(ref, rec)):
+            severity = self.get_severity([ref_words, rec_words], rng, self.disagreement)
+            counts[severity] += 1
+            if not rec_words:
+                reasons.append(f'"{" ".join(ref_words)}" is omitted ({severity})')
+            elif not ref_words:
+                reasons.append(f'"{" ".join(rec_words)}" has been inserted ({severity})')
+            else:
+                reasons.append(f'"{" ".join(ref_words)}" misrecognized as "{" ".join(rec_words)}" ({severity})')
+        penalty = sum(SEVERITY_SCORES[severity] * count for severity, count in counts.items())
+        reasoning = ", ".join(reasons) or "no differences"
+        result = " + ".join(f"{counts[severity]} {severity}" for severity in SEVERITIES) + f" = {penalty} penalty"
+        return reasoning, result
+
+    def continuation(self, prompt, rng):
+        if prompt.endswith("Reasoning 1:"):
+            # Batch prompt so answer every numbered utterance
+            pairs = BATCH_PAIR_PATTERN.findall(prompt)
+            if self.drop_last_batch_answer:
+                pairs = pairs[:-1]
+            answers = []
+            for i, ref, rec in pairs:
+                reasoning, result = self.answer(ref, rec, rng)
+                answers.append(f"Reasoning {i}: {reasoning}\nResult {i}: {result}")
+            return "\n\n".join(answers)[len("Reasoning 1:") :]  # noqa: E203
+        ref = prompt.split("Reference:")[-1].split("\n")[0].strip()
+        rec = prompt.split("Recognised:")[-1].split("\n")[0].strip()
+        reasoning, result = self.answer(ref, rec, rng)
+        return f" {reasoning}\nResult: {result}"
+
+    def get_latency(self, rng):
+        if self.latency_sigma <= 0:
+            return self.latency
+        return self.latency * math.exp(rng.gauss(0, self.latency_sigma))
+
+    def respond(self, body):
+        """(status, response json, headers) for a completion request"""
+        with self.lock:
+            rng = random.Random(self.rng.random())
+            if (self.fail_after is not None and self.requests >= self.fail_after) or rng.random() < self.error_rate:
+                self.errors += 1
+                return 500, {"error": {"message": "Mock server error", "type": "server_error"}}, {}
+            if self.rate_limited > 0 or rng.random() < self.rate_limit_rate:
+                self.rate_limited = max(self.rate_limited - 1, 0)
+                self.errors += 1
+                error = {"error": {"message": "Rate limit reached", "type": "requests"}}
+                return 429, error, {"Retry-After": str(self.retry_after)}
+            self.requests += 1
+            self.max_tokens.append(body["max_tokens"])
+            truncated = self.truncated > 0 or rng.random() < self.truncation_rate
+            self.truncated = max(self.truncated - 1, 0)
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        time.sleep(self.get_latency(rng))
+        with self.lock:
+            self.in_flight -= 1
+
+        num_samples = body.get("n", 1)
+        texts = []
+        for _ in range(num_samples):
+            text = self.continuation(body["prompt"], rng)
+            texts.append(text.split("\n")[0] if truncated else text)
+        # Roughly 4 characters per token
+        prompt_tokens = len(body["prompt"]) // 4
+        completion_tokens = sum(len(text) // 4 for text in texts)
+        self.tokens.append(prompt_tokens + completion_tokens)
+        response = {
+            "object": "text_completion",
+            "model": body["model"],
+            "choices": [
+                {"text": text, "index": i, "finish_reason": "length" if truncated else "stop"}
+                for i, text in enumerate(texts)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+        return 200, response, {}
+
+    def start(self, host="127.0.0.1", port=0):
+        """Serve on a background thread, api_base is set to the address to pass to LanguageModel"""
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Answers every completion request posted to it with the mock's response"""
+
+            def do_POST(self):  # noqa: N802
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                status, response, headers = mock.respond(body)
+                data = json.dumps(response).encode("utf-8")
+                self.send_response(status)
+                for header, value in headers.items():
+                    self.send_header(header, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.api_base = f"http://{host}:{self.server.server_address[1]}/v1"
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
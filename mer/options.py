@@ -0,0 +1,130 @@
+from dataclasses import dataclass, fields
+from typing import Optional, Sequence
+
+from mer.cache import DEFAULT_CACHE_PATH, ContinuationCache
+from mer.lm import LanguageModel, models2cost
+from mer.store import DEFAULT_STORE_PATH
+from mer.triage import IGNORABLE_CLASSES, Triage
+
+
+@dataclass
+class ScoringOptions:  # pylint: disable=too-many-instance-attributes
+    """
+    Settings of a scoring run, named after the CLI flags that set them. The run, test, sweep and service CLIs
+    each read theirs from the parsed flags and anything a CLI doesn't have keeps its default.
+    """
+
+    api_key: Optional[str] = None
+    api_base: Optional[str] = None
+    cache_path: Optional[str] = None
+    cache_size_mb: float = 512
+    concurrency: int = 1
+    requests_per_minute: Optional[int] = None
+    tokens_per_minute: Optional[int] = None
+    max_retries: int = 6
+    model: str = "text-davinci-002"
+    simple: bool = False
+    num_samples: int = 3
+    batch_size: int = 1
+    triage: bool = False
+    triage_classes: Sequence[str] = IGNORABLE_CLASSES
+    resume: bool = False
+    adaptive: bool = False
+    max_samples: Optional[int] = None
+    max_budget: Optional[float] = None
+    spend_cap: Optional[float] = None
+    token_cap: Optional[int] = None
+    stream: bool = False
+    chunk_size: int = 1000
+    num_examples: Optional[int] = None
+    example_token_budget: Optional[int] = None
+    cascade_model: Optional[str] = None
+    cascade_wer_threshold: Optional[float] = None
+    max_repairs: int = 2
+    result_store: Optional[str] = None
+    build: Optional[str] = None
+    compare_build: Optional[str] = None
+    metrics: bool = False
+    metrics_textfile: Optional[str] = None
+    progress_interval: Optional[float] = None
+    wer_processes: Optional[int] = None
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(**{field.name: getattr(args, field.name) for field in fields(cls) if hasattr(args, field.name)})
+
+    def get_cache(self):
+        return ContinuationCache(self.cache_path, max_size_mb=self.cache_size_mb) if self.cache_path else None
+
+    def get_language_model(self, model=None, cache=None, metrics=None):
+        """Client of the model (the main one by default), with its own rate limiter as quotas are per model"""
+        return LanguageModel(
+            model=model or self.model,
+            api_key=self.api_key,
+            api_base=self.api_base,
+            cache=cache,
+            requests_per_minute=self.requests_per_minute,
+            tokens_per_minute=self.tokens_per_minute,
+            max_retries=self.max_retries,
+            metrics=metrics,
+        )
+
+    def get_triage(self):
+        """Triage that scores utterances whose only differences the prompt says to ignore, if it's turned on"""
+        return Triage(self.triage_classes) if self.triage else None
+
+
+def add_lm_args(parser, concurrency=1):
+    """Flags for reaching the completion api: credentials, continuation cache and rate limits"""
+    # pylint: disable=line-too-long
+    # fmt: off
+    parser.add_argument("--api_key", type=str, default=None, help="api key for open ai")  # noqa:  E201
+    parser.add_argument("--api_base", type=str, default=None, help="base url of the completion api, e.g. a local stand-in server")  # noqa:  E201
+    parser.add_argument("--cache_path", type=str, default=DEFAULT_CACHE_PATH, help="path to sqlite continuation cache, pass an empty string to disable")  # noqa:  E201
+    parser.add_argument("--cache_size_mb", type=float, default=512, help="evict least recently used continuations once the cache is bigger than this")  # noqa:  E201
+    parser.add_argument("--concurrency", type=int, default=concurrency, help="number of requests to keep in flight at once")  # noqa:  E201
+    parser.add_argument("--requests_per_minute", type=int, default=None, help="requests per minute quota to stay within")  # noqa:  E201
+    parser.add_argument("--tokens_per_minute", type=int, default=None, help="tokens per minute quota to stay within")  # noqa:  E201
+    parser.add_argument("--max_retries", type=int, default=6, help="times to retry a request on rate limit or server errors")  # noqa:  E201
+    # fmt: on
+
+
+def add_voting_args(parser):
+    """Flags for how each utterance is voted on: the model, samples, batching and triage"""
+    # pylint: disable=line-too-long
+    # fmt: off
+    parser.add_argument("--model", type=str, default="text-davinci-002", choices=list(models2cost), help="model to score utterances with")  # noqa:  E201
+    parser.add_argument("--num_samples", type=int, default=3, help="number of times to sample GPT3 for majority voting")  # noqa:  E201
+    parser.add_argument("--batch_size", type=int, default=1, help="number of utterances to pack into each prompt after one shared few shot prefix")  # noqa:  E201
+    parser.add_argument("--triage", action="store_true", help="score utterances whose only differences are ignorable locally instead of with the LM")  # noqa:  E201
+    parser.add_argument("--triage_classes", type=str, nargs="+", default=IGNORABLE_CLASSES, choices=IGNORABLE_CLASSES, help="differences the triage can ignore")  # noqa:  E201
+    # fmt: on
+
+
+def add_scoring_args(parser):
+    """Flags of a scoring run shared by the mer.run and mer.test CLIs"""
+    add_lm_args(parser)
+    add_voting_args(parser)
+    # pylint: disable=line-too-long
+    # fmt: off
+    parser.add_argument("--resume", action="store_true", help="skip examples already in the checkpoint from a previous run")  # noqa:  E201
+    parser.add_argument("--adaptive", action="store_true", help="sample incrementally and stop once the majority vote can't change")  # noqa:  E201
+    parser.add_argument("--max_samples", type=int, default=None, help="cap on samples drawn on ties or parse failures in adaptive mode (default 2 * num_samples)")  # noqa:  E201
+    parser.add_argument("--max_budget", type=float, default=None, help="run unattended if the estimated cost in dollars is within this budget, otherwise exit")  # noqa:  E201
+    parser.add_argument("--spend_cap", type=float, default=None, help="stop admitting new requests once this many dollars have been spent")  # noqa:  E201
+    parser.add_argument("--token_cap", type=int, default=None, help="stop admitting new requests once this many tokens have been used")  # noqa:  E201
+    parser.add_argument("--stream", action="store_true", help="score examples a chunk at a time and write results to output_json as JSONL lines")  # noqa:  E201
+    parser.add_argument("--chunk_size", type=int, default=1000, help="number of examples to score at once in stream mode")  # noqa:  E201
+    parser.add_argument("--num_examples", type=int, default=None, help="only include this many of the most relevant few shot examples in each prompt")  # noqa:  E201
+    parser.add_argument("--example_token_budget", type=int, default=None, help="cap on the tokens of few shot examples retrieved for each prompt")  # noqa:  E201
+    parser.add_argument("--cascade_model", type=str, default=None, choices=list(models2cost), help="cheaper model to score every utterance with first, escalating to --model on disagreement")  # noqa:  E201
+    parser.add_argument("--cascade_wer_threshold", type=float, default=None, help="also escalate utterances with a WER above this in cascade mode")  # noqa:  E201
+    parser.add_argument("--max_repairs", type=int, default=2, help="rounds of re-requesting samples that failed to parse")  # noqa:  E201
+    parser.add_argument("--result_store", type=str, nargs="?", default=None, const=DEFAULT_STORE_PATH, help=f"reuse per-utterance results across runs from this sqlite store ({DEFAULT_STORE_PATH} if no path is given)")  # noqa:  E201
+    parser.add_argument("--build", type=str, default=None, help="name of the ASR build being scored, so its results can be compared with later builds")  # noqa:  E201
+    parser.add_argument("--compare_build", type=str, default=None, help="write a report of utterances that moved since this earlier build")  # noqa:  E201
+    parser.add_argument("--metrics", action="store_true", help="time each stage and API request and report the latency percentiles and throughput in the usage block")  # noqa:  E201
+    parser.add_argument("--metrics_textfile", type=str, default=None, help="path of a Prometheus textfile to keep updated with the run metrics (implies --metrics)")  # noqa:  E201
+    parser.add_argument("--progress_interval", type=float, default=None, help="print a progress line every this many seconds (implies --metrics)")  # noqa:  E201
+    parser.add_argument("--wer_processes", type=int, default=None, help="number of processes to align transcripts with (default one per cpu)")  # noqa:  E201
+    # fmt: on
@@ -0,0 +1,165 @@
+import sys
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # pragma: no cover
+    tiktoken = None
+
+from mer.lm import models2cost
+
+# Assumed seconds per request when working out how long a run will take
+DEFAULT_LATENCY = 2.0
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model):
+    """BPE encoding used by the model, or None if tiktoken or the encoding files aren't available"""
+    if tiktoken is None:
+        print("WARNING: tiktoken not installed, estimating tokens as ~4 chars each")
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception as e:  # pylint: disable=broad-except
+        # Encoding files are downloaded on first use so this fails when offline
+        print(f"WARNING: Couldn't load tokenizer for {model} ({type(e).__name__}), estimating tokens as ~4 chars each")
+        return None
+
+
+def count_tokens(text, model):
+    encoding = get_encoding(model)
+    if encoding is None:
+        return len(text) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+class CostPlanner:
+    """
+    Works out the tokens, cost and wall time of a run before it starts. The shared few shot prefix
+    is tokenized once and each utterance only adds the tokens of its own reference and recognised lines.
+    """
+
+    def __init__(
+        self,
+        prompt,
+        model,
+        num_samples=1,
+        concurrency=1,
+        requests_per_minute=None,
+        tokens_per_minute=None,
+        latency=DEFAULT_LATENCY,
+    ):
+        self.prompt = prompt
+        self.model = model
+        self.num_samples = num_samples
+        self.concurrency = concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.latency = latency
+
+        self.prefix_tokens = count_tokens("\n".join(prompt.base), model)
+        if getattr(prompt, "index", None) is not None:
+            self.header_tokens = count_tokens("\n".join(prompt.header), model)
+        # Expect continuations to be about as long as the reasoning and result of the few shot examples
+        answers = [line for line in prompt.base if line.startswith("Reasoning:") or line.startswith("Result:")]
+        answer_tokens = count_tokens("\n".join(answers), model) - count_tokens("Reasoning:", model)
+        self.completion_tokens = max(answer_tokens // max(len(answers) // 2, 1), 1)
+
+    def count_prefix_tokens(self, pairs, alignments=None):
+        """
+        Tokens before the utterances, which depend on the pairs when few shot examples are retrieved per prompt.
+        The examples selected when the pairs' prompt was built are reused rather than ranked again.
+        """
+        if getattr(self.prompt, "index", None) is None:
+            return self.prefix_tokens
+        selected = self.prompt.select_examples(pairs, alignments)
+        return self.header_tokens + sum(self.prompt.example_tokens[i] for i in selected)
+
+    def count_utterance_tokens(self, ref, rec, index=None):
+        if index is None:
+            return count_tokens(f"\nReference: {ref}\nRecognised: {rec}\nReasoning:", self.model)
+        return count_tokens(f"\nReference {index}: {ref}\nRecognised {index}: {rec}\n", self.model)
+
+    def plan(self, pairs, batch_size=1, alignments=None, num_samples=None, max_tokens=None):
+        """
+        Return the expected requests, tokens, cost and wall time of scoring the pairs. num_samples overrides the
+        planner's and max_tokens plans every sample at that many completion tokens (e.g. for re-requests of
+        samples that were cut off).
+        """
+        alignments = alignments or [None] * len(pairs)
+        requests = 0
+        prompt_tokens = 0
+        if batch_size > 1:
+            instruction_tokens = count_tokens("Give the reasoning and result for each of the following\n", self.model)
+            for start in range(0, len(pairs), batch_size):
+                batch = pairs[start : start + batch_size]  # noqa: E203
+                requests += 1
+                batch_alignments = alignments[start : start + batch_size]  # noqa: E203
+                prompt_tokens += self.count_prefix_tokens(batch, batch_alignments) + instruction_tokens
+                prompt_tokens += sum(self.count_utterance_tokens(ref, rec, i + 1) for i, (ref, rec) in enumerate(batch))
+        else:
+            requests = len(pairs)
+            prompt_tokens = sum(
+                self.count_prefix_tokens([pair], [alignment]) + self.count_utterance_tokens(*pair)
+                for pair, alignment in zip(pairs, alignments)
+            )
+
+        completion_tokens = len(pairs) * (max_tokens or self.completion_tokens) * (num_samples or self.num_samples)
+        total_tokens = prompt_tokens + completion_tokens
+        cost = models2cost[self.model] * total_tokens / 1000
+
+        # Run is bound by whichever is slowest: latency with the requests in flight or the rate limits
+        wall_time = requests * self.latency / self.concurrency
+        if self.requests_per_minute:
+            wall_time = max(wall_time, 60 * requests / self.requests_per_minute)
+        if self.tokens_per_minute:
+            wall_time = max(wall_time, 60 * total_tokens / self.tokens_per_minute)
+
+        return {
+            "requests": requests,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": total_tokens,
+            "cost": round(cost, 2),
+            "wall_time": round(wall_time, 1),
+        }
+
+
+def print_plan(plan):
+    minutes = plan["wall_time"] / 60
+    print(
+        f"PLAN: #requests: {plan['requests']}, #tokens: {plan['total_tokens']} "
+        f"({plan['prompt_tokens']} prompt + {plan['completion_tokens']} completion), "
+        f"cost: ${plan['cost']:.2f}, expected wall time: {minutes:.1f} mins"
+    )
+
+
+class SpendApproval:
+    """
+    Approves plans before any money is spent. With max_budget set, runs go ahead unattended as long as
+    every plan approved so far fits in the budget. Otherwise the user is asked once, which for a streamed
+    run only covers the first chunk as the size of the corpus isn't known up front.
+    """
+
+    def __init__(self, max_budget=None, stream=False):
+        self.max_budget = max_budget
+        self.stream = stream
+        self.approved_cost = 0.0
+        self.asked = False
+
+    def __call__(self, plan):
+        print_plan(plan)
+        if self.max_budget is not None:
+            if self.approved_cost + plan["cost"] > self.max_budget:
+                remaining = self.max_budget - self.approved_cost
+                print(f"Estimated cost ${plan['cost']:.2f} is over the remaining budget of ${remaining:.2f}, exiting")
+                sys.exit(1)
+        elif not self.asked:
+            if self.stream:
+                print("Streaming so this only covers the first chunk, use --spend_cap to limit the whole run")
+            accept_strings = ["Y", "y", "Yes", "yes"]
+            if input(f"Do you want to spend ${plan['cost']:.2f}? Enter Y/N to continue: ") not in accept_strings:
+                print("You didn't want to proceed, exiting")
+                sys.exit(1)
+            self.asked = True
+        self.approved_cost += plan["cost"]
@@ -1,8 +1,22 @@
 import copy
 import json
 import random
+import re
 from abc import ABC, abstractmethod
 
+from mer.planner import count_tokens
+from mer.retrieval import ExampleIndex
+
+
+# Matches each numbered answer in a batch continuation e.g. "Reasoning 2: ...\nResult 2: ..."
+BATCH_ANSWER_PATTERN = re.compile(r"^Reasoning (\d+):(.*)\nResult \1:(.*)$", re.MULTILINE)
+# Error counts and penalty in a result line e.g. "Result: 1 minor + 0 standard + 1 serious = 1.25 penalty"
+COUNT_PATTERN = re.compile(r"(\d+)\s*(minor|standard|serious)\b")
+PENALTY_PATTERN = re.compile(r"(\d+(?:\.\d+)?)\s*penalty")
+RESULT_LINE_PATTERN = re.compile(r"^\s*Result\b", re.MULTILINE)
+# Selections of retrieved examples kept for reuse, a few chunks' worth of prompts
+MAX_SELECTIONS = 100_000
+
 
 class PromptBase(ABC):
     """
@@ -120,7 +134,9 @@ class PromptMultiple(PromptBase):
     It can also find the result given the LM output.
     """
 
-    def __init__(self, config, simple=False, seed=10):
+    def __init__(
+        self, config, simple=False, seed=10, num_examples=None, example_token_budget=None, model="text-davinci-002"
+    ):
         self.config = config
         self.simple = simple
         random.seed(seed)
@@ -128,6 +144,17 @@ class PromptMultiple(PromptBase):
         self.error2score = self.get_score_mapping()
         self.base = self.get_prompt_base()
 
+        # Optionally only include the few shot examples most relevant to each utterance
+        self.num_examples = num_examples
+        self.example_token_budget = example_token_budget
+        self.index = None
+        # Examples selected for the pairs of each prompt built, so planning its cost doesn't rank them again
+        self.selections = {}
+        if num_examples is not None or example_token_budget is not None:
+            examples = [self.unpack_example(example)[1:] for example in self.config["examples"]]
+            self.index = ExampleIndex(examples)
+            self.example_tokens = [count_tokens("\n".join(lines), model) for lines in self.example_lines]
+
     @staticmethod
     def unpack_example(example):
         if example.get("minor", None) is not None:
@@ -176,17 +203,50 @@ class PromptMultiple(PromptBase):
             )
 
         random.shuffle(self.config["examples"])  # shuffle so no order to examples
-        for example in self.config["examples"]:
-            error_count_dict, ref, rec = self.unpack_example(example)
-            penalty = self.get_penalty(error_count_dict)
-            minor, standard, serious, reason = self.unpack_error_counts(error_count_dict)
-
-            base.append(f"Reference: {ref}")
-            base.append(f"Recognised: {rec}")
-            base.append(f"Reasoning: {reason}")
-            base.append(f"Result: {minor} minor + {standard} standard + {serious} serious = {penalty} penalty\n")
-
-        return base
+        self.header = base
+        self.example_lines = [self.format_example(example) for example in self.config["examples"]]
+        return base + [line for lines in self.example_lines for line in lines]
+
+    def format_example(self, example):
+        error_count_dict, ref, rec = self.unpack_example(example)
+        penalty = self.get_penalty(error_count_dict)
+        minor, standard, serious, reason = self.unpack_error_counts(error_count_dict)
+        return [
+            f"Reference: {ref}",
+            f"Recognised: {rec}",
+            f"Reasoning: {reason}",
+            f"Result: {minor} minor + {standard} standard + {serious} serious = {penalty} penalty\n",
+        ]
+
+    def select_examples(self, pairs, alignments=None):
+        """
+        Most relevant examples that fit in the budget, ordered so the most relevant is nearest the utterance.
+        The selection is recorded, the oldest one making way once MAX_SELECTIONS are held.
+        """
+        key = tuple(pairs)
+        if key in self.selections:
+            return self.selections[key]
+        selected, tokens = [], 0
+        for i in self.index.rank(pairs, alignments):
+            if self.num_examples is not None and len(selected) >= self.num_examples:
+                break
+            if self.example_token_budget is not None and tokens + self.example_tokens[i] > self.example_token_budget:
+                continue
+            selected.append(i)
+            tokens += self.example_tokens[i]
+        if len(self.selections) >= MAX_SELECTIONS:
+            del self.selections[next(iter(self.selections))]
+        self.selections[key] = selected[::-1]
+        return self.selections[key]
+
+    def get_base(self, pairs, alignments=None):
+        """
+        Error descriptions followed by the few shot examples to use when scoring the pairs.
+        Alignments already built for the pairs are reused to retrieve the examples.
+        """
+        if self.index is None:
+            return self.base
+        return self.header + [line for i in self.select_examples(pairs, alignments) for line in self.example_lines[i]]
 
     def get_score_mapping(self):
         error2score = {}
@@ -194,39 +254,65 @@ class PromptMultiple(PromptBase):
             error2score[error_type] = self.config["errors"][error_type]["score"]
         return error2score
 
-    def create_prompt(self, ref, rec):
-        prompt = copy.deepcopy(self.base)
+    def create_prompt(self, ref, rec, alignment=None):
+        prompt = copy.deepcopy(self.get_base([(ref, rec)], [alignment]))
         prompt.append(f"Reference: {ref}")
         prompt.append(f"Recognised: {rec}")
         prompt.append("Reasoning:")
         return "\n".join(prompt)
 
+    def create_batch_prompt(self, pairs, alignments=None):
+        """Pack several numbered utterances after one shared copy of the base prompt"""
+        prompt = copy.deepcopy(self.get_base(pairs, alignments))
+        prompt.append(f"Give the reasoning and result for each of the following {len(pairs)} utterances.\n")
+        for i, (ref, rec) in enumerate(pairs, 1):
+            prompt.append(f"Reference {i}: {ref}")
+            prompt.append(f"Recognised {i}: {rec}\n")
+        prompt.append("Reasoning 1:")
+        return "\n".join(prompt)
+
+    @staticmethod
+    def split_batch_continuation(text, batch_size):
+        """
+        Split a continuation of a batch prompt into one continuation per utterance in the same
+        format as single utterance prompting. Utterances whose answer is missing are None.
+        """
+        # The prompt ends with "Reasoning 1:" so add it back before matching the numbered answers
+        text = "Reasoning 1: " + text.strip()
+        continuations = [None] * batch_size
+        for match in BATCH_ANSWER_PATTERN.finditer(text):
+            index = int(match.group(1)) - 1
+            if 0 <= index < batch_size and continuations[index] is None:
+                continuations[index] = f"{match.group(2).strip()}\nResult: {match.group(3).strip()}"
+        return continuations
+
+    @classmethod
+    def split_batch_continuations(cls, texts, batch_size):
+        """
+        Continuations of each utterance across every sampled continuation of a batch prompt,
+        None for utterances whose answer is missing from any sample.
+        """
+        samples = [cls.split_batch_continuation(text, batch_size) for text in texts]
+        continuations_list = [[sample[i] for sample in samples] for i in range(batch_size)]
+        return [None if None in continuations else continuations for continuations in continuations_list]
+
     def get_result(self, text):
         assert text is not None, "Text is empty"
+        # Get reason from first line and result (containing error counts) on the second line
+        # e.g. Result: 1 minor + 0 standard + 1 serious = 1.25 penalty
         lines = text.strip().split("\n")
-        try:
-            # Get reason from first line and result (containing error counts) on the second line
-            reason, result = lines[0], lines[1]
-            # Unpack the counts from result line
-            # e.g. Result: 1 minor + 0 standard + 1 serious = 1.25 penalty
-            minor, standard, serious, penalty = 0, 0, 0, None
-            if "minor" in result:
-                minor = result.split("minor")[0].strip().split()[-1]
-            if "standard" in result:
-                standard = result.split("standard")[0].strip().split()[-1]
-            if "serious" in result:
-                serious = result.split("serious")[0].strip().split()[-1]
-            if "penalty" in result:
-                penalty = float(result.split("penalty")[0].strip().split()[-1])
-            error_count_dict = {
-                "minor": minor,
-                "standard": standard,
-                "serious": serious,
-                "reason": reason,
-            }
-        except IndexError:
+        if len(lines) < 2 or COUNT_PATTERN.search(lines[1]) is None:
             print(f"Bad continuation from LM as can't unpack items {text}")
-            return None, None, None
+            return None, None
+        counts = {error_type: count for count, error_type in COUNT_PATTERN.findall(lines[1])}
+        penalty = PENALTY_PATTERN.search(lines[1])
+        penalty = float(penalty.group(1)) if penalty is not None else None
+        error_count_dict = {
+            "minor": counts.get("minor", 0),
+            "standard": counts.get("standard", 0),
+            "serious": counts.get("serious", 0),
+            "reason": lines[0],
+        }
 
         penalty_from_counts = self.get_penalty(error_count_dict)
 
@@ -234,3 +320,8 @@ class PromptMultiple(PromptBase):
             print(f"WARNING: LM bad at maths! It said {penalty} but should be {penalty_from_counts}.")
 
         return error_count_dict, penalty_from_counts
+
+    @staticmethod
+    def is_truncated(text):
+        """Continuations that never reached the result line were most likely cut off by max_tokens"""
+        return RESULT_LINE_PATTERN.search(text) is None
@@ -0,0 +1,118 @@
+import random
+import time
+
+import openai
+
+# Errors worth retrying, anything else (e.g. bad request or authentication) fails straight away
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIError,
+    openai.error.Timeout,
+    openai.error.APIConnectionError,
+)
+
+
+class TokenBucket:
+    """
+    Token bucket that refills at limit_per_minute / 60 per second up to a burst of limit_per_minute.
+    Callers reserve what they need straight away (the balance can go negative) and are told how long to
+    wait, so requests are admitted in the order they arrive without needing a lock.
+    """
+
+    def __init__(self, limit_per_minute):
+        self.capacity = limit_per_minute
+        self.rate = limit_per_minute / 60
+        self.tokens = limit_per_minute
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        """Take amount from the bucket and return the number of seconds to wait before using it"""
+        self.refill()
+        self.tokens -= min(amount, self.capacity)
+        return max(0.0, -self.tokens / self.rate)
+
+    def refund(self, amount):
+        """Give back tokens that were reserved but not used (e.g. the estimate was too high)"""
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class RateLimiter:
+    """Requests per minute and tokens per minute limits, either of which can be None for no limit"""
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+
+    def reserve(self, tokens):
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(tokens))
+        return wait
+
+    def refund(self, tokens):
+        if self.tokens is not None and tokens > 0:
+            self.tokens.refund(tokens)
+
+
+def get_retry_delay(error, attempt, backoff_base=1.0, backoff_max=60.0):
+    """Exponential backoff with jitter, waiting at least as long as the server's retry-after header asks"""
+    delay = min(backoff_max, backoff_base * 2**attempt) * random.uniform(0.5, 1.0)
+    headers = getattr(error, "headers", None) or {}
+    for header, scale in [("retry-after-ms", 0.001), ("retry-after", 1.0)]:
+        try:
+            return max(delay, float(headers[header]) * scale)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return delay
+
+
+def is_retryable(error):
+    if isinstance(error, openai.error.APIError):
+        # Only retry generic api errors if the server is at fault
+        return error.http_status is None or error.http_status >= 500
+    return isinstance(error, RETRYABLE_ERRORS)
+
+
+class SpendCapReached(Exception):
+    """Raised for a request that isn't admitted because the spend cap has been reached"""
+
+
+class SpendCap:
+    """
+    Live accounting of tokens used against a dollar and/or token cap. Once the cap is reached no new
+    requests are admitted, although requests already in flight are allowed to finish.
+    """
+
+    def __init__(self, cost_per_1k_tokens, max_cost=None, max_tokens=None, spent_tokens=0, spent_cost=None):
+        self.cost_per_1k_tokens = cost_per_1k_tokens
+        self.max_cost = max_cost
+        self.max_tokens = max_tokens
+        self.spent_tokens = spent_tokens
+        if spent_cost is None:
+            spent_cost = cost_per_1k_tokens * spent_tokens / 1000
+        self.cost = spent_cost
+
+    @property
+    def reached(self):
+        if self.max_tokens is not None and self.spent_tokens >= self.max_tokens:
+            return True
+        return self.max_cost is not None and self.cost >= self.max_cost
+
+    def add(self, tokens, cost_per_1k_tokens=None):
+        """Tokens are costed at the rate of the model that used them so the cap can be shared between models"""
+        if cost_per_1k_tokens is None:
+            cost_per_1k_tokens = self.cost_per_1k_tokens
+        self.spent_tokens += tokens
+        self.cost += cost_per_1k_tokens * tokens / 1000
+
+    def admit(self):
+        if self.reached:
+            raise SpendCapReached(f"Spend cap reached after {self.spent_tokens} tokens (${self.cost:.2f})")
@@ -0,0 +1,66 @@
+import math
+from collections import Counter, defaultdict
+
+from mer.triage import Triage
+from mer.utils import Alignment
+
+NGRAM_SIZE = 3
+
+
+def get_diff_text(ref, rec, alignment=None):
+    """Words that differ between the transcripts, which is what makes one labelled example relevant to another"""
+    differences = Triage.get_differences(alignment if alignment is not None else Alignment(ref, rec))
+    if not differences:
+        return f"{ref} | {rec}".lower()
+    ref_words = " ".join(word for ref_words, _ in differences for word in ref_words)
+    rec_words = " ".join(word for _, rec_words in differences for word in rec_words)
+    return f"{ref_words} | {rec_words}".lower()
+
+
+def get_ngrams(text, n=NGRAM_SIZE):
+    text = f" {text} "
+    return Counter(text[i : i + n] for i in range(len(text) - n + 1))  # noqa: E203
+
+
+class ExampleIndex:
+    """
+    In-memory TF-IDF index over character n-grams of each labelled example's ref/rec diff. It's built once
+    and then ranks the examples by cosine similarity to the utterances being scored.
+    """
+
+    def __init__(self, pairs, ngram_size=NGRAM_SIZE):
+        self.ngram_size = ngram_size
+        documents = [get_ngrams(get_diff_text(ref, rec), ngram_size) for ref, rec in pairs]
+        document_frequency = Counter(ngram for document in documents for ngram in document)
+        self.idf = {
+            ngram: math.log((1 + len(documents)) / (1 + count)) + 1 for ngram, count in document_frequency.items()
+        }
+
+        # Inverted index from n-gram to the (example, weight) pairs that contain it
+        self.size = len(documents)
+        self.postings = defaultdict(list)
+        for i, document in enumerate(documents):
+            vector = self.get_vector(document)
+            for ngram, weight in vector.items():
+                self.postings[ngram].append((i, weight))
+
+    def get_vector(self, document):
+        vector = {ngram: count * self.idf.get(ngram, 0.0) for ngram, count in document.items()}
+        norm = math.sqrt(sum(weight * weight for weight in vector.values())) or 1.0
+        return {ngram: weight / norm for ngram, weight in vector.items() if weight > 0}
+
+    def get_similarities(self, pairs, alignments=None):
+        """Cosine similarity of every example to the pairs (batched pairs are treated as one query)"""
+        query = Counter()
+        for (ref, rec), alignment in zip(pairs, alignments or [None] * len(pairs)):
+            query.update(get_ngrams(get_diff_text(ref, rec, alignment), self.ngram_size))
+        similarities = [0.0] * self.size
+        for ngram, weight in self.get_vector(query).items():
+            for i, example_weight in self.postings.get(ngram, []):
+                similarities[i] += weight * example_weight
+        return similarities
+
+    def rank(self, pairs, alignments=None):
+        """Example indices from most to least relevant, ties kept in bank order"""
+        similarities = self.get_similarities(pairs, alignments)
+        return sorted(range(self.size), key=lambda i: -similarities[i])
@@ -1,27 +1,16 @@
 import argparse
+import os
 
+from mer.chunking import DEFAULT_MAX_WORDS, save_file_results, split_examples
+from mer.loader import DEFAULT_THREADS, load_dbl_examples, load_tar_examples, read_dbl
 from mer.mer import get_meaning_error_rate
+from mer.options import ScoringOptions, add_scoring_args
+from mer.wer import get_word_error_rate
 
 
-def convert_dbl_to_dict(ref_dbl, rec_dbl):
-    ref_list = ref_dbl.read().split("\n")
-    rec_list = rec_dbl.read().split("\n")
-
-    assert len(ref_list) == len(rec_list), "Length of reference and recognised dbls differ"
-
-    examples = []
-    for ref_file, rec_file in zip(ref_list, rec_list):
-        with open(ref_file, "r", encoding="utf-8") as ref_h, open(rec_file, "r", encoding="utf-8") as rec_h:
-            ref = ref_h.read().strip()
-            rec = rec_h.read().strip()
-
-            example = {
-                "reference": ref,
-                "recognised": rec,
-            }
-            examples.append(example)
-
-    return examples
+def convert_dbl_to_dict(ref_dbl, rec_dbl, threads=DEFAULT_THREADS):
+    """Lazily load examples from the transcripts listed in the dbls, reading many files at once"""
+    return load_dbl_examples(read_dbl(ref_dbl), read_dbl(rec_dbl), threads)
 
 
 def main():
@@ -29,22 +18,44 @@ def main():
     parser = argparse.ArgumentParser()
     # pylint: disable=line-too-long
     # fmt: off
-    parser.add_argument("--ref_dbl", type=argparse.FileType("r"), required=True, help="Dbl file containing paths to reference transcripts")  # noqa:  E201
-    parser.add_argument("--rec_dbl", type=argparse.FileType("r"), required=True, help="Dbl file containing paths to recognised transcripts")  # noqa:  E201
+    parser.add_argument("--ref_dbl", type=argparse.FileType("r"), default=None, help="Dbl file containing paths to reference transcripts")  # noqa:  E201
+    parser.add_argument("--rec_dbl", type=argparse.FileType("r"), default=None, help="Dbl file containing paths to recognised transcripts")  # noqa:  E201
+    parser.add_argument("--tar", type=str, nargs="+", default=None, help="tar shards of reference/<name> and recognised/<name> transcripts to use instead of dbls")  # noqa:  E201
+    parser.add_argument("--loader_threads", type=int, default=DEFAULT_THREADS, help="number of transcript files to read at once")  # noqa:  E201
     parser.add_argument("--prompt_config_path", type=str, default="./config/prompt.json", help="path to prompt config json")  # noqa:  E201
     parser.add_argument("--output_json", type=str, default="./results_dbl.json", help="path to output json to store results")  # noqa:  E201
-    parser.add_argument("--api_key", type=str, default=None, help="api key for open ai")  # noqa:  E201
-    parser.add_argument("--num_samples", type=str, default=3, help="number of times to sample GPT3 for majority voting")  # noqa:  E201
+    parser.add_argument("--sentences", action="store_true", help="split each transcript into aligned sentence units that are scored separately, then aggregated per file")  # noqa:  E201
+    parser.add_argument("--max_words", type=int, default=DEFAULT_MAX_WORDS, help="cap on aligned words in a sentence unit so prompts stay bounded")  # noqa:  E201
+    parser.add_argument("--wer_only", action="store_true", help="only calculate WER, which doesn't need the LM or an api key")  # noqa:  E201
     # fmt: on
+    add_scoring_args(parser)
     args = parser.parse_args()
 
-    examples = convert_dbl_to_dict(args.ref_dbl, args.rec_dbl)
+    if args.tar:
+        examples = load_tar_examples(args.tar)
+    else:
+        assert args.ref_dbl and args.rec_dbl, "Pass --ref_dbl and --rec_dbl or --tar"
+        examples = convert_dbl_to_dict(args.ref_dbl, args.rec_dbl, args.loader_threads)
+
+    if args.wer_only:
+        wer = get_word_error_rate(examples, args.output_json, processes=args.wer_processes)
+        print(f"wer: {wer:.2f}%")
+        return
+
+    if args.sentences:
+        # Long-form transcripts are scored as sentence units so prompt size doesn't grow with the recording
+        examples = split_examples(examples, max_words=args.max_words)
 
     meaning_error_rate, _ = get_meaning_error_rate(
-        examples, args.prompt_config_path, args.output_json, api_key=args.api_key, num_samples=args.num_samples
+        examples, args.prompt_config_path, args.output_json, ScoringOptions.from_args(args)
     )
     print(f"meaning_error_rate: {meaning_error_rate}%")
 
+    if args.sentences:
+        files_json = f"{os.path.splitext(args.output_json)[0]}_files.json"
+        file_results = save_file_results(args.output_json, files_json, stream=args.stream)
+        print(f"Saved results of {len(file_results)} files to {files_json}")
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,250 @@
+import argparse
+import asyncio
+import json
+import threading
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from mer.engine import pooled_session
+from mer.mer import score_examples
+from mer.options import ScoringOptions, add_lm_args, add_voting_args
+from mer.prompt import PromptMultiple
+from mer.triage import get_triage_vote
+from mer.utils import Alignment, calculate_meaning_error_rate, majority_voting
+
+# Seconds to wait for more requests to arrive before scoring what has been coalesced so far
+DEFAULT_MAX_WAIT = 0.05
+
+
+class ScoringService:
+    """
+    Long running scorer that keeps the prompt base, LM connection pool and continuation cache warm between calls.
+    Requests can come from any thread. Their pairs are queued on one event loop, where pairs arriving within
+    max_wait of each other are coalesced, identical pairs share one vote (including ones already in flight) and
+    the rest are scored with batched prompts or parallel single utterance prompts.
+    """
+
+    def __init__(
+        self,
+        prompt,
+        lm,
+        num_samples=3,
+        batch_size=1,
+        concurrency=8,
+        max_wait=DEFAULT_MAX_WAIT,
+        max_pending=256,
+        triage=None,
+    ):
+        self.prompt = prompt
+        self.lm = lm
+        self.num_samples = num_samples
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_wait = max_wait
+        self.max_pending = max_pending  # most pairs coalesced into one group
+        self.triage = triage
+        self.stats = Counter()
+
+        self.loop = asyncio.new_event_loop()
+        self.started = threading.Event()
+        self.thread = threading.Thread(target=self.loop.run_until_complete, args=(self.run(),), daemon=True)
+
+    def start(self):
+        self.thread.start()
+        self.started.wait()
+        return self
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.stopped.set)
+        self.thread.join()
+        self.loop.close()
+
+    async def run(self):
+        self.queue = asyncio.Queue()
+        self.stopped = asyncio.Event()
+        self.pending = {}  # pair -> future of its vote, shared by every request waiting on the pair
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        # LM requests are only started from the coalescing task so they all inherit the pooled session
+        async with pooled_session(self.concurrency):
+            coalescer = asyncio.ensure_future(self.coalesce())
+            self.started.set()
+            await self.stopped.wait()
+            coalescer.cancel()
+
+    async def coalesce(self):
+        while True:
+            group = [await self.queue.get()]
+            deadline = self.loop.time() + self.max_wait
+            while len(group) < self.max_pending:
+                timeout = deadline - self.loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    group.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self.stats["groups"] += 1
+            # Start scoring straight away so the next group can be collected while this one is in flight
+            asyncio.ensure_future(self.score_group(group))
+
+    async def get_continuations(self, prompt_string, max_tokens=64):
+        async with self.semaphore:
+            self.stats["lm_requests"] += 1
+            continuations, _ = await self.lm.get_continuation_async(
+                prompt_string, max_tokens=max_tokens, num_samples=self.num_samples
+            )
+            return continuations
+
+    async def get_batch_continuations(self, batch):
+        """Per-utterance continuations of one batch prompt, None for utterances missing from any sample"""
+        texts = await self.get_continuations(self.prompt.create_batch_prompt(batch), max_tokens=64 * len(batch))
+        return self.prompt.split_batch_continuations(texts, len(batch))
+
+    async def score_group(self, pairs):
+        try:
+            continuations_list = [None] * len(pairs)
+            if self.batch_size > 1:
+                batches = [pairs[i : i + self.batch_size] for i in range(0, len(pairs), self.batch_size)]  # noqa: E203
+                batch_results = await asyncio.gather(*(self.get_batch_continuations(batch) for batch in batches))
+                continuations_list = [continuations for results in batch_results for continuations in results]
+            # Single utterance prompts for everything not batched and for utterances the batch answer missed
+            fallback = [i for i, continuations in enumerate(continuations_list) if continuations is None]
+            single_results = await asyncio.gather(
+                *(self.get_continuations(self.prompt.create_prompt(*pairs[i])) for i in fallback)
+            )
+            for i, continuations in zip(fallback, single_results):
+                continuations_list[i] = continuations
+            for pair, continuations in zip(pairs, continuations_list):
+                self.pending.pop(pair).set_result(majority_voting(continuations, self.prompt))
+        except Exception as e:  # pylint: disable=broad-except
+            # Fail every request waiting on the group rather than leaving them hanging
+            for pair in pairs:
+                future = self.pending.pop(pair, None)
+                if future is not None:
+                    future.set_exception(e)
+
+    def get_vote(self, pair):
+        """Future of the pair's vote, joining one already queued or in flight"""
+        if pair in self.pending:
+            self.stats["coalesced"] += 1
+            return self.pending[pair]
+        future = self.loop.create_future()
+        classes = self.triage.classify(*pair) if self.triage is not None else None
+        if classes is not None:
+            self.stats["triaged"] += 1
+            future.set_result(get_triage_vote(classes))
+            return future
+        self.pending[pair] = future
+        self.queue.put_nowait(pair)
+        return future
+
+    async def get_votes(self, pairs):
+        self.stats["requests"] += 1
+        self.stats["utterances"] += len(pairs)
+        return await asyncio.gather(*(self.get_vote(pair) for pair in pairs))
+
+    def score(self, examples):
+        """Results for the examples in the same shape as the results entries of the output json, plus a summary"""
+        pairs = [tuple(self.prompt.unpack_example(example)[1:]) for example in examples]
+        votes = asyncio.run_coroutine_threadsafe(self.get_votes(pairs), self.loop).result()
+
+        totals = Counter()
+        wers = [Alignment(ref, rec).get_wer() for ref, rec in pairs]
+        results = list(score_examples(self.prompt, examples, votes, range(len(pairs)), wers, totals))
+        summary = {
+            "total_reference_count": totals["reference_count"],
+            "total_penalty": totals["penalty"],
+            # Utterances none of whose samples parsed have no result and don't count towards the rates
+            "unparseable": sum(1 for vote in votes if vote is None),
+            "coverage": round(totals["scored"] / totals["examples"], 4) if totals["examples"] else 0.0,
+        }
+        if totals["reference_count"] > 0:
+            meaning_error_rate = calculate_meaning_error_rate(totals["reference_count"], totals["penalty"])
+            summary["meaning_error_rate"] = round(meaning_error_rate, 2)
+            summary["wer"] = round(100 * totals["errors"] / totals["reference_count"], 2)
+        return {"results": results, "summary": summary}
+
+
+def get_server(service, host="127.0.0.1", port=8000):
+    """HTTP server with POST /score taking {"examples": [{"reference": ..., "recognised": ...}]} and GET /health"""
+
+    class Handler(BaseHTTPRequestHandler):
+        """Routes the requests to the scoring service and answers them in json"""
+
+        def send_json(self, status, response):
+            data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):  # noqa: N802
+            if self.path != "/health":
+                self.send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            self.send_json(200, {"status": "ok", "stats": dict(service.stats)})
+
+        def do_POST(self):  # noqa: N802
+            if self.path != "/score":
+                self.send_json(404, {"error": f"Unknown path {self.path}"})
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                # A single pair can be posted on its own rather than as a list of examples
+                examples = body["examples"] if "examples" in body else [body]
+                assert all("reference" in e and "recognised" in e for e in examples), "Examples need both transcripts"
+            except (ValueError, KeyError, TypeError, AssertionError) as e:
+                self.send_json(400, {"error": f"Bad request: {e}"})
+                return
+            try:
+                self.send_json(200, service.score(examples))
+            except Exception as e:  # pylint: disable=broad-except
+                self.send_json(500, {"error": f"{type(e).__name__}: {e}"})
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Serve MER scoring over HTTP with a warm prompt and cache")
+    # pylint: disable=line-too-long
+    # fmt: off
+    parser.add_argument("--prompt_config_path", type=str, default="./config/prompt_multiple.json", help="path to prompt config json")  # noqa:  E201
+    parser.add_argument("--host", type=str, default="127.0.0.1", help="address to listen on")  # noqa:  E201
+    parser.add_argument("--port", type=int, default=8000, help="port to listen on")  # noqa:  E201
+    parser.add_argument("--simple", action="store_true", help="only enumerate the error types in the prompt")  # noqa:  E201
+    parser.add_argument("--max_wait", type=float, default=DEFAULT_MAX_WAIT, help="seconds to wait for more requests to coalesce with")  # noqa:  E201
+    # fmt: on
+    add_lm_args(parser, concurrency=8)
+    add_voting_args(parser)
+    args = parser.parse_args()
+
+    options = ScoringOptions.from_args(args)
+    service = ScoringService(
+        PromptMultiple.from_file(args.prompt_config_path, simple=options.simple),
+        options.get_language_model(cache=options.get_cache()),
+        num_samples=options.num_samples,
+        batch_size=options.batch_size,
+        concurrency=options.concurrency,
+        max_wait=args.max_wait,
+        triage=options.get_triage(),
+    ).start()
+    server = get_server(service, args.host, args.port)
+    print(f"Serving MER on http://{args.host}:{server.server_address[1]}/score")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+DEFAULT_STORE_PATH = os.path.join("~", ".cache", "mer", "results.db")
+
+
+def get_settings_fingerprint(prompt, settings):
+    """Hash of the few shot prompt and every setting that affects how an utterance is scored"""
+    fingerprint = json.dumps(["\n".join(prompt.base), settings], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+
+class ResultStore:
+    """
+    On disk store of voted results keyed by a fingerprint of (ref, rec, prompt config, model and settings), so
+    re-scoring a reference set against a new ASR build only pays for the recognised transcripts that changed.
+    The per-utterance results of each named build are also kept so two builds can be diffed.
+    """
+
+    def __init__(self, store_path=DEFAULT_STORE_PATH):
+        self.store_path = os.path.expanduser(store_path)
+        if os.path.dirname(self.store_path):
+            os.makedirs(os.path.dirname(self.store_path), exist_ok=True)
+
+        self.conn = sqlite3.connect(self.store_path, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute("CREATE TABLE IF NOT EXISTS votes (fingerprint TEXT PRIMARY KEY, value TEXT, created REAL)")
+        self.conn.execute(
+            """CREATE TABLE IF NOT EXISTS builds (
+                build TEXT,
+                utterance INTEGER,
+                reference TEXT,
+                recognised TEXT,
+                penalty REAL,
+                meaning_error_rate REAL,
+                wer REAL,
+                PRIMARY KEY (build, utterance)
+            )"""
+        )
+
+    @staticmethod
+    def get_fingerprint(settings_fingerprint, ref, rec):
+        pair = json.dumps([settings_fingerprint, ref, rec], ensure_ascii=False)
+        return hashlib.sha256(pair.encode("utf-8")).hexdigest()
+
+    def get(self, fingerprint):
+        row = self.conn.execute("SELECT value FROM votes WHERE fingerprint = ?", (fingerprint,)).fetchone()
+        if row is None:
+            return None
+        voted_penalty, result = json.loads(row[0])
+        return voted_penalty, result
+
+    def put(self, fingerprint, vote):
+        value = json.dumps(vote, ensure_ascii=False)
+        self.conn.execute("INSERT OR REPLACE INTO votes VALUES (?, ?, ?)", (fingerprint, value, time.time()))
+
+    def clear_build(self, build):
+        self.conn.execute("DELETE FROM builds WHERE build = ?", (build,))
+
+    def add_build_results(self, build, results):
+        """Record (utterance index, result) pairs of a build"""
+        rows = [
+            (
+                build,
+                utterance,
+                result["reference"],
+                result["recognised"],
+                result["voted_penality"],
+                result["meaning_error_rate"],
+                result["wer"] if isinstance(result["wer"], (int, float)) else None,
+            )
+            for utterance, result in results
+        ]
+        self.conn.execute("BEGIN")
+        self.conn.executemany("INSERT OR REPLACE INTO builds VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.conn.execute("COMMIT")
+
+    def diff_builds(self, old_build, new_build):
+        """Utterances whose recognised transcript or score moved between the builds, matched by utterance index"""
+        rows = self.conn.execute(
+            """SELECT old.utterance, old.reference, new.reference, old.recognised, new.recognised,
+                      old.penalty, new.penalty, old.meaning_error_rate, new.meaning_error_rate, old.wer, new.wer
+               FROM builds AS old JOIN builds AS new ON old.utterance = new.utterance
+               WHERE old.build = ? AND new.build = ?
+               ORDER BY old.utterance""",
+            (old_build, new_build),
+        )
+        moved = []
+        summary = {"compared": 0, "changed_transcripts": 0, "improved": 0, "regressed": 0, "reference_mismatches": 0}
+        for (
+            utterance,
+            old_ref,
+            new_ref,
+            old_rec,
+            new_rec,
+            old_penalty,
+            new_penalty,
+            old_mer,
+            new_mer,
+            old_wer,
+            new_wer,
+        ) in rows:
+            summary["compared"] += 1
+            if old_ref != new_ref:
+                summary["reference_mismatches"] += 1
+            if old_rec == new_rec and old_penalty == new_penalty:
+                continue
+            summary["changed_transcripts"] += old_rec != new_rec
+            summary["improved"] += new_penalty < old_penalty
+            summary["regressed"] += new_penalty > old_penalty
+            moved.append(
+                {
+                    "utterance": utterance,
+                    "reference": new_ref,
+                    "old_recognised": old_rec,
+                    "new_recognised": new_rec,
+                    "old_penalty": old_penalty,
+                    "new_penalty": new_penalty,
+                    "mer_diff": round(new_mer - old_mer, 2),
+                    "wer_diff": round(new_wer - old_wer, 2) if old_wer is not None and new_wer is not None else None,
+                }
+            )
+        return {"old_build": old_build, "new_build": new_build, "summary": summary, "moved": moved}
+
+    def close(self):
+        self.conn.close()
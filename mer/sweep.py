@@ -0,0 +1,207 @@
+import argparse
+import itertools
+import json
+from collections import Counter
+from dataclasses import replace
+
+from mer.engine import map_in_order
+from mer.lm import models2cost
+from mer.mer import score_examples
+from mer.options import ScoringOptions, add_lm_args
+from mer.planner import DEFAULT_LATENCY, CostPlanner, SpendApproval
+from mer.prompt import PromptMultiple
+from mer.utils import calculate_meaning_error_rate, group_identical_pairs, majority_voting, read_examples
+from mer.wer import calculate_corpus_alignments, calculate_corpus_wer, get_wer_pool
+
+# Settings that can be swept, each configuration takes one value of every setting
+GRID_SETTINGS = ("prompt_config_path", "simple", "seed", "model", "num_samples")
+
+
+def get_configurations(grid):
+    """Every combination of the values in the grid as a list of settings dicts"""
+    values = [grid[setting] for setting in GRID_SETTINGS]
+    return [dict(zip(GRID_SETTINGS, combination)) for combination in itertools.product(*values)]
+
+
+def get_response_usage(response):
+    # Cache hits report zero usage so fall back to what the original request used
+    if response["usage"]["total_tokens"] == 0 and "cached_usage" in response:
+        return response["cached_usage"]
+    return response["usage"]
+
+
+def plan_requests(requests, samples_needed, planned, lms, concurrency=1):
+    """One plan that covers every request that isn't already cached"""
+    plan = Counter()
+    for model, prompt_string in requests:
+        num_samples = samples_needed[(model, prompt_string)]
+        if lms[model].is_cached(prompt_string, num_samples=num_samples):
+            continue
+        planner, pair, alignment = planned[(model, prompt_string)]
+        prompt_tokens = planner.count_prefix_tokens([pair], [alignment]) + planner.count_utterance_tokens(*pair)
+        completion_tokens = planner.completion_tokens * num_samples
+        plan.update(
+            {
+                "requests": 1,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "cost": models2cost[model] * (prompt_tokens + completion_tokens) / 1000,
+            }
+        )
+    if plan["requests"]:
+        plan["cost"] = round(plan["cost"], 2)
+        plan["wall_time"] = round(plan["requests"] * DEFAULT_LATENCY / concurrency, 1)
+    return plan
+
+
+def summarise_configuration(configuration, prompt, strings, responses, samples_needed, examples, pair_indices, wers):
+    """MER, WER and the tokens and cost the configuration would have used on its own"""
+    model, num_samples = configuration["model"], configuration["num_samples"]
+    votes, total_tokens = [], 0
+    for prompt_string in strings:
+        request = (model, prompt_string)
+        continuations, response = responses[request]
+        votes.append(majority_voting(continuations[:num_samples], prompt))
+        # Tokens this configuration would have used on its own, with completions scaled to its samples
+        usage = get_response_usage(response)
+        completion_share = usage["completion_tokens"] * num_samples / samples_needed[request]
+        total_tokens += usage["prompt_tokens"] + completion_share
+
+    totals = Counter()
+    mer_diffs = [
+        abs(result["mer_diff"])
+        for result in score_examples(prompt, examples, votes, pair_indices, wers, totals)
+        if "mer_diff" in result
+    ]
+    summary = {**configuration, "meaning_error_rate": 0.0, "meaning_error_rate_target": None, "wer": 0.0}
+    if totals["reference_count"] > 0:
+        meaning_error_rate = calculate_meaning_error_rate(totals["reference_count"], totals["penalty"])
+        summary["meaning_error_rate"] = round(meaning_error_rate, 2)
+        summary["wer"] = round(100 * totals["errors"] / totals["reference_count"], 2)
+    if totals["target_penalty"] > 0:
+        target = calculate_meaning_error_rate(totals["reference_count"], totals["target_penalty"])
+        summary["meaning_error_rate_target"] = round(target, 2)
+    summary["mean_abs_mer_diff"] = round(sum(mer_diffs) / len(mer_diffs), 2) if mer_diffs else None
+    summary["total_tokens"] = round(total_tokens)
+    summary["cost"] = round(models2cost[model] * total_tokens / 1000, 4)
+    return summary
+
+
+def sweep(examples, grid, output_json, options=None, **kwargs):
+    """
+    Score the examples with every configuration in the grid, sharing as much work as possible between them.
+    Each unique pair is aligned once, every prompt is sent once at the most samples any configuration needs (a
+    configuration with fewer samples votes on the first ones) and all requests go through one concurrent queue
+    and continuation cache. The api, cache and rate limit settings come from options, overridden by any kwargs.
+    Saves and returns a summary of each configuration for comparison.
+    """
+    options = replace(options or ScoringOptions(), **kwargs)
+    examples = list(examples)
+    pairs = [PromptMultiple.unpack_example(example)[1:] for example in examples]
+    unique_pairs, pair_indices = group_identical_pairs(pairs)
+    configurations = get_configurations(grid)
+
+    wer_pool = get_wer_pool(options.wer_processes)
+    try:
+        alignments = calculate_corpus_alignments(unique_pairs, wer_pool)
+    finally:
+        if wer_pool is not None:
+            wer_pool.shutdown()
+    wers = calculate_corpus_wer(pairs, alignments=[alignments[i] for i in pair_indices])
+
+    cache = options.get_cache()
+    lms = {model: options.get_language_model(model, cache) for model in grid["model"]}
+
+    # Prompts shared between configurations (e.g. differing only by num_samples) are requested once
+    prompts, prompt_strings, samples_needed, planned = [], [], {}, {}
+    for configuration in configurations:
+        prompt = PromptMultiple.from_file(
+            configuration["prompt_config_path"], simple=configuration["simple"], seed=configuration["seed"]
+        )
+        strings = [prompt.create_prompt(*pair, alignment) for pair, alignment in zip(unique_pairs, alignments)]
+        planner = CostPlanner(prompt, configuration["model"])
+        for pair, alignment, prompt_string in zip(unique_pairs, alignments, strings):
+            request = (configuration["model"], prompt_string)
+            samples_needed[request] = max(samples_needed.get(request, 0), configuration["num_samples"])
+            planned[request] = (planner, pair, alignment)
+        prompts.append(prompt)
+        prompt_strings.append(strings)
+    requests = list(samples_needed)
+    print(
+        f"Sweeping {len(configurations)} configurations over {len(unique_pairs)} unique pairs "
+        f"with {len(requests)} shared requests ({len(configurations) * len(unique_pairs)} without sharing)"
+    )
+
+    plan = plan_requests(requests, samples_needed, planned, lms, options.concurrency)
+    if plan["requests"]:
+        SpendApproval(options.max_budget)(plan)
+
+    async def worker(request):
+        model, prompt_string = request
+        return await lms[model].get_continuation_async(prompt_string, num_samples=samples_needed[request])
+
+    responses = dict(zip(requests, map_in_order(worker, requests, concurrency=options.concurrency)))
+
+    summaries = [
+        summarise_configuration(configuration, prompt, strings, responses, samples_needed, examples, pair_indices, wers)
+        for configuration, prompt, strings in zip(configurations, prompts, prompt_strings)
+    ]
+
+    spent_tokens = Counter()
+    for (model, _), (_, response) in responses.items():
+        spent_tokens[model] += response["usage"]["total_tokens"]
+    usage = {
+        "requests": len(requests),
+        "requests_without_sharing": len(configurations) * len(unique_pairs),
+        "total_tokens": sum(spent_tokens.values()),
+        "cost": round(sum(models2cost[model] * tokens / 1000 for model, tokens in spent_tokens.items()), 4),
+    }
+    print_table(summaries)
+    print(f"Sweep cost: ${usage['cost']:.2f} for {usage['total_tokens']} tokens over {usage['requests']} requests")
+
+    with open(output_json, "w", encoding="utf-8") as f:
+        json.dump({"configurations": summaries, "usage": usage}, f, indent=4)
+    return summaries
+
+
+def print_table(summaries):
+    columns = [*GRID_SETTINGS, "meaning_error_rate", "meaning_error_rate_target", "mean_abs_mer_diff", "wer", "cost"]
+    headers = ["prompt", "simple", "seed", "model", "samples", "MER", "MER target", "|mer_diff|", "WER", "cost ($)"]
+    rows = [["-" if summary[c] is None else str(summary[c]) for c in columns] for summary in summaries]
+    widths = [max(len(cell) for cell in column) for column in zip(headers, *rows)]
+    for row in [headers, *rows]:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description="Compare MER over a grid of prompt configs, seeds, models and samples")
+    # pylint: disable=line-too-long
+    # fmt: off
+    parser.add_argument("--test_json", type=str,default="./config/test_multiple.json", help="Json file containing examples with labels, or JSONL with one example per line")  # noqa:  E201
+    parser.add_argument("--prompt_config_paths", type=str, nargs="+", default=["./config/prompt_multiple.json"], help="prompt configs to compare, in the format of prompt_multiple.json")  # noqa:  E201
+    parser.add_argument("--simple", type=int, nargs="+", default=[0], dest="simple_grid", metavar="SIMPLE", choices=[0, 1], help="1 to only enumerate the error types in the prompt, 0 to describe them")  # noqa:  E201
+    parser.add_argument("--seeds", type=int, nargs="+", default=[10], help="seeds for shuffling the few shot examples")  # noqa:  E201
+    parser.add_argument("--models", type=str, nargs="+", default=["text-davinci-002"], choices=list(models2cost), help="models to compare")  # noqa:  E201
+    parser.add_argument("--num_samples", type=int, nargs="+", default=[3], dest="num_samples_grid", metavar="NUM_SAMPLES", help="numbers of samples for majority voting")  # noqa:  E201
+    parser.add_argument("--output_json", type=str, default="./sweep.json", help="path to output json to store the comparison")  # noqa:  E201
+    parser.add_argument("--max_budget", type=float, default=None, help="run unattended if the estimated cost in dollars is within this budget, otherwise exit")  # noqa:  E201
+    parser.add_argument("--wer_processes", type=int, default=None, help="number of processes to align transcripts with (default one per cpu)")  # noqa:  E201
+    # fmt: on
+    add_lm_args(parser)
+    args = parser.parse_args()
+
+    grid = {
+        "prompt_config_path": args.prompt_config_paths,
+        "simple": [bool(simple) for simple in args.simple_grid],
+        "seed": args.seeds,
+        "model": args.models,
+        "num_samples": args.num_samples_grid,
+    }
+    # The swept flags have their own names so only the api, cache and rate limit flags are taken as options
+    sweep(read_examples(args.test_json), grid, args.output_json, ScoringOptions.from_args(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,8 @@
 import argparse
-import json
 
 from mer.mer import get_meaning_error_rate
+from mer.options import ScoringOptions, add_scoring_args
+from mer.utils import read_examples
 
 
 def main():
@@ -9,20 +10,18 @@ def main():
     parser = argparse.ArgumentParser()
     # pylint: disable=line-too-long
     # fmt: off
-    parser.add_argument("--test_json", type=str,default="./config/test_multiple.json", help="Json file containing examples with labels")  # noqa:  E201
+    parser.add_argument("--test_json", type=str,default="./config/test_multiple.json", help="Json file containing examples with labels, or JSONL with one example per line")  # noqa:  E201
     parser.add_argument("--prompt_config_path", type=str, default="./config/prompt_multiple.json", help="path to prompt config json")  # noqa:  E201
     parser.add_argument("--output_json", type=str, default="./results.json", help="path to output json to store results")  # noqa:  E201
-    parser.add_argument("--api_key", type=str, default=None, help="api key for open ai")  # noqa:  E201
-    parser.add_argument("--num_samples", type=str, default=3, help="number of times to sample GPT3 for majority voting")  # noqa:  E201
     # fmt: on
+    add_scoring_args(parser)
     args = parser.parse_args()
 
-    with open(args.test_json, "r", encoding="utf-8") as f:
-        testset = json.load(f)
-        examples = testset["examples"]
+    # JSONL test sets are read lazily so in stream mode only one chunk is ever in memory
+    examples = read_examples(args.test_json)
 
     meaning_error_rate, accuracy = get_meaning_error_rate(
-        examples, args.prompt_config_path, args.output_json, api_key=args.api_key, num_samples=args.num_samples
+        examples, args.prompt_config_path, args.output_json, ScoringOptions.from_args(args)
     )
     print(f"meaning_error_rate: {meaning_error_rate}%, accuracy: {accuracy}%")
 
@@ -0,0 +1,185 @@
+from mer.utils import GAP, WORD_PATTERN
+
+# Differences the prompt tells the LM to ignore completely, in the order they're tried
+IGNORABLE_CLASSES = ("normalisation", "filler", "contraction", "number", "compound")
+
+FILLER_WORDS = {"ah", "eh", "er", "erm", "hm", "hmm", "mhm", "mm", "uh", "uhm", "um", "umm"}
+
+# Contractions are matched with their apostrophe so ones that are also words without it (e.g. we're/were,
+# it's/its, we'll/well) are only expanded when the apostrophe is really there
+CONTRACTIONS = {
+    "aren't": "are not",
+    "can't": "can not",
+    "cannot": "can not",
+    "couldn't": "could not",
+    "didn't": "did not",
+    "doesn't": "does not",
+    "don't": "do not",
+    "hadn't": "had not",
+    "hasn't": "has not",
+    "haven't": "have not",
+    "he's": "he is",
+    "i'll": "i will",
+    "i'm": "i am",
+    "isn't": "is not",
+    "it's": "it is",
+    "i've": "i have",
+    "let's": "let us",
+    "she's": "she is",
+    "shouldn't": "should not",
+    "that's": "that is",
+    "there's": "there is",
+    "they'll": "they will",
+    "they're": "they are",
+    "they've": "they have",
+    "wasn't": "was not",
+    "we'll": "we will",
+    "we're": "we are",
+    "weren't": "were not",
+    "we've": "we have",
+    "what's": "what is",
+    "won't": "will not",
+    "wouldn't": "would not",
+    "you'll": "you will",
+    "you're": "you are",
+    "you've": "you have",
+}
+
+UNITS = "zero one two three four five six seven eight nine ten eleven twelve thirteen fourteen fifteen sixteen".split()
+UNITS += "seventeen eighteen nineteen".split()
+NUMBER_WORDS = {word: i for i, word in enumerate(UNITS)}
+NUMBER_WORDS.update(
+    {word: 10 * i for i, word in enumerate("twenty thirty forty fifty sixty seventy eighty ninety".split(), 2)}
+)
+SCALES = {"hundred": 100, "thousand": 1000, "million": 1000000}
+
+
+def words_to_number(words):
+    """Value of a run of number words (e.g. two hundred and five) or a single digit string, otherwise None"""
+    if len(words) == 1 and words[0].isdigit():
+        return int(words[0])
+    total, current = 0, 0
+    for word in words:
+        if word in NUMBER_WORDS:
+            current += NUMBER_WORDS[word]
+        elif word == "hundred" and current:
+            current *= 100
+        elif word in SCALES and current:
+            total += current * SCALES[word]
+            current = 0
+        elif word != "and":
+            return None
+    return total + current if words and words[-1] != "and" else None
+
+
+def get_tokens(text):
+    """Words of the original text, keeping their apostrophes and hyphens, and its punctuation marks"""
+    return WORD_PATTERN.findall(text.replace("\u2019", "'"))
+
+
+def replace_numbers(tokens):
+    """Tokens with every run of number words (e.g. two hundred and five) replaced by its digits"""
+    result, run = [], []
+    for token in tokens + [None]:
+        word = token.lower() if token is not None else None
+        # "and" only carries a number on after a scale word (e.g. two hundred and five, not two and three)
+        if word in NUMBER_WORDS or word in SCALES or (run and run[-1] in SCALES and word == "and"):
+            run.append(word)
+            continue
+        # A trailing "and" joins the next words rather than being part of the number
+        trailing = []
+        while run and run[-1] == "and":
+            trailing.append(run.pop())
+        number = words_to_number(run) if run else None
+        result.extend(run if number is None else [str(number)])
+        result.extend(trailing)
+        if token is not None:
+            result.append(token)
+        run = []
+    return result
+
+
+class Triage:
+    """
+    Deterministic pre-classifier that scores an utterance as zero penalty without the LM when the tokens of
+    both original transcripts are equal once the ignorable classes of difference are removed. Anything else,
+    including any other apostrophe or punctuation difference, is left for the LM to score.
+    """
+
+    def __init__(self, ignorable=IGNORABLE_CLASSES):
+        unknown = set(ignorable) - set(IGNORABLE_CLASSES)
+        assert not unknown, f"Unknown triage classes {unknown}, choose from {IGNORABLE_CLASSES}"
+        self.ignorable = [c for c in IGNORABLE_CLASSES if c in ignorable]
+
+    @staticmethod
+    def get_differences(alignment):
+        """Runs of consecutive mismatched words in the alignment as (ref words, rec words)"""
+        differences, ref_words, rec_words = [], [], []
+        for ref, rec in alignment.pairs + [(None, None)]:
+            if ref == rec:
+                if ref_words or rec_words:
+                    differences.append((ref_words, rec_words))
+                    ref_words, rec_words = [], []
+                continue
+            if ref != GAP:
+                ref_words.append(ref)
+            if rec != GAP:
+                rec_words.append(rec)
+        return differences
+
+    @staticmethod
+    def apply(tokens, difference_class):
+        """Tokens with the differences of one class removed"""
+        if difference_class == "normalisation":
+            # Case and a missing full stop at the end of the utterance
+            tokens = [token.lower() for token in tokens]
+            return tokens[:-1] if tokens and tokens[-1] == "." else tokens
+        if difference_class == "filler":
+            # Fillers go along with a comma straight after them
+            kept, dropped = [], False
+            for token in tokens:
+                if token.lower() in FILLER_WORDS or (dropped and token == ","):
+                    dropped = token != ","
+                    continue
+                kept.append(token)
+                dropped = False
+            return kept
+        if difference_class == "contraction":
+            return " ".join(CONTRACTIONS.get(token.lower(), token) for token in tokens).split()
+        if difference_class == "number":
+            return replace_numbers(tokens)
+        # Hyphenated compound written as separate words
+        return [part for token in tokens for part in token.split("-") if part]
+
+    def is_equal(self, ref_tokens, rec_tokens, classes):
+        for difference_class in self.ignorable:
+            if difference_class in classes:
+                ref_tokens = self.apply(ref_tokens, difference_class)
+                rec_tokens = self.apply(rec_tokens, difference_class)
+        return ref_tokens == rec_tokens
+
+    def classify(self, ref_text, rec_text):
+        """
+        Classes of difference needed to make the transcripts' tokens equal if they're all ignorable, otherwise
+        None. Starting from every ignorable class, each one the tokens are still equal without is dropped.
+        """
+        ref_tokens, rec_tokens = get_tokens(ref_text), get_tokens(rec_text)
+        classes = list(self.ignorable)
+        if not self.is_equal(ref_tokens, rec_tokens, classes):
+            return None
+        for difference_class in self.ignorable:
+            fewer = [c for c in classes if c != difference_class]
+            if self.is_equal(ref_tokens, rec_tokens, fewer):
+                classes = fewer
+        return sorted(classes)
+
+
+def get_triage_vote(classes):
+    """Same shape as the majority vote so triaged utterances are reported alongside the LM ones"""
+    return 0.0, {
+        "predictions": [],
+        "voted_penality": 0.0,
+        "vote_count": 0,
+        "resolved_by": "triage",
+        "triage_classes": classes,
+    }
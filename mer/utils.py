@@ -1,3 +1,4 @@
+import itertools
 import json
 import pandas
 import re
@@ -9,6 +10,7 @@ GAP = "***"
 
 
 def majority_voting(continuations, prompt):
+    """Voted penalty and result of the continuations, or None if none of them could be parsed"""
     # Loop over text in continuations and extract results
     predictions = []
     penalities = []
@@ -17,8 +19,12 @@ def majority_voting(continuations, prompt):
         penalities.append(penalty)
         predictions.append(error_counts_dict)
 
-    # Run majority voting given the predicted error tpes
-    counts = Counter(penalities)
+    # Run majority voting given the predicted error tpes (ignoring continuations that failed to parse)
+    counts = Counter(penalty for penalty in penalities if penalty is not None)
+    if not counts:
+        # A zero penalty would count the utterance as perfectly scored, so leave it out like an unscored one
+        print("WARNING: No continuations could be parsed so leaving this utterance unscored")
+        return None
     voted_penality, vote_count = counts.most_common()[0]
 
     result = {
@@ -30,116 +36,204 @@ def majority_voting(continuations, prompt):
     return voted_penality, result
 
 
-def get_alignment(ref_text, rec_text):
-    # separate punctuation and split into words
-    # TODO this will fail for abbreviations e.g. Mr.
+def get_samples_needed(penalties, num_samples, max_samples):
+    """
+    Number of extra samples needed before the majority vote is decided. The vote is decided once the
+    leading penalty can't be beaten by the rest of the num_samples budget. Ties and parse failures (None)
+    keep drawing one sample at a time up to max_samples.
+    """
+    counts = Counter(penalty for penalty in penalties if penalty is not None).most_common(2)
+    leader = counts[0][1] if counts else 0
+    runner_up = counts[1][1] if len(counts) > 1 else 0
+    remaining = max(num_samples - len(penalties), 0)
+    if leader > runner_up + remaining or len(penalties) >= max_samples:
+        return 0
+    if remaining == 0:
+        return 1
+    # Fewest samples that would decide the vote if they all agree with the leader
+    return min((runner_up + remaining - leader) // 2 + 1, remaining)
 
-    # Find indices of punctuation in reference text
-    ref_words = re.findall(r"[\w'-]+|[.,!?;]", ref_text)
-    punctuation_dict = {i: v for i, v in enumerate(ref_words) if v in ".!?,"}
 
-    # Remove all punctuation and align
-    ref_text = re.sub(r"[^\w\s]", "", ref_text)
-    rec_text = re.sub(r"[^\w\s]", "", rec_text)
-    ref_words = ref_text.split()
-    rec_words = rec_text.split()
-    alignment = align(ref_words, rec_words, GAP)
+def normalise_text(text):
+    # Collapse runs of whitespace so pairs that only differ in spacing are treated as identical
+    return " ".join(text.split())
 
-    reference_count = len(alignment)
-    return alignment, reference_count, punctuation_dict
 
+def group_identical_pairs(pairs):
+    """
+    Group identical (reference, recognised) pairs so each unique pair only needs to be scored once.
+    Returns the unique pairs along with the index into them for every input pair.
+    """
+    unique_indices = {}
+    unique_pairs, pair_indices = [], []
+    for ref, rec in pairs:
+        pair = (normalise_text(ref), normalise_text(rec))
+        if pair not in unique_indices:
+            unique_indices[pair] = len(unique_pairs)
+            unique_pairs.append(pair)
+        pair_indices.append(unique_indices[pair])
+    return unique_pairs, pair_indices
 
-def get_sentences(ref_text, rec_text):
+
+# Compiled once as they're used for every utterance
+WORD_PATTERN = re.compile(r"[\w'-]+|[.,!?;]")
+PUNCTUATION_PATTERN = re.compile(r"[^\w\s]")
+SENTENCE_END_PATTERN = re.compile(r'\s([?.!"](?:\s|$))')
+COMPARISON_KEY = "Key: [recognised reference] {deletion} <insertion>\n"
+
+
+class Alignment:
     """
-    We don't want to pass whole paragraphs so this splits up the reference and recognised transcript
-    based on the alignment. You need the alignment to deal with the cases where a whole sentence is missing
-    if the ref/rec or eos punctuation is missing.
+    Word alignment of a reference and recognised transcript along with its error counts. It's built once per pair
+    and then shared by sentence splitting, WER counting and comparison rendering so nothing is aligned twice.
     """
-    alignment, _, punctuation_dict = get_alignment(ref_text, rec_text)
-
-    ref_sentences = []
-    rec_sentences = []
-    ref_sentence = []
-    rec_sentence = []
-    ref_counter = 0
-    for ref, rec in alignment:
-        if ref != GAP:
-            ref_sentence.append(ref)
-            ref_counter += 1
-        if rec != GAP:
-            rec_sentence.append(rec)
-        if ref_counter in punctuation_dict:
-            if punctuation_dict[ref_counter] in ".?!":
-                # Append end of sentence punctuation.
-                # TODO: Do not use the ref puncutation in recognised as sometimes incorrect punctuation can change meaning.
-                ref_sentence.append(punctuation_dict[ref_counter])
-                rec_sentence.append(punctuation_dict[ref_counter])
-                del punctuation_dict[ref_counter]
-                ref_counter += 1
-                # Rejoin the punctuation in the string and save to list
-                ref_sentence = re.sub(r'\s([?.!"](?:\s|$))', r"\1", " ".join(ref_sentence))
-                rec_sentence = re.sub(r'\s([?.!"](?:\s|$))', r"\1", " ".join(rec_sentence))
-                ref_sentences.append(ref_sentence)
-                rec_sentences.append(rec_sentence)
-                # reset the current sentence
-                ref_sentence = []
-                rec_sentence = []
+
+    __slots__ = ("ref_text", "rec_text", "pairs", "punctuation_dict", "insertions", "deletions", "substitions")
+
+    def __init__(self, ref_text, rec_text, pairs=None, punctuation_dict=None):
+        self.ref_text = ref_text
+        self.rec_text = rec_text
+        if pairs is None:
+            # separate punctuation and split into words
+            # TODO this will fail for abbreviations e.g. Mr.
+
+            # Find indices of punctuation in reference text
+            ref_words = WORD_PATTERN.findall(ref_text)
+            punctuation_dict = {i: v for i, v in enumerate(ref_words) if v in ".!?,"}
+
+            # Remove all punctuation and align
+            ref_words = PUNCTUATION_PATTERN.sub("", ref_text).split()
+            rec_words = PUNCTUATION_PATTERN.sub("", rec_text).split()
+            pairs = align(ref_words, rec_words, GAP)
+        self.pairs = pairs
+        self.punctuation_dict = punctuation_dict or {}
+
+        self.insertions, self.deletions, self.substitions = 0, 0, 0
+        for ref, rec in pairs:
+            if ref == rec:
+                continue
+            if ref == GAP:
+                self.insertions += 1
+            elif rec == GAP:
+                self.deletions += 1
             else:
+                self.substitions += 1
+
+    @property
+    def reference_count(self):
+        return len(self.pairs)
+
+    @property
+    def errors(self):
+        return self.insertions + self.deletions + self.substitions
+
+    def get_comparison(self):
+        comparison = [COMPARISON_KEY]
+        for ref, rec in self.pairs:
+            # Correct
+            if ref == rec:
+                comparison.append(ref)
+            # Insertion Error
+            elif ref == GAP:
+                comparison.append(f"<{rec}>")
+            # Deletion Error
+            elif rec == GAP:
+                comparison.append("{" + ref + "}")
+            # Subsitution Error
+            else:
+                comparison.append(f"[{rec} {ref}]")
+        return " ".join(comparison)
+
+    def get_sentences(self, keep_remainder=False, max_words=None):
+        """
+        We don't want to pass whole paragraphs so this splits up the reference and recognised transcript
+        based on the alignment. You need the alignment to deal with the cases where a whole sentence is missing
+        if the ref/rec or eos punctuation is missing. Each sentence keeps its slice of this alignment.
+        With max_words set, sentences are also cut after that many aligned words so none can be unboundedly long,
+        and keep_remainder keeps any words after the last end of sentence punctuation.
+        """
+        punctuation_dict = dict(self.punctuation_dict)
+        sentences = []
+        ref_sentence = []
+        rec_sentence = []
+        start = 0
+        ref_counter = 0
+        for i, (ref, rec) in enumerate(self.pairs):
+            if ref != GAP:
+                ref_sentence.append(ref)
+                ref_counter += 1
+            if rec != GAP:
+                rec_sentence.append(rec)
+            if ref_counter in punctuation_dict:
+                if punctuation_dict[ref_counter] in ".?!":
+                    # Append end of sentence punctuation.
+                    # TODO: Do not use the ref puncutation in recognised as sometimes incorrect punctuation can change
+                    # meaning.
+                    ref_sentence.append(punctuation_dict[ref_counter])
+                    rec_sentence.append(punctuation_dict[ref_counter])
+                    del punctuation_dict[ref_counter]
+                    ref_counter += 1
+                    sentences.append(self.get_sentence(ref_sentence, rec_sentence, start, i + 1))
+                    # reset the current sentence
+                    ref_sentence = []
+                    rec_sentence = []
+                    start = i + 1
+                    continue
                 # Append other punctuation (eg ,) to sentence and continue
                 ref_sentence.append(punctuation_dict[ref_counter])
                 ref_counter += 1
+            if max_words is not None and i + 1 - start >= max_words:
+                sentences.append(self.get_sentence(ref_sentence, rec_sentence, start, i + 1))
+                ref_sentence = []
+                rec_sentence = []
+                start = i + 1
 
-    return ref_sentences, rec_sentences
+        if keep_remainder and start < len(self.pairs):
+            sentences.append(self.get_sentence(ref_sentence, rec_sentence, start, len(self.pairs)))
+        return sentences
+
+    def get_sentence(self, ref_words, rec_words, start, end):
+        # Rejoin the punctuation in the string
+        ref_sentence = SENTENCE_END_PATTERN.sub(r"\1", " ".join(ref_words))
+        rec_sentence = SENTENCE_END_PATTERN.sub(r"\1", " ".join(rec_words))
+        return Alignment(ref_sentence, rec_sentence, self.pairs[start:end])
+
+    def get_wer(self):
+        result = {"reference": self.ref_text, "recognised": self.rec_text, "reference_count": self.reference_count}
+        if self.reference_count == 0:
+            # reference is empty after alignment, return wer=100
+            result["wer"] = "null"
+            return None, self.reference_count, result
+
+        wer = 100 * self.errors / self.reference_count
+        result.update(
+            [
+                ("comparison", self.get_comparison()),
+                ("insertions", self.insertions),
+                ("deletions", self.deletions),
+                ("substitions", self.substitions),
+                ("wer", round(wer, 2)),
+            ]
+        )
+
+        return self.errors, self.reference_count, result
+
+
+def get_alignment(ref_text, rec_text):
+    alignment = Alignment(ref_text, rec_text)
+    return alignment.pairs, alignment.reference_count, dict(alignment.punctuation_dict)
+
+
+def get_sentences(ref_text, rec_text):
+    sentences = Alignment(ref_text, rec_text).get_sentences()
+    return [sentence.ref_text for sentence in sentences], [sentence.rec_text for sentence in sentences]
 
 
 def calculate_wer(ref_text, rec_text):
+    return Alignment(ref_text, rec_text).get_wer()
+
 
-    alignment, reference_count, _ = get_alignment(ref_text, rec_text)
-    result = {"reference": ref_text, "recognised": rec_text, "reference_count": reference_count}
-    if reference_count == 0:
-        # reference is empty after alignment, return wer=100
-        result["wer"] = "null"
-        return None, reference_count, result
-
-    comparison = ["Key: [recognised reference] {deletion} <insertion>\n"]
-    insertions, deletions, substitions = 0, 0, 0
-    for (ref, rec) in alignment:
-        # Correct
-        if ref == rec:
-            comparison.append(ref)
-        # Insertion Error
-        elif ref == GAP:
-            insertions += 1
-            comparison.append(f"<{rec}>")
-        # Deletion Error
-        elif rec == GAP:
-            deletions += 1
-            comparison.append("{" + ref + "}")
-        # Subsitution Error
-        else:
-            substitions += 1
-            comparison.append(f"[{rec} {ref}]")
-
-    num_errors = insertions + deletions + substitions
-    wer = 100 * num_errors / reference_count
-    comparison = " ".join(comparison)
-
-    result.update(
-        [
-            ("comparison", comparison),
-            ("insertions", insertions),
-            ("deletions", deletions),
-            ("substitions", substitions),
-            ("wer", round(wer, 2)),
-        ]
-    )
-
-    return num_errors, reference_count, result
-
-
-def save_results(
-    output_json,
-    results,
+def get_summary(
     total_tokens,
     cost,
     total_reference_count,
@@ -147,26 +241,72 @@ def save_results(
     meaning_error_rate,
     wer,
     meaning_error_rate_target=None,
+    usage=None,
+    coverage=1.0,
 ):
     output = {}
-    output["results"] = results
     output["usage"] = {
         "total_tokens": total_tokens,
         "cost": cost,
+        **(usage or {}),
     }
     output["summary"] = {
         "wer": round(wer, 2),
         "total_reference_count": total_reference_count,
         "total_penalty": total_penalty,
         "meaning_error_rate": round(meaning_error_rate, 2),
+        "coverage": round(coverage, 4),
     }
     if meaning_error_rate_target:
         output["summary"]["accuracy"] = round(meaning_error_rate_target, 2)
+    return output
+
+
+def save_results(output_json, results, *args, **kwargs):
+    output = {"results": results, **get_summary(*args, **kwargs)}
 
     with open(output_json, "w", encoding="utf-8") as f:
         json.dump(output, f, indent=4)
 
 
+class ResultStream:
+    """
+    Writes per-utterance results to JSONL as soon as they're scored so nothing is held in memory.
+    The usage and summary blocks are written as the last line once the run is finished.
+    """
+
+    def __init__(self, output_jsonl):
+        self.f = open(output_jsonl, "w", encoding="utf-8")  # pylint: disable=consider-using-with
+
+    def write(self, result):
+        self.f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+    def close(self, *args, **kwargs):
+        self.f.write(json.dumps(get_summary(*args, **kwargs), ensure_ascii=False) + "\n")
+        self.f.close()
+
+
+def read_examples(path):
+    """Lazily yield examples from a JSONL testset (one example per line) or load them from a json testset"""
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            yield from json.load(f)["examples"]
+
+
+def iter_chunks(iterable, chunk_size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
 def calculate_meaning_error_rate(total_reference_count, total_penalty):
     # All serious errors makes this error rate go to 100%, no errors and it is 0%
     return 100 * total_penalty / total_reference_count
@@ -0,0 +1,71 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from mer.utils import Alignment, calculate_wer
+
+# Pairs sent to a worker process at a time, big enough that pickling overhead is small next to aligning
+DEFAULT_CHUNK_SIZE = 32
+
+
+def get_wer_pool(processes=None):
+    """Process pool for aligning transcripts, or None to align in this process"""
+    processes = processes or os.cpu_count() or 1
+    if processes == 1:
+        return None
+    return ProcessPoolExecutor(processes)
+
+
+def calculate_corpus_alignments(pairs, pool=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Alignment of every (ref, rec) pair in the same order, sharded across the pool like calculate_corpus_wer"""
+    refs = [ref for ref, _ in pairs]
+    recs = [rec for _, rec in pairs]
+    if pool is None or len(pairs) <= chunk_size:
+        return list(map(Alignment, refs, recs))
+    return list(pool.map(Alignment, refs, recs, chunksize=chunk_size))
+
+
+def calculate_corpus_wer(pairs, pool=None, chunk_size=DEFAULT_CHUNK_SIZE, alignments=None):
+    """
+    calculate_wer for every (ref, rec) pair, returned in the same order. Alignment is CPU bound so with a pool
+    the pairs are sharded across worker processes chunk_size at a time. Alignments already built for the pairs
+    (e.g. of their whitespace normalised copies) are reused instead, with results still showing the pairs' text.
+    """
+    if alignments is not None:
+        return [
+            Alignment(ref, rec, alignment.pairs, alignment.punctuation_dict).get_wer()
+            for (ref, rec), alignment in zip(pairs, alignments)
+        ]
+    refs = [ref for ref, _ in pairs]
+    recs = [rec for _, rec in pairs]
+    if pool is None or len(pairs) <= chunk_size:
+        return list(map(calculate_wer, refs, recs))
+    return list(pool.map(calculate_wer, refs, recs, chunksize=chunk_size))
+
+
+def get_word_error_rate(examples, output_json, processes=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """WER only scoring of the examples which doesn't need the LM (or an api key) at all"""
+    pairs = [(example["reference"], example["recognised"]) for example in examples]
+    pool = get_wer_pool(processes)
+    try:
+        wers = calculate_corpus_wer(pairs, pool, chunk_size)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    total_errors, total_reference_count = 0, 0
+    results = []
+    for errors, reference_count, wer_result in wers:
+        total_errors += errors or 0
+        total_reference_count += reference_count
+        results.append(wer_result)
+    wer = 100 * total_errors / total_reference_count if total_reference_count else 0.0
+
+    output = {
+        "results": results,
+        "summary": {"wer": round(wer, 2), "total_errors": total_errors, "total_reference_count": total_reference_count},
+    }
+    with open(output_json, "w", encoding="utf-8") as f:
+        json.dump(output, f, indent=4)
+
+    return wer
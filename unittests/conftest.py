@@ -0,0 +1,55 @@
+import json
+import re
+
+import pytest
+
+from mer.mer import get_meaning_error_rate
+from mer.mockserver import MockCompletionServer
+
+
+class StandInLM(MockCompletionServer):
+    """
+    Mock completions endpoint whose continuations echo the last recognised transcript in the prompt
+    so tests can check results come back in input order.
+    """
+
+    def continuation(self, prompt, rng):
+        if prompt.endswith("Reasoning 1:"):
+            # Batch prompt so answer every numbered utterance
+            recs = re.findall(r"^Recognised (\d+): (.*)$", prompt, re.MULTILINE)
+            if self.drop_last_batch_answer:
+                recs = recs[:-1]
+            answers = [
+                f'Reasoning {i}: "{rec}" checked\nResult {i}: 0 minor + 0 standard + 0 serious = 0.0 penalty'
+                for i, rec in recs
+            ]
+            return "\n\n".join(answers)[len("Reasoning 1:") :]  # noqa: E203
+        rec = prompt.split("Recognised:")[-1].split("\n")[0].strip()
+        return f' "{rec}" checked\nResult: 0 minor + 0 standard + 0 serious = 0.0 penalty'
+
+
+@pytest.fixture
+def stand_in_lm():
+    with StandInLM(latency=0.025, latency_sigma=0.5) as lm:
+        yield lm
+
+
+@pytest.fixture
+def score_with_stand_in(stand_in_lm, tmp_path, monkeypatch):
+    """Score examples against the stand-in LM, approving the spend, and return the output json"""
+    monkeypatch.setattr("builtins.input", lambda _: "Y")
+
+    def score(examples, **kwargs):
+        output_json = str(tmp_path / "results.json")
+        get_meaning_error_rate(
+            examples,
+            "./config/prompt_multiple.json",
+            output_json,
+            api_key="test",
+            api_base=stand_in_lm.api_base,
+            **kwargs,
+        )
+        with open(output_json, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    return score
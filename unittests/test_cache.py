@@ -0,0 +1,62 @@
+from mer.cache import EVICTION_LOW_WATER, ContinuationCache
+from mer.engine import get_continuations
+from mer.lm import LanguageModel
+
+
+def test_cache_eviction(tmp_path):
+    cache = ContinuationCache(str(tmp_path / "cache.db"), max_size_mb=0.001)
+    for i in range(20):
+        key = ContinuationCache.get_key("text-davinci-002", f"prompt {i}", 0.7, 64, 3)
+        cache.put(key, "text-davinci-002", {"continuations": ["x" * 100], "usage": {"total_tokens": 10}})
+
+    stats = cache.stats()
+    assert 0 < stats["entries"] < 20
+    assert stats["size"] <= 0.001 * 1024 * 1024
+    # Most recently added entry survives eviction
+    assert ContinuationCache.get_key("text-davinci-002", "prompt 19", 0.7, 64, 3) in cache
+
+
+def test_cache_evicts_to_low_water_mark(tmp_path):
+    cache = ContinuationCache(str(tmp_path / "cache.db"), max_size_mb=0.01)
+    sizes = []
+    for i in range(200):
+        key = ContinuationCache.get_key("text-davinci-002", f"prompt {i}", 0.7, 64, 3)
+        cache.put(key, "text-davinci-002", {"continuations": ["x" * 10], "usage": {"total_tokens": 10}})
+        sizes.append(cache.size)
+    evictions = [size for previous, size in zip(sizes, sizes[1:]) if size < previous]
+    assert evictions
+    # Each eviction frees room for several more entries rather than just the one being added
+    assert all(size <= EVICTION_LOW_WATER * cache.max_size for size in evictions)
+    assert len(evictions) < 200 // 4
+    # Evicting in small batches still gets down to the target
+    assert cache.evict(cache.size // 2, batch_size=2) > 2
+    assert cache.size <= sizes[-1] // 2
+
+
+def test_only_changed_prompts_requested(stand_in_lm, tmp_path):
+    cache = ContinuationCache(str(tmp_path / "cache.db"))
+    lm = LanguageModel(api_key="test", api_base=stand_in_lm.api_base, cache=cache)
+    prompt_strings = [f"Reference: a\nRecognised: utterance {i}\nReasoning:" for i in range(5)]
+    first = get_continuations(lm, prompt_strings, num_samples=2, concurrency=2)
+    assert stand_in_lm.requests == 5
+
+    prompt_strings[2] = "Reference: a\nRecognised: changed\nReasoning:"
+    second = get_continuations(lm, prompt_strings, num_samples=2, concurrency=2)
+    assert stand_in_lm.requests == 6
+    assert second[0][0] == first[0][0]
+    assert second[0][1]["usage"]["total_tokens"] == 0
+    assert '"changed"' in second[2][0][0]
+
+    # A different number of samples is a different request
+    get_continuations(lm, prompt_strings[:1], num_samples=3)
+    assert stand_in_lm.requests == 7
+
+
+def test_endpoints_cached_separately(stand_in_lm, tmp_path):
+    cache = ContinuationCache(str(tmp_path / "cache.db"))
+    prompt_strings = ["Reference: a\nRecognised: b\nReasoning:"]
+    get_continuations(LanguageModel(api_key="test", api_base=stand_in_lm.api_base, cache=cache), prompt_strings)
+    # Continuations from the stand-in aren't served to a model pointed at another endpoint
+    other_lm = LanguageModel(api_key="test", api_base="http://127.0.0.1:1/v1", cache=cache)
+    assert not other_lm.is_cached(prompt_strings[0])
+    assert LanguageModel(api_key="test", api_base=stand_in_lm.api_base, cache=cache).is_cached(prompt_strings[0])
@@ -0,0 +1,33 @@
+import pytest
+
+
+def test_cascade_escalates_hard_utterances(stand_in_lm, score_with_stand_in):
+    examples = [{"reference": "a b c d", "recognised": f"a b c {i}"} for i in range(4)]
+    examples.append({"reference": "a b c d", "recognised": "x y z"})
+
+    output = score_with_stand_in(examples, cascade_model="text-curie-001", cascade_wer_threshold=50)
+
+    # Stand-in samples always agree so only the high WER utterance is escalated
+    assert stand_in_lm.requests == len(examples) + 1
+    assert [result["model"] for result in output["results"]] == ["text-curie-001"] * 4 + ["text-davinci-002"]
+    tiers = output["usage"]["tiers"]
+    assert tiers["text-curie-001"]["utterances"] == 5
+    assert tiers["text-davinci-002"]["utterances"] == 1
+    assert tiers["text-curie-001"]["total_tokens"] + tiers["text-davinci-002"]["total_tokens"] == sum(
+        stand_in_lm.tokens
+    )
+    assert output["usage"]["cost"] == pytest.approx(
+        tiers["text-curie-001"]["cost"] + tiers["text-davinci-002"]["cost"], abs=0.01
+    )
+
+
+def test_cascade_escalates_unparseable_utterances(stand_in_lm, score_with_stand_in):
+    examples = [{"reference": "a b c", "recognised": f"a b {i}"} for i in range(3)]
+
+    # None of the cheap model's samples parse for the first utterance, so the main model scores it
+    stand_in_lm.truncated = 1
+    output = score_with_stand_in(examples, cascade_model="text-curie-001", max_repairs=0)
+
+    assert [result["model"] for result in output["results"]] == ["text-davinci-002"] + ["text-curie-001"] * 2
+    assert output["usage"]["escalated"] == 1
+    assert output["usage"]["unparseable"] == 0
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+
+from mer.chunking import save_file_results, split_examples
+from mer.mer import get_meaning_error_rate
+
+
+# Stream mode writes JSONL whatever the output is called (the mer.run default is a .json name)
+@pytest.mark.parametrize(
+    "output_name,stream", [("results.jsonl", True), ("results.json", True), ("results.json", False)]
+)
+def test_long_transcripts_scored_as_sentences(stand_in_lm, tmp_path, monkeypatch, output_name, stream):
+    monkeypatch.setattr("builtins.input", lambda _: "Y")
+    long_reference = " ".join(f"word{i}" for i in range(120))
+    examples = [
+        {
+            "reference": "Hello there. How are you doing today? Fine",
+            "recognised": "hello their how you doing today fine",
+            "metadata": {"file": "calls/reference/0.txt", "shard": "shard_0.tar"},
+        },
+        {"reference": long_reference, "recognised": long_reference, "metadata": {"file": "ref/1.txt"}},
+    ]
+    units = list(split_examples(examples, max_words=50))
+    assert [unit["metadata"]["file_index"] for unit in units] == [0, 0, 0, 1, 1, 1]
+    # The words after the last full stop are kept and unpunctuated text is cut to bounded units
+    assert units[2]["reference"] == "Fine"
+    assert max(len(unit["reference"].split()) for unit in units) == 50
+
+    output_json = str(tmp_path / output_name)
+    get_meaning_error_rate(
+        iter(units),
+        "./config/prompt_multiple.json",
+        output_json,
+        api_key="test",
+        api_base=stand_in_lm.api_base,
+        concurrency=4,
+        stream=stream,
+    )
+    file_results = save_file_results(output_json, str(tmp_path / "files.json"), stream=stream)
+
+    assert [file_result["sentences"] for file_result in file_results] == [3, 3]
+    # Each file is named by the reference path or tar member the loader recorded
+    assert [file_result["file"] for file_result in file_results] == ["calls/reference/0.txt", "ref/1.txt"]
+    assert file_results[0]["shard"] == "shard_0.tar"
+    assert file_results[1]["reference_count"] == 120
+    assert file_results[1]["wer"] == 0.0
+    with open(str(tmp_path / "files.json"), "r", encoding="utf-8") as f:
+        assert len(json.load(f)["files"]) == 2
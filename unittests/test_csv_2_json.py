@@ -0,0 +1,48 @@
+import csv
+import io
+import json
+
+from dataprep.csv_2_json import csv_2_json
+
+
+def get_csv(num_rows):
+    f = io.StringIO()
+    writer = csv.DictWriter(f, fieldnames=["speaker", "content", "amazon_transcription"])
+    writer.writeheader()
+    for i in range(num_rows):
+        writer.writerow(
+            {
+                "speaker": f"speaker_{i % 3}",
+                "content": f"I went to the shop on day {i}. It was closed so I came home.",
+                "amazon_transcription": f"I went to a shop on day {i}. It was closed so I came home.",
+            }
+        )
+    f.seek(0)
+    return f
+
+
+def convert(num_rows, **kwargs):
+    json_out = io.StringIO()
+    csv_2_json(get_csv(num_rows), json_out, **kwargs)
+    return json.loads(json_out.getvalue())["examples"]
+
+
+def test_parallel_matches_serial():
+    serial = convert(10, processes=1, chunk_size=4)
+    parallel = convert(10, processes=2, chunk_size=4)
+
+    assert parallel == serial
+    # Only the first sentence of each row has an error, the identical second one is dropped
+    assert len(serial) == 10
+    for i, example in enumerate(serial):
+        assert example["reference"] == f"I went to the shop on day {i}."
+        assert example["recognised"] == f"I went to a shop on day {i}."
+        assert example["metadata"] == {"row": i, "speaker": f"speaker_{i % 3}", "sentence": 0}
+
+
+def test_jsonl_output():
+    json_out = io.StringIO()
+    csv_2_json(get_csv(3), json_out, jsonl=True, processes=1)
+
+    examples = [json.loads(line) for line in json_out.getvalue().splitlines()]
+    assert examples == convert(3, processes=1)
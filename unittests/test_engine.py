@@ -0,0 +1,167 @@
+import json
+
+import openai
+import pytest
+
+from mer.engine import get_continuations
+from mer.lm import LanguageModel
+from mer.mer import get_meaning_error_rate
+from mer.planner import SpendApproval
+from mer.utils import Alignment, read_examples
+
+
+def test_continuations_in_input_order(stand_in_lm):
+    lm = LanguageModel(api_key="test", api_base=stand_in_lm.api_base)
+    prompt_strings = [f"Reference: a\nRecognised: utterance {i}\nReasoning:" for i in range(20)]
+
+    results = get_continuations(lm, prompt_strings, num_samples=2, concurrency=8)
+
+    assert stand_in_lm.max_in_flight > 1
+    for i, (continuations, response) in enumerate(results):
+        assert len(continuations) == 2
+        assert f'"utterance {i}"' in continuations[0]
+        assert response["usage"]["total_tokens"] > 0
+
+
+def test_running_concurrently_with_stand_in(stand_in_lm, tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda _: "Y")
+    with open("./config/test_multiple.json", "r", encoding="utf-8") as f:
+        examples = json.load(f)["examples"]
+    output_json = str(tmp_path / "results.json")
+
+    meaning_error_rate, _ = get_meaning_error_rate(
+        examples,
+        "./config/prompt_multiple.json",
+        output_json,
+        api_key="test",
+        num_samples=3,
+        concurrency=4,
+        api_base=stand_in_lm.api_base,
+    )
+
+    with open(output_json, "r", encoding="utf-8") as f:
+        output = json.load(f)
+    assert meaning_error_rate == 0.0
+    assert [result["recognised"] for result in output["results"]] == [example["recognised"] for example in examples]
+    assert stand_in_lm.requests == len(examples)
+
+
+def test_resume_from_checkpoint(stand_in_lm, tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda _: "Y")
+    examples = [{"reference": "a b c", "recognised": f"a b {i}"} for i in range(10)]
+    output_json = str(tmp_path / "results.json")
+    kwargs = {"api_key": "test", "num_samples": 1, "api_base": stand_in_lm.api_base, "max_retries": 0}
+
+    # Server dies part way through the run
+    stand_in_lm.fail_after = 6
+    with pytest.raises(openai.error.APIError):
+        get_meaning_error_rate(examples, "./config/prompt_multiple.json", output_json, **kwargs)
+    with open(f"{output_json}.checkpoint.jsonl", "r", encoding="utf-8") as f:
+        assert len(f.readlines()) == 6
+
+    stand_in_lm.fail_after = None
+    get_meaning_error_rate(examples, "./config/prompt_multiple.json", output_json, resume=True, **kwargs)
+    assert stand_in_lm.requests == 10
+
+    with open(output_json, "r", encoding="utf-8") as f:
+        output = json.load(f)
+    assert [result["recognised"] for result in output["results"]] == [example["recognised"] for example in examples]
+    # Tokens paid for before the crash are still counted
+    assert output["usage"]["total_tokens"] == sum(stand_in_lm.tokens)
+
+
+def test_identical_pairs_requested_once(stand_in_lm, score_with_stand_in):
+    examples = [{"reference": "Okay thank you.", "recognised": "okay thank you."} for _ in range(4)]
+    examples += [{"reference": "Yeah.", "recognised": "yeah "}, {"reference": "Yeah.", "recognised": " yeah"}]
+
+    output = score_with_stand_in(examples)
+
+    assert stand_in_lm.requests == 2
+    assert len(output["results"]) == len(examples)
+    assert [result["recognised"] for result in output["results"]] == [example["recognised"] for example in examples]
+    assert output["usage"]["unique_examples"] == 2
+    assert output["usage"]["dedup_ratio"] == round(1 - 2 / 6, 4)
+
+
+def test_each_unique_pair_aligned_once(score_with_stand_in, monkeypatch):
+    examples = [{"reference": "I went to the shop.", "recognised": "I went to a shop."} for _ in range(3)]
+    examples += [{"reference": "I don't know.", "recognised": "I do not know."}]
+    aligned = []
+    init = Alignment.__init__
+
+    def count_alignments(self, ref_text, rec_text, pairs=None, punctuation_dict=None):
+        if pairs is None:
+            aligned.append((ref_text, rec_text))
+        init(self, ref_text, rec_text, pairs, punctuation_dict)
+
+    monkeypatch.setattr(Alignment, "__init__", count_alignments)
+    score_with_stand_in(
+        examples,
+        triage=True,
+        num_examples=2,
+        cascade_model="text-curie-001",
+        cascade_wer_threshold=10,
+        wer_processes=1,
+    )
+
+    # Triage, example retrieval, escalation and WER all share one alignment per unique pair
+    pairs = [(example["reference"], example["recognised"]) for example in examples]
+    assert sorted(pair for pair in aligned if pair in pairs) == sorted(set(pairs))
+
+
+def test_batched_prompts(stand_in_lm, score_with_stand_in, monkeypatch):
+    plans = []
+    approve = SpendApproval.__call__
+    monkeypatch.setattr(SpendApproval, "__call__", lambda self, plan: plans.append(plan) or approve(self, plan))
+    examples = [{"reference": "a b c", "recognised": f"a b {i}"} for i in range(10)]
+
+    # Last utterance of each batch goes missing so has to fall back to single utterance prompts
+    stand_in_lm.drop_last_batch_answer = True
+    output = score_with_stand_in(examples, batch_size=4)
+
+    assert stand_in_lm.requests == 3 + 3
+    # The fallback prompts are approved before they're paid for too
+    assert [plan["requests"] for plan in plans] == [3, 3]
+    for example, result in zip(examples, output["results"]):
+        assert all(f'"{example["recognised"]}"' in p["reason"] for p in result["predictions"])
+    assert output["usage"]["batch_fallbacks"] == 3
+    assert output["usage"]["estimated_prompt_token_saving"] > 0.3
+
+
+def test_adaptive_voting_stops_early(stand_in_lm, score_with_stand_in):
+    examples = [{"reference": "a b c", "recognised": f"a b {i}"} for i in range(5)]
+
+    output = score_with_stand_in(examples, num_samples=5, adaptive=True)
+
+    # Stand-in always agrees with itself so 3 of 5 samples is an unbeatable majority
+    assert output["usage"]["average_samples"] == 3
+    assert all(result["vote_count"] == 3 for result in output["results"])
+    assert stand_in_lm.requests == len(examples)
+
+
+def test_streaming_jsonl(stand_in_lm, tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda _: "Y")
+    examples = [{"reference": "a b c", "recognised": f"a b {i % 4}"} for i in range(10)]
+    test_jsonl = tmp_path / "test.jsonl"
+    test_jsonl.write_text("".join(json.dumps(example) + "\n" for example in examples), encoding="utf-8")
+    output_jsonl = str(tmp_path / "results.jsonl")
+
+    meaning_error_rate, _ = get_meaning_error_rate(
+        read_examples(str(test_jsonl)),
+        "./config/prompt_multiple.json",
+        output_jsonl,
+        api_key="test",
+        api_base=stand_in_lm.api_base,
+        stream=True,
+        chunk_size=4,
+    )
+
+    with open(output_jsonl, "r", encoding="utf-8") as f:
+        lines = [json.loads(line) for line in f]
+    results, summary = lines[:-1], lines[-1]
+    assert [result["recognised"] for result in results] == [example["recognised"] for example in examples]
+    assert summary["summary"]["meaning_error_rate"] == meaning_error_rate
+    assert summary["summary"]["total_reference_count"] == 3 * len(examples)
+    assert summary["usage"]["examples"] == len(examples)
+    # Pairs repeated in later chunks are found in the checkpoint so are only requested once
+    assert stand_in_lm.requests == 4
@@ -0,0 +1,45 @@
+import io
+import tarfile
+
+from mer.loader import load_tar_examples
+from mer.run import convert_dbl_to_dict
+
+
+def test_dbl_with_trailing_newline(tmp_path):
+    ref_paths, rec_paths = [], []
+    for i in range(50):
+        for name, paths in [("ref", ref_paths), ("rec", rec_paths)]:
+            path = tmp_path / f"{name}_{i}.txt"
+            path.write_text(f"{name} {i}\n", encoding="utf-8")
+            paths.append(str(path))
+
+    examples = convert_dbl_to_dict(
+        io.StringIO("\n".join(ref_paths) + "\n"), io.StringIO("\n".join(rec_paths) + "\n"), 4
+    )
+
+    assert list(examples) == [
+        {"reference": f"ref {i}", "recognised": f"rec {i}", "metadata": {"file": ref_paths[i]}} for i in range(50)
+    ]
+
+
+def test_tar_shards(tmp_path):
+    shards = []
+    for shard in range(2):
+        shard_path = str(tmp_path / f"shard_{shard}.tar")
+        with tarfile.open(shard_path, "w") as tar:
+            for i in range(3):
+                for transcript_type in ["reference", "recognised"]:
+                    data = f"{transcript_type} {shard} {i}".encode("utf-8")
+                    member = tarfile.TarInfo(f"calls/{transcript_type}/{i}.txt")
+                    member.size = len(data)
+                    tar.addfile(member, io.BytesIO(data))
+        shards.append(shard_path)
+
+    examples = list(load_tar_examples(shards))
+
+    assert len(examples) == 6
+    assert examples[4] == {
+        "reference": "reference 1 1",
+        "recognised": "recognised 1 1",
+        "metadata": {"file": "calls/reference/1.txt", "shard": shards[1]},
+    }
@@ -0,0 +1,23 @@
+from mer.metrics import get_percentile
+
+
+def test_percentiles():
+    values = sorted(float(i) for i in range(1, 101))
+    assert [get_percentile(values, p) for p in (50, 95, 99)] == [50.0, 95.0, 99.0]
+    assert get_percentile([], 50) == 0.0
+
+
+def test_run_metrics_reported(stand_in_lm, score_with_stand_in, tmp_path):
+    examples = [{"reference": "a b c", "recognised": f"a b {i}"} for i in range(6)]
+    textfile = str(tmp_path / "mer.prom")
+
+    output = score_with_stand_in(examples, concurrency=3, metrics_textfile=textfile, progress_interval=0)
+
+    metrics = output["usage"]["metrics"]
+    assert metrics["utterances"] == len(examples)
+    assert metrics["api"]["requests"] == stand_in_lm.requests == len(examples)
+    assert metrics["api"]["latency"]["p50"] <= metrics["api"]["latency"]["p99"]
+    assert metrics["stages"]["prompt"]["calls"] == len(examples)
+    assert set(metrics["stages"]) >= {"prompt", "parse", "voting", "alignment"}
+    with open(textfile, "r", encoding="utf-8") as f:
+        assert f"mer_utterances_total {len(examples)}" in f.read()
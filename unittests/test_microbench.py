@@ -0,0 +1,17 @@
+from mer.microbench import compare, get_corpus, run
+
+
+def test_corpora_sizes():
+    pairs = get_corpus("long")
+    assert len(pairs) == 2
+    assert len(pairs[0][0].split()) == 10000
+
+
+def test_compare_flags_regressions():
+    timings = run(corpora=["short"], names=["create_prompt", "get_result"], repeat=1)["timings"]
+    assert set(timings) == {"create_prompt/short", "get_result/short"}
+
+    baseline = dict(timings)
+    baseline["get_result/short"] = timings["get_result/short"] / 2
+    regressions = compare(timings, baseline, threshold=1.25)
+    assert [key for key, *_ in regressions] == ["get_result/short"]
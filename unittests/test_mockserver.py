@@ -0,0 +1,30 @@
+import random
+
+from mer.benchmark import get_synthetic_examples, run_benchmark
+from mer.mockserver import MockCompletionServer
+from mer.prompt import PromptMultiple
+
+
+def test_mock_continuations_parse():
+    prompt = PromptMultiple.from_file("./config/prompt_multiple.json")
+    server = MockCompletionServer(disagreement=0.0)
+    rng = random.Random(0)
+
+    text = server.continuation(prompt.create_prompt("the cat sat on the mat", "the cat sat on a mat"), rng)
+    _, penalty = prompt.get_result(text)
+    assert penalty in (0.25, 0.5, 1.0)
+
+    batch = [("a b c", "a b c"), ("d e f", "d f")]
+    texts = [server.continuation(prompt.create_batch_prompt(batch), rng) for _ in range(3)]
+    continuations_list = prompt.split_batch_continuations(texts, len(batch))
+    penalties = [[prompt.get_result(text)[1] for text in continuations] for continuations in continuations_list]
+    assert penalties[0] == [0.0] * 3 and all(penalty > 0 for penalty in penalties[1])
+
+
+def test_benchmark_against_mock_server():
+    examples = get_synthetic_examples(20)
+    assert len(examples) == 20 and any(e["reference"] != e["recognised"] for e in examples)
+    with MockCompletionServer(latency=0.01, rate_limit_rate=0.1) as server:
+        result = run_benchmark(server.api_base, "./config/prompt_multiple.json", 20, 4, 3, 1, False, 0)
+    assert result["utterances_per_second"] > 0
+    assert result["total_tokens"] == sum(server.tokens)
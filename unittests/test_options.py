@@ -0,0 +1,18 @@
+import argparse
+
+from mer.options import ScoringOptions, add_lm_args, add_scoring_args
+
+
+def test_options_from_flags():
+    parser = argparse.ArgumentParser()
+    add_scoring_args(parser)
+    options = ScoringOptions.from_args(parser.parse_args(["--batch_size", "4", "--triage", "--result_store", "s.db"]))
+    assert options.batch_size == 4 and options.triage and options.result_store == "s.db"
+    assert options.get_triage() is not None
+
+    # Anything a CLI has no flag for keeps its default
+    parser = argparse.ArgumentParser()
+    add_lm_args(parser, concurrency=8)
+    options = ScoringOptions.from_args(parser.parse_args([]))
+    assert options.concurrency == 8 and options.num_samples == 3
+    assert options.get_triage() is None
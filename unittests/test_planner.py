@@ -0,0 +1,43 @@
+import pytest
+
+from mer.mer import get_meaning_error_rate
+from mer.planner import CostPlanner, count_tokens
+from mer.prompt import PromptMultiple
+
+
+def test_plan_matches_prompts():
+    prompt = PromptMultiple.from_file("./config/prompt_multiple.json")
+    planner = CostPlanner(prompt, "text-davinci-002", num_samples=3, concurrency=4, requests_per_minute=60)
+    pairs = [("a b c", f"a b {i}") for i in range(8)]
+
+    plan = planner.plan(pairs)
+    expected_prompt_tokens = sum(count_tokens(prompt.create_prompt(ref, rec), "text-davinci-002") for ref, rec in pairs)
+    assert plan["requests"] == 8
+    assert plan["prompt_tokens"] == pytest.approx(expected_prompt_tokens, rel=0.01)
+    assert plan["completion_tokens"] == 8 * 3 * planner.completion_tokens
+    # Bound by the requests per minute limit rather than latency
+    assert plan["wall_time"] == 8.0
+
+    batch_plan = planner.plan(pairs, batch_size=4)
+    assert batch_plan["requests"] == 2
+    assert batch_plan["prompt_tokens"] < plan["prompt_tokens"] / 2
+
+
+def test_max_budget_replaces_confirmation(stand_in_lm, tmp_path, monkeypatch):
+    def no_input(_):
+        raise AssertionError("Shouldn't ask for confirmation when a budget is set")
+
+    monkeypatch.setattr("builtins.input", no_input)
+    examples = [{"reference": "a b c", "recognised": f"a b {i}"} for i in range(4)]
+    kwargs = {"api_key": "test", "api_base": stand_in_lm.api_base}
+
+    with pytest.raises(SystemExit):
+        get_meaning_error_rate(
+            examples, "./config/prompt_multiple.json", str(tmp_path / "r.json"), max_budget=0.0, **kwargs
+        )
+    assert stand_in_lm.requests == 0
+
+    get_meaning_error_rate(
+        examples, "./config/prompt_multiple.json", str(tmp_path / "r.json"), max_budget=10.0, **kwargs
+    )
+    assert stand_in_lm.requests == 4
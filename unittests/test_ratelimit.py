@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from mer.engine import get_continuations
+from mer.lm import LanguageModel
+from mer.mer import get_meaning_error_rate
+from mer.ratelimit import TokenBucket, get_retry_delay
+
+
+def test_token_bucket():
+    bucket = TokenBucket(600)  # 10 per second
+    assert bucket.reserve(600) == 0.0
+    assert bucket.reserve(10) == pytest.approx(1.0, abs=0.05)
+    # Unused tokens are given back to the bucket
+    bucket.refund(20)
+    assert bucket.reserve(5) == pytest.approx(0.0, abs=0.05)
+
+
+def test_retry_delay_honours_retry_after():
+    class Error(Exception):
+        """Rate limit error whose response asked for a 30 second wait"""
+
+        headers = {"retry-after": "30"}
+
+    assert get_retry_delay(Error(), 0, backoff_base=1.0) == 30.0
+    assert 4.0 <= get_retry_delay(Exception(), 3, backoff_base=1.0) <= 8.0
+
+
+def test_retry_on_rate_limit(stand_in_lm):
+    stand_in_lm.rate_limited = 3
+    lm = LanguageModel(api_key="test", api_base=stand_in_lm.api_base, backoff_base=0.01, requests_per_minute=6000)
+    prompt_strings = [f"Reference: a\nRecognised: utterance {i}\nReasoning:" for i in range(6)]
+
+    results = get_continuations(lm, prompt_strings, concurrency=3)
+
+    assert lm.retries == 3
+    assert stand_in_lm.requests == 6
+    assert all(f'"utterance {i}"' in continuations[0] for i, (continuations, _) in enumerate(results))
+
+
+def test_spend_cap_stops_admitting_requests(stand_in_lm, tmp_path):
+    examples = [{"reference": "a b c", "recognised": f"a b {i}"} for i in range(20)]
+    output_json = str(tmp_path / "results.json")
+    kwargs = {"api_key": "test", "api_base": stand_in_lm.api_base, "num_samples": 1, "max_budget": 10.0}
+
+    # Find out how many tokens a request uses so the cap can be set part way through the run
+    get_meaning_error_rate(examples[:1], "./config/prompt_multiple.json", output_json, **kwargs)
+    tokens_per_request = stand_in_lm.tokens[0]
+    stand_in_lm.requests = 0
+
+    get_meaning_error_rate(
+        examples,
+        "./config/prompt_multiple.json",
+        output_json,
+        concurrency=2,
+        token_cap=5 * tokens_per_request,
+        **kwargs,
+    )
+
+    with open(output_json, "r", encoding="utf-8") as f:
+        output = json.load(f)
+    assert 5 <= stand_in_lm.requests <= 6
+    assert len(output["results"]) == stand_in_lm.requests
+    assert output["usage"]["spend_cap_reached"]
+    assert output["summary"]["coverage"] == len(output["results"]) / len(examples)
@@ -0,0 +1,44 @@
+from mer.planner import SpendApproval
+
+
+def test_repair_truncated_samples(stand_in_lm, score_with_stand_in):
+    examples = [{"reference": "a b c", "recognised": f"a b {i}"} for i in range(4)]
+
+    # The first utterance's samples never reach the result line
+    stand_in_lm.truncated = 1
+    output = score_with_stand_in(examples)
+
+    # Only the failed samples are requested again, with a bigger token budget
+    assert stand_in_lm.requests == len(examples) + 1
+    assert stand_in_lm.max_tokens[-1] == 128
+    assert all(result["vote_count"] == 3 for result in output["results"])
+    assert output["usage"]["parse_failures"] == 3
+    assert output["usage"]["parse_failure_rate"] == 0.25
+    assert output["usage"]["repair_rate"] == 0.25
+
+
+def test_repairs_are_approved(stand_in_lm, score_with_stand_in, monkeypatch):
+    plans = []
+    approve = SpendApproval.__call__
+    monkeypatch.setattr(SpendApproval, "__call__", lambda self, plan: plans.append(plan) or approve(self, plan))
+    examples = [{"reference": "a b c", "recognised": f"a b {i}"} for i in range(4)]
+
+    stand_in_lm.truncated = 1
+    score_with_stand_in(examples, max_budget=1.0)
+
+    # Re-requests count towards the budget, with the truncated samples planned at the larger max_tokens
+    assert [plan["requests"] for plan in plans] == [len(examples), 1]
+    assert plans[1]["completion_tokens"] == 3 * 128
+
+
+def test_unparseable_utterances_left_unscored(stand_in_lm, score_with_stand_in):
+    examples = [{"reference": "a b c", "recognised": f"a b {i}"} for i in range(4)]
+
+    # Without repairs the first utterance's samples never parse, so it can't be scored at zero penalty
+    stand_in_lm.truncated = 1
+    output = score_with_stand_in(examples, max_repairs=0)
+
+    assert [result["recognised"] for result in output["results"]] == ["a b 1", "a b 2", "a b 3"]
+    assert output["usage"]["unparseable"] == 1
+    assert output["summary"]["coverage"] == 0.75
+    assert output["summary"]["total_reference_count"] == 9
@@ -0,0 +1,58 @@
+import pytest
+
+from mer.planner import CostPlanner, count_tokens
+from mer.prompt import PromptMultiple
+from mer.retrieval import ExampleIndex
+
+
+def test_index_ranks_similar_diffs_first():
+    index = ExampleIndex(
+        [
+            ("I'll see you on Monday.", "I'll see you on Sunday."),
+            ("The cat sat on the mat.", "The cat sat on the hat."),
+            ("Call John tomorrow.", "Call Jon tomorrow."),
+        ]
+    )
+    assert index.rank([("We meet on Monday.", "We meet on Sunday.")])[0] == 0
+    assert index.rank([("Email John.", "Email Jon.")])[0] == 2
+
+
+def test_prompt_only_includes_relevant_examples():
+    full_prompt = PromptMultiple.from_file("./config/prompt_multiple.json")
+    prompt = PromptMultiple.from_file("./config/prompt_multiple.json", num_examples=2)
+    ref, rec = full_prompt.config["examples"][0]["reference"], full_prompt.config["examples"][0]["recognised"]
+
+    prompt_string = prompt.create_prompt(ref, rec)
+    assert prompt_string.count("Reasoning:") == 2 + 1
+    # The labelled example itself is the most relevant so goes nearest the utterance
+    assert prompt_string.split("Reference: ")[-2].startswith(ref)
+    assert len(prompt_string) < len(full_prompt.create_prompt(ref, rec))
+
+    budget_prompt = PromptMultiple.from_file("./config/prompt_multiple.json", example_token_budget=150)
+    assert sum(budget_prompt.example_tokens[i] for i in budget_prompt.select_examples([(ref, rec)])) <= 150
+
+
+def test_plan_matches_retrieved_prompts():
+    prompt = PromptMultiple.from_file("./config/prompt_multiple.json", num_examples=3)
+    planner = CostPlanner(prompt, "text-davinci-002")
+    pairs = [("a b c", f"a b {i}") for i in range(4)] + [("Okay thank you.", "okay thank you")]
+
+    plan = planner.plan(pairs)
+    expected_prompt_tokens = sum(count_tokens(prompt.create_prompt(ref, rec), "text-davinci-002") for ref, rec in pairs)
+    assert plan["prompt_tokens"] == pytest.approx(expected_prompt_tokens, rel=0.02)
+
+
+def test_plan_reuses_selected_examples(monkeypatch):
+    prompt = PromptMultiple.from_file("./config/prompt_multiple.json", num_examples=3)
+    planner = CostPlanner(prompt, "text-davinci-002")
+    pairs = [("a b c", f"a b {i}") for i in range(4)]
+    rankings = []
+    rank = prompt.index.rank
+    monkeypatch.setattr(prompt.index, "rank", lambda *args: rankings.append(args) or rank(*args))
+
+    for pair in pairs:
+        prompt.create_prompt(*pair)
+    prompt.create_batch_prompt(pairs)
+    planner.plan(pairs)
+    planner.plan(pairs, batch_size=4)
+    assert len(rankings) == len(pairs) + 1
@@ -0,0 +1,72 @@
+import json
+import threading
+import urllib.request
+
+import pytest
+
+from mer.cache import ContinuationCache
+from mer.lm import LanguageModel
+from mer.prompt import PromptMultiple
+from mer.service import ScoringService, get_server
+
+
+@pytest.fixture(params=[False, True], ids=["no_cache", "cache"])
+def service_url(stand_in_lm, tmp_path, request):
+    # The cache is opened on this thread but used from the service's event loop thread
+    cache = ContinuationCache(str(tmp_path / "cache.db")) if request.param else None
+    lm = LanguageModel(api_key="test", api_base=stand_in_lm.api_base, cache=cache)
+    prompt = PromptMultiple.from_file("./config/prompt_multiple.json")
+    service = ScoringService(prompt, lm, num_samples=3, batch_size=4, concurrency=4, max_wait=0.2).start()
+    server = get_server(service, port=0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+    service.stop()
+
+
+def post(url, body):
+    request = urllib.request.Request(url, data=json.dumps(body).encode("utf-8"), method="POST")
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+def test_concurrent_requests_coalesced(stand_in_lm, service_url):
+    responses = [None] * 6
+
+    def score(i):
+        # Every request shares one pair with the others and has one of its own
+        examples = [{"reference": "a b c", "recognised": "a b x"}, {"reference": "a b c", "recognised": f"a b {i}"}]
+        responses[i] = post(f"{service_url}/score", {"examples": examples})
+
+    threads = [threading.Thread(target=score, args=(i,)) for i in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for i, response in enumerate(responses):
+        results = response["results"]
+        assert [result["recognised"] for result in results] == ["a b x", f"a b {i}"]
+        assert results[1]["predictions"][0]["reason"] == f'"a b {i}" checked'
+        assert "meaning_error_rate" in results[0] and "wer" in results[0]
+        assert response["summary"]["total_reference_count"] == 6
+    # 7 unique pairs arriving together are packed into batch prompts rather than sent one by one
+    assert stand_in_lm.requests < 7
+
+    single = post(f"{service_url}/score", {"reference": "hello there", "recognised": "hello their"})
+    assert single["results"][0]["recognised"] == "hello their"
+    with urllib.request.urlopen(f"{service_url}/health") as response:
+        stats = json.loads(response.read())["stats"]
+    assert stats["requests"] == 7 and stats["utterances"] == 13
+
+
+def test_cached_responses_reused(stand_in_lm, service_url, request):
+    body = {"examples": [{"reference": "a b c", "recognised": "a b d"}]}
+    first = post(f"{service_url}/score", body)
+    assert stand_in_lm.requests == 1
+    second = post(f"{service_url}/score", body)
+    assert second["results"] == first["results"]
+    # With a cache the second request is answered from it on the service's event loop thread
+    cached = request.node.callspec.params["service_url"]
+    assert stand_in_lm.requests == (1 if cached else 2)
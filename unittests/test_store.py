@@ -0,0 +1,64 @@
+import json
+
+from mer.mer import get_meaning_error_rate
+
+
+def test_new_build_only_scores_changed_pairs(stand_in_lm, tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda _: "Y")
+    store_path = str(tmp_path / "results.db")
+    examples = [{"reference": "a b c d", "recognised": f"a b c {i}"} for i in range(4)]
+
+    get_meaning_error_rate(
+        examples,
+        "./config/prompt_multiple.json",
+        str(tmp_path / "a.json"),
+        api_key="test",
+        api_base=stand_in_lm.api_base,
+        result_store=store_path,
+        build="a",
+    )
+    assert stand_in_lm.requests == 4
+
+    examples[2] = {"reference": "a b c d", "recognised": "a b c d"}
+    meaning_error_rate, _ = get_meaning_error_rate(
+        examples,
+        "./config/prompt_multiple.json",
+        str(tmp_path / "b.json"),
+        api_key="test",
+        api_base=stand_in_lm.api_base,
+        result_store=store_path,
+        build="b",
+        compare_build="a",
+    )
+    # Only the changed utterance is sent to the LM, the rest come from the store
+    assert stand_in_lm.requests == 5
+
+    with open(str(tmp_path / "b.json"), "r", encoding="utf-8") as f:
+        output = json.load(f)
+    assert output["usage"]["stored"] == 3
+    assert output["summary"]["meaning_error_rate"] == meaning_error_rate
+    assert output["summary"]["total_reference_count"] == 16
+
+    with open(str(tmp_path / "b_diff.json"), "r", encoding="utf-8") as f:
+        report = json.load(f)
+    assert report["summary"]["compared"] == 4
+    assert report["summary"]["changed_transcripts"] == 1
+    assert [moved["utterance"] for moved in report["moved"]] == [2]
+    assert report["moved"][0]["wer_diff"] == -25.0
+
+
+def test_store_keyed_by_endpoint(stand_in_lm, tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda _: "Y")
+    store_path = str(tmp_path / "results.db")
+    examples = [{"reference": "a b c d", "recognised": "a b c e"}]
+    for i, api_base in enumerate([stand_in_lm.api_base, stand_in_lm.api_base.replace("127.0.0.1", "localhost")]):
+        get_meaning_error_rate(
+            examples,
+            "./config/prompt_multiple.json",
+            str(tmp_path / f"{i}.json"),
+            api_key="test",
+            api_base=api_base,
+            result_store=store_path,
+        )
+    # Votes stored for one endpoint aren't reused for another
+    assert stand_in_lm.requests == 2
@@ -0,0 +1,30 @@
+import json
+
+from mer.sweep import get_configurations, sweep
+from mer.utils import read_examples
+
+
+def test_sweep_shares_requests(stand_in_lm, tmp_path, monkeypatch):
+    monkeypatch.setattr("builtins.input", lambda _: "Y")
+    examples = list(read_examples("./config/test_multiple.json"))[:6]
+    grid = {
+        "prompt_config_path": ["./config/prompt_multiple.json"],
+        "simple": [False, True],
+        "seed": [10],
+        "model": ["text-davinci-002"],
+        "num_samples": [1, 3],
+    }
+    assert len(get_configurations(grid)) == 4
+    output_json = str(tmp_path / "sweep.json")
+
+    summaries = sweep(examples, grid, output_json, api_key="test", api_base=stand_in_lm.api_base, concurrency=4)
+
+    # Configurations that only differ by num_samples share one request per utterance
+    unique_pairs = len({(example["reference"], example["recognised"]) for example in examples})
+    assert stand_in_lm.requests == 2 * unique_pairs
+    assert all(summary["mean_abs_mer_diff"] is not None for summary in summaries)
+    one_sample, three_samples = summaries[0], summaries[1]
+    assert one_sample["num_samples"] == 1 and three_samples["num_samples"] == 3
+    assert one_sample["cost"] < three_samples["cost"]
+    with open(output_json, "r", encoding="utf-8") as f:
+        assert json.load(f)["usage"]["requests"] == 2 * unique_pairs
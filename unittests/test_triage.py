@@ -0,0 +1,53 @@
+from mer.triage import Triage, words_to_number
+
+
+def test_ignorable_differences():
+    triage = Triage()
+    assert triage.classify("Okay thank you.", "okay thank you") == ["normalisation"]
+    assert triage.classify("I think so", "I um think uh so") == ["filler"]
+    assert triage.classify("I don't know", "I do not know") == ["contraction"]
+    assert triage.classify("I have two hundred and five", "I have 205") == ["number"]
+    assert triage.classify("a well-known fact", "a well known fact") == ["compound"]
+    assert triage.classify("a well known fact", "a Well-known fact") == ["compound", "normalisation"]
+    assert triage.classify("Um, we can't go.", "we cannot go") == ["contraction", "filler", "normalisation"]
+
+
+def test_real_errors_left_for_lm():
+    triage = Triage()
+    assert triage.classify("I have two cats", "I have three cats") is None
+    assert triage.classify("we were there", "we are there") is None
+    assert triage.classify("call me at five", "call me at 50") is None
+    # Only hyphenated compounds can be split or joined, other word boundary changes can change the meaning
+    assert triage.classify("see the rapist now", "see therapist now") is None
+    assert triage.classify("no body came", "nobody came") is None
+    assert triage.classify("ten", "1 0") is None
+    assert triage.classify("two and three", "5") is None
+    # Apostrophes and punctuation count, only case and a missing final full stop are normalisation
+    assert triage.classify("We're here", "were here") is None
+    assert triage.classify("we'll go", "well go") is None
+    assert triage.classify("it's over", "its over") is None
+    assert triage.classify("Let's eat, grandma.", "Let's eat grandma") is None
+    assert triage.classify("Okay, thank you.", "okay thank you") is None
+    # Classes can be turned off
+    assert Triage(["filler"]).classify("I don't know", "I do not know") is None
+
+
+def test_words_to_number():
+    assert words_to_number(["twenty", "one"]) == 21
+    assert words_to_number(["three", "thousand", "and", "two"]) == 3002
+    assert words_to_number(["for"]) is None
+
+
+def test_triage_skips_lm(stand_in_lm, score_with_stand_in):
+    examples = [
+        {"reference": "I don't know.", "recognised": "i do not know"},
+        {"reference": "I have two cats.", "recognised": "I have three cats"},
+        {"reference": "Um, okay.", "recognised": "okay"},
+    ]
+
+    output = score_with_stand_in(examples, triage=True)
+
+    assert stand_in_lm.requests == 1
+    assert [result["resolved_by"] for result in output["results"]] == ["triage", "lm", "triage"]
+    assert output["results"][0]["triage_classes"] == ["contraction", "normalisation"]
+    assert output["usage"]["triaged"] == 2
@@ -0,0 +1,33 @@
+from mer.prompt import PromptMultiple
+from mer.utils import get_samples_needed, majority_voting
+
+
+def test_samples_needed():
+    # Start with the fewest samples that could be a majority
+    assert get_samples_needed([], 3, 6) == 2
+    # Unanimous so the last sample can't change the vote
+    assert get_samples_needed([1.0, 1.0], 3, 6) == 0
+    # Disagreement or parse failure so draw the rest of the budget
+    assert get_samples_needed([1.0, 0.0], 3, 6) == 1
+    assert get_samples_needed([1.0, None], 3, 6) == 1
+    # Tie after the budget is spent so keep going until the cap
+    assert get_samples_needed([1.0, 0.0, None], 3, 6) == 1
+    assert get_samples_needed([1.0, 0.0, None, 0.5, 0.25, None], 3, 6) == 0
+
+
+def test_result_parser():
+    prompt = PromptMultiple.from_file("./config/prompt_multiple.json")
+    counts, penalty = prompt.get_result("Names differ\nResult: 1 minor + 0 standard + 1 serious = 1.25 penalty")
+    assert (counts["minor"], counts["serious"], penalty) == ("1", "1", 1.25)
+    # Cut off before the result line or part way through it
+    assert prompt.get_result("Names differ") == (None, None)
+    assert prompt.get_result("Names differ\nResult: 1 min") == (None, None)
+    assert prompt.is_truncated("Names differ")
+    assert not prompt.is_truncated("Names differ\nResult: garbled")
+
+
+def test_no_parsed_samples_leaves_utterance_unscored():
+    prompt = PromptMultiple.from_file("./config/prompt_multiple.json")
+    assert majority_voting(["Names differ", "Names differ\nResult: 1 min"], prompt) is None
+    penalty, result = majority_voting(["Names differ", "Fine\nResult: 0 minor + 0 standard + 0 serious = 0"], prompt)
+    assert (penalty, result["vote_count"]) == (0.0, 1)
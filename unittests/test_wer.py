@@ -0,0 +1,52 @@
+import json
+
+from mer.run import convert_dbl_to_dict
+from mer.utils import Alignment, calculate_wer
+from mer.wer import calculate_corpus_alignments, calculate_corpus_wer, get_wer_pool, get_word_error_rate
+
+
+def test_pool_matches_serial():
+    pairs = [("the cat sat on the mat.", f"the cat sat on {'a ' * (i % 3)}mat") for i in range(100)]
+    pool = get_wer_pool(2)
+    try:
+        results = calculate_corpus_wer(pairs, pool, chunk_size=8)
+    finally:
+        pool.shutdown()
+    assert results == [calculate_wer(ref, rec) for ref, rec in pairs]
+
+
+def test_wer_from_shared_alignments():
+    pairs = [("the cat  sat on the mat.", f"the cat sat on {'a ' * (i % 3)}mat ") for i in range(100)]
+    normalised = [(" ".join(ref.split()), " ".join(rec.split())) for ref, rec in pairs]
+    pool = get_wer_pool(2)
+    try:
+        alignments = calculate_corpus_alignments(normalised, pool, chunk_size=8)
+    finally:
+        pool.shutdown()
+    # Alignments of the normalised pairs give the same results, still showing each pair's own text
+    assert calculate_corpus_wer(pairs, alignments=alignments) == calculate_corpus_wer(pairs)
+
+
+def test_wer_only_with_dbls(tmp_path):
+    with open("./unittests/data/ref.dbl", "r", encoding="utf-8") as ref_dbl:
+        with open("./unittests/data/rec.dbl", "r", encoding="utf-8") as rec_dbl:
+            examples = list(convert_dbl_to_dict(ref_dbl, rec_dbl))
+    output_json = str(tmp_path / "results.json")
+
+    wer = get_word_error_rate(examples, output_json, processes=2, chunk_size=1)
+
+    with open(output_json, "r", encoding="utf-8") as f:
+        output = json.load(f)
+    assert len(output["results"]) == len(examples)
+    assert output["summary"]["wer"] == round(wer, 2)
+    assert "meaning_error_rate" not in output["summary"]
+
+
+def test_sentences_share_alignment():
+    alignment = Alignment("Hello there. How are you doing today?", "hello their how you doing today")
+    sentences = alignment.get_sentences()
+    assert [sentence.ref_text for sentence in sentences] == ["Hello there.", "How are you doing today?"]
+    assert [sentence.rec_text for sentence in sentences] == ["hello their.", "how you doing today?"]
+    # Sentence error counts come from slices of the whole alignment rather than aligning again
+    assert sum(sentence.errors for sentence in sentences) == alignment.errors
+    assert sentences[1].get_wer() == calculate_wer("How are you doing today?", "how you doing today?")